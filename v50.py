@@ -3,28 +3,2231 @@ from selenium import webdriver
 from selenium.webdriver.common.by import By
 from selenium.webdriver.support.ui import WebDriverWait
 from selenium.webdriver.support import expected_conditions as EC
-from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException, ElementNotInteractableException
+from selenium.common.exceptions import TimeoutException, NoSuchElementException, StaleElementReferenceException, ElementNotInteractableException, WebDriverException
 from selenium.webdriver.common.action_chains import ActionChains
 from selenium.webdriver.common.keys import Keys
 from selenium.webdriver.chrome.options import Options
 import time
 import json
 import os
-from datetime import datetime
+from datetime import datetime, timedelta
 import traceback
 import shutil
+import sys
+import argparse
+import threading
+import queue
+import heapq
+import math
+import re
+import csv
+import hashlib
+from functools import lru_cache
+from urllib.parse import quote, urlparse
+from concurrent.futures import ThreadPoolExecutor
+import sqlite3
+import urllib3
+
+# Parquet/Arrow output and the multithreaded CSV reader are optional
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+    import pyarrow.csv as pacsv
+except ImportError:
+    pa = None
+    pq = None
+    pacsv = None
+
+# ============= TEXT NORMALIZATION =============
+
+# Common character replacements for HTML entities and encoding issues
+TEXT_REPLACEMENTS = {
+    'ÃƒÂ¢Ã¢â€šÂ¬"': '—', # em dash
+    'ÃƒÂ¢Ã¢â€šÂ¬"': '—', # em dash (alternative encoding)
+    'ÃƒÂ¢Ã¢â€šÂ¬Ã‹Å"': ''', # left single quotation mark
+            'ÃƒÂ¢Ã¢â€šÂ¬Ã¢â€žÂ¢': ''', # right single quotation mark
+    'ÃƒÂ¢Ã¢â€šÂ¬Ã…"': '"', # left double quotation mark
+    'ÃƒÂ¢Ã¢â€šÂ¬': '"', # right double quotation mark
+    'ÃƒÂ¢Ã¢â€šÂ¬Ã‚Â¦': '…', # horizontal ellipsis
+    '&amp;': '&', # ampersand
+    '&lt;': '<', # less than
+    '&gt;': '>', # greater than
+    '&quot;': '"', # quotation mark
+    '&#39;': "'", # apostrophe
+}
+
+def build_normalizer_table(replacements):
+    """
+    Turn the ordered replacement dict into (pattern, replacement) pairs for one regex pass.
+    str.replace runs the entries one after another, so a replacement can feed a later entry
+    (e.g. '&amp;lt;' -> '&lt;' -> '<'). Those cascades are folded into the table so a single
+    left-to-right pass gives exactly the same result as the sequential loop.
+    """
+    items = list(replacements.items())
+
+    def apply_from(text, start):
+        for old, new in items[start:]:
+            text = text.replace(old, new)
+        return text
+
+    table = {}
+    for i, (old, new) in enumerate(items):
+        # Outputs whose tail starts a later entry complete it with the text that follows
+        for j in range(i + 1, len(items)):
+            later_old, later_new = items[j]
+            for size in range(1, len(new) + 1):
+                if len(later_old) > size and later_old.startswith(new[-size:]):
+                    composite = old + later_old[size:]
+                    table.setdefault(composite, apply_from(new[:-size], i + 1) + apply_from(later_new, j + 1))
+        table.setdefault(old, apply_from(new, i + 1))
+    return table
+
+NORMALIZER_TABLE = build_normalizer_table(TEXT_REPLACEMENTS)
+NORMALIZER_PATTERN = re.compile('|'.join(re.escape(old) for old in NORMALIZER_TABLE))
+
+@lru_cache(maxsize=65536)
+def normalize_text(text):
+    """Normalize text to handle encoding issues (single regex pass, cached per distinct value)"""
+    if not text:
+        return text
+    return NORMALIZER_PATTERN.sub(lambda match: NORMALIZER_TABLE[match.group(0)], text).strip()
+
+def normalize_text_series(series):
+    """Normalize a whole pandas Series, running normalize_text once per distinct value; NaN stays NaN"""
+    codes, uniques = pd.factorize(series)
+    normalized = pd.Index([normalize_text(str(value)) for value in uniques], dtype=object)
+    return pd.Series(normalized.take(codes, allow_fill=True, fill_value=None), index=series.index, dtype=object)
+
+# ============= INJECTED JAVASCRIPT =============
+
+# Shared helpers for locating the react-select location control and its menu.
+# Prepended to every script that works on the dropdown inside the page.
+DROPDOWN_HELPERS_JS = """
+var CONTROL_SELECTOR = '.css-1pahdxg-control, .css-yk16xz-control';
+function norm(s) { return (s || '').replace(/\\s+/g, ' ').trim(); }
+function findControl() {
+    var control = document.querySelector(CONTROL_SELECTOR);
+    if (control) { return control; }
+    var divs = document.getElementsByTagName('div');
+    for (var i = 0; i < divs.length; i++) {
+        if (divs[i].children.length === 0 && norm(divs[i].textContent) === 'Select...') {
+            return divs[i].closest('[class*="control"]') || divs[i].parentElement;
+        }
+    }
+    return null;
+}
+function findContainer(control) { return control ? (control.parentElement || document) : document; }
+function optionLabelElements(container) {
+    var labels = [];
+    var options = container.querySelectorAll('div[class*="option"]');
+    for (var i = 0; i < options.length; i++) {
+        var span = options[i].querySelector('span.me-2');
+        if (span) {
+            if (labels.indexOf(span) === -1) { labels.push(span); }
+        } else if (!options[i].querySelector('div[class*="option"]')) {
+            labels.push(options[i]);
+        }
+    }
+    return labels;
+}
+function openMenu(control) {
+    var target = control.querySelector('.badge') || control;
+    ['mousedown', 'mouseup', 'click'].forEach(function (type) {
+        target.dispatchEvent(new MouseEvent(type, {bubbles: true, cancelable: true, button: 0}));
+    });
+}
+function searchInput(control) { return control ? control.querySelector('input') : null; }
+function setSearchText(input, text) {
+    // The native setter plus an input event is what React sees as typing
+    Object.getOwnPropertyDescriptor(HTMLInputElement.prototype, 'value').set.call(input, text);
+    input.dispatchEvent(new Event('input', {bubbles: true}));
+}
+function exactLabel(labels, name) {
+    for (var i = 0; i < labels.length; i++) {
+        if (norm(labels[i].textContent) === norm(name)) { return labels[i]; }
+    }
+    return null;
+}
+// Option labels once the menu shows the results for text ([] for 'No options'), null while it has not caught up
+function filteredLabels(text) {
+    var container = findContainer(findControl());
+    if (container.querySelector('[class*="NoOptionsMessage"], [class*="no-options"]')) { return []; }
+    var labels = optionLabelElements(container);
+    if (!labels.length) { return null; }
+    var needle = norm(text).toLowerCase();
+    for (var i = 0; i < labels.length; i++) {
+        if (norm(labels[i].textContent).toLowerCase().indexOf(needle) === -1) { return null; }
+    }
+    return labels;
+}
+// Types text into the search input and calls callback(exact option for name or null, timedOut).
+// If the filtered menu lacks the name (e.g. cut short by virtualization) the full name is searched.
+function searchOption(name, text, timeoutMs, callback) {
+    var input = searchInput(findControl());
+    if (!input) { callback(null, false); return; }
+    setSearchText(input, text);
+    var started = Date.now();
+    (function poll() {
+        var labels = filteredLabels(text);
+        if (labels !== null) {
+            var target = exactLabel(labels, name);
+            if (!target && norm(text) !== norm(name)) { searchOption(name, name, timeoutMs, callback); return; }
+            if (!target) { setSearchText(input, ''); }
+            callback(target, false);
+            return;
+        }
+        if (Date.now() - started > timeoutMs) {
+            setSearchText(input, '');
+            callback(null, true);
+            return;
+        }
+        setTimeout(poll, 25);
+    })();
+}
+function optionIndexState() {
+    var index = window.__marOptionIndex;
+    if (!index) { return null; }
+    return {generation: index.generation, stale: index.stale || !document.contains(index.menu)};
+}
+function selectedLabels(control) {
+    var labels = [];
+    if (!control) { return labels; }
+    var badges = control.querySelectorAll('.badge');
+    for (var i = 0; i < badges.length; i++) {
+        var text = norm(badges[i].textContent).replace(/\\s*\\u00d7$/, '');
+        if (text) { labels.push(text); }
+    }
+    return labels;
+}
+function allUnitsShown() {
+    return !!document.evaluate("//span[text()='All units']", document, null,
+        XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+}
+function signature() { return (allUnitsShown() ? 'ALL|' : '') + selectedLabels(findControl()).join('|'); }
+"""
+
+# Clicks every requested option in a single async call. With search texts each name is typed
+# into the search input and picked from the filtered menu; otherwise the menu is opened and scanned.
+# A click only counts as 'selected' once the name's badge appears (or the control switches to
+# 'All units'); a click the control does not register within the timeout is 'not_registered'.
+# arguments: [names, per-step timeout in ms, {name: search text} or null]
+# Resolves to {results: {name: status}, search_disabled: bool}
+BATCH_SELECT_SCRIPT = DROPDOWN_HELPERS_JS + """
+var names = arguments[0];
+var timeoutMs = arguments[1];
+var searchTexts = arguments[2] || null;
+var done = arguments[arguments.length - 1];
+var results = {};
+var searchDisabled = false;
+
+// Click an option, then wait for the control to show the name's badge and record the outcome
+function pick(name, target, callback) {
+    var before = signature();
+    var started = Date.now();
+    target.click();
+    (function confirm() {
+        var now = signature();
+        if (selectedLabels(findControl()).indexOf(norm(name)) !== -1 ||
+                (now !== before && now.indexOf('ALL|') === 0)) {
+            results[name] = 'selected';
+            callback();
+            return;
+        }
+        if (Date.now() - started > timeoutMs) {
+            results[name] = 'not_registered';
+            callback();
+            return;
+        }
+        setTimeout(confirm, 25);
+    })();
+}
+
+function waitForOptions(control, started, callback) {
+    var labels = optionLabelElements(findContainer(control));
+    if (labels.length > 0) { callback(labels); return; }
+    if (Date.now() - started > timeoutMs) { callback(null); return; }
+    setTimeout(function () { waitForOptions(control, started, callback); }, 25);
+}
+
+function step(index) {
+    if (index >= names.length) { done({results: results, search_disabled: searchDisabled}); return; }
+    var name = names[index];
+    var control = findControl();
+    if (!control) { done({error: 'dropdown control not found', results: results, search_disabled: searchDisabled}); return; }
+    if (name in results) { step(index + 1); return; }
+    // With 'All units' shown the badges are hidden, and clicking an option would deselect it
+    if (allUnitsShown() || selectedLabels(control).indexOf(norm(name)) !== -1) {
+        results[name] = 'already_selected';
+        step(index + 1);
+        return;
+    }
+    if (searchTexts && searchInput(control)) {
+        searchOption(name, searchTexts[name] || name, timeoutMs, function (target, timedOut) {
+            if (timedOut) {
+                // Typing does not filter this control: scan the open menu instead from here on
+                searchTexts = null;
+                searchDisabled = true;
+                step(index);
+                return;
+            }
+            if (!target) {
+                results[name] = 'not_found';
+                setTimeout(function () { step(index + 1); }, 0);
+                return;
+            }
+            pick(name, target, function () { step(index + 1); });
+        });
+        return;
+    }
+    var go = function (labels) {
+        if (!labels) { done({error: 'dropdown menu did not open', results: results, search_disabled: searchDisabled}); return; }
+        var target = exactLabel(labels, name);
+        if (!target) {
+            results[name] = 'not_found';
+            setTimeout(function () { step(index + 1); }, 0);
+            return;
+        }
+        pick(name, target, function () { step(index + 1); });
+    };
+    if (optionLabelElements(findContainer(control)).length === 0) { openMenu(control); }
+    waitForOptions(control, Date.now(), go);
+}
+
+try { step(0); } catch (e) { done({error: String(e), results: results, search_disabled: searchDisabled}); }
+"""
+
+# Reads the whole multi-select state in one call: selected labels, 'All units' badge,
+# menu open state and the element to click to open the dropdown.
+SELECTION_STATE_SCRIPT = DROPDOWN_HELPERS_JS + """
+var control = findControl();
+var labels = selectedLabels(control);
+var allUnits = document.evaluate("//span[text()='All units']", document, null,
+    XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+var anchor = null;
+var anchorText = null;
+if (allUnits) {
+    anchor = allUnits.parentElement;
+    anchorText = 'All units';
+} else if (control) {
+    var spans = control.getElementsByTagName('span');
+    for (var i = 0; i < spans.length && labels.length; i++) {
+        if (norm(spans[i].textContent) === labels[0] && spans[i].parentElement.tagName === 'DIV') {
+            anchor = spans[i].parentElement;
+            anchorText = labels[0];
+            break;
+        }
+    }
+    if (!anchor) {
+        var divs = control.getElementsByTagName('div');
+        for (var j = 0; j < divs.length; j++) {
+            if (divs[j].children.length === 0 && norm(divs[j].textContent) === 'Select...') {
+                anchor = divs[j];
+                break;
+            }
+        }
+    }
+    anchor = anchor || control;
+}
+return {
+    control_found: !!control,
+    selected: labels.filter(function (label) { return label !== 'All units'; }),
+    all_units: !!allUnits,
+    menu_open: optionLabelElements(findContainer(control)).length > 0,
+    option_index: optionIndexState(),
+    anchor: anchor,
+    anchor_text: anchorText
+};
+"""
+
+# Collects every option label of the dropdown, scrolling through virtualized menus.
+# arguments: [timeout in ms]; resolves to {labels: [...]} (plus error if the menu did not open)
+LABEL_SNAPSHOT_SCRIPT = DROPDOWN_HELPERS_JS + """
+var timeoutMs = arguments[0];
+var done = arguments[arguments.length - 1];
+var control = findControl();
+if (!control) { done({error: 'dropdown control not found', labels: []}); return; }
+var input = searchInput(control);
+if (input && input.value) { setSearchText(input, ''); }
+if (!optionLabelElements(findContainer(control)).length) { openMenu(control); }
+var seen = {};
+var labels = [];
+var started = Date.now();
+
+function collect() {
+    var elements = optionLabelElements(findContainer(findControl()));
+    for (var i = 0; i < elements.length; i++) {
+        var label = norm(elements[i].textContent);
+        if (label && !seen.hasOwnProperty(label)) {
+            seen[label] = true;
+            labels.push(label);
+        }
+    }
+    return elements;
+}
+function scroller(elements) {
+    var node = elements[0].parentElement;
+    while (node && node !== document.body) {
+        if (node.scrollHeight > node.clientHeight + 1) { return node; }
+        node = node.parentElement;
+    }
+    return null;
+}
+function scan(list, lastTop) {
+    collect();
+    if (list.scrollTop === lastTop || list.scrollTop + list.clientHeight >= list.scrollHeight - 1 ||
+            Date.now() - started > timeoutMs) {
+        list.scrollTop = 0;
+        done({labels: labels});
+        return;
+    }
+    var top = list.scrollTop;
+    list.scrollTop = top + Math.max(1, list.clientHeight - 40);
+    setTimeout(function () { scan(list, top); }, 50);
+}
+(function waitForMenu() {
+    var elements = collect();
+    if (elements.length) {
+        var list = scroller(elements);
+        if (list) { scan(list, -1); } else { done({labels: labels}); }
+        return;
+    }
+    if (Date.now() - started > timeoutMs) { done({error: 'dropdown menu did not open', labels: labels}); return; }
+    setTimeout(waitForMenu, 25);
+})();
+"""
+
+# Resolves one option through the search input.
+# arguments: [name, search text, timeout in ms]; resolves to {status, element}
+# status: found, not_found, no_input (the control has no search input) or timeout (typing did not filter)
+SEARCH_OPTION_SCRIPT = DROPDOWN_HELPERS_JS + """
+var name = arguments[0];
+var text = arguments[1];
+var timeoutMs = arguments[2];
+var done = arguments[arguments.length - 1];
+if (!searchInput(findControl())) { done({status: 'no_input', element: null}); return; }
+try {
+    searchOption(name, text, timeoutMs, function (target, timedOut) {
+        done({status: target ? 'found' : (timedOut ? 'timeout' : 'not_found'), element: target});
+    });
+} catch (e) { done({status: 'error', error: String(e), element: null}); }
+"""
+
+# Snapshots the options of the open menu in one call and watches the menu for re-renders:
+# added/removed option nodes, changed text or the menu closing mark the snapshot stale
+# (reported by optionIndexState). Returns {generation, labels, elements}.
+OPTION_INDEX_SCRIPT = DROPDOWN_HELPERS_JS + """
+var labels = optionLabelElements(findContainer(findControl()));
+var previous = window.__marOptionIndex;
+if (previous && previous.observer) { previous.observer.disconnect(); }
+var index = {generation: (previous ? previous.generation : 0) + 1, stale: labels.length === 0, menu: null, observer: null};
+window.__marOptionIndex = index;
+if (labels.length) {
+    index.menu = labels[0].closest('[class*="menu"]') || labels[0].parentElement;
+    index.observer = new MutationObserver(function () {
+        index.stale = true;
+        index.observer.disconnect();
+    });
+    index.observer.observe(index.menu, {childList: true, subtree: true, characterData: true});
+}
+return {
+    generation: index.generation,
+    labels: labels.map(function (label) { return norm(label.textContent); }),
+    elements: labels
+};
+"""
+
+# Waits on a MutationObserver until the dropdown reaches the requested condition.
+# arguments: [condition, param, timeout in ms, element to click first (optional)]
+# Conditions: menu_open, menu_closed, selection_changed, selection_empty,
+# selection_nonempty, all_units, xpath_present, dom_quiet (param = quiet ms).
+# Resolves to {reached: bool, elapsed: ms}.
+WAIT_FOR_STATE_SCRIPT = DROPDOWN_HELPERS_JS + """
+var condition = arguments[0];
+var param = arguments[1];
+var timeoutMs = arguments[2];
+var clickTarget = arguments[3];
+var done = arguments[arguments.length - 1];
+var started = Date.now();
+
+function menuOpen() { return optionLabelElements(findContainer(findControl())).length > 0; }
+
+var baseline = signature();
+var checks = {
+    menu_open: menuOpen,
+    menu_closed: function () { return !menuOpen(); },
+    selection_changed: function () { return signature() !== baseline; },
+    selection_empty: function () { return signature() === ''; },
+    selection_nonempty: function () { return signature() !== ''; },
+    all_units: function () { return signature().indexOf('ALL|') === 0; },
+    xpath_present: function () {
+        return !!document.evaluate(param, document, null, XPathResult.FIRST_ORDERED_NODE_TYPE, null).singleNodeValue;
+    },
+    dom_quiet: function () { return false; }
+};
+var check = checks[condition];
+if (!check) { done({reached: false, error: 'unknown condition ' + condition}); return; }
+
+var finished = false;
+var observer = null;
+var quietTimer = null;
+var deadline = null;
+function finish(reached) {
+    if (finished) { return; }
+    finished = true;
+    if (observer) { observer.disconnect(); }
+    clearTimeout(quietTimer);
+    clearTimeout(deadline);
+    done({reached: reached, elapsed: Date.now() - started});
+}
+function armQuietTimer() {
+    clearTimeout(quietTimer);
+    quietTimer = setTimeout(function () { finish(true); }, param || 200);
+}
+
+if (clickTarget) { clickTarget.click(); }
+if (check()) { finish(true); return; }
+
+observer = new MutationObserver(function () {
+    if (condition === 'dom_quiet') { armQuietTimer(); return; }
+    if (check()) { finish(true); }
+});
+observer.observe(document.documentElement, {childList: true, subtree: true, attributes: true, characterData: true});
+if (condition === 'dom_quiet') { armQuietTimer(); }
+deadline = setTimeout(function () { finish(check()); }, timeoutMs);
+"""
+
+# ============= REPORT API REPLAY =============
+
+# Date formats the report request may carry the From/To dates in
+REPORT_DATE_FORMATS = ['%d/%m/%Y', '%Y-%m-%d', '%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M:%S.%fZ',
+                       '%Y-%m-%dT%H:%M:%SZ', '%Y-%m-%dT%H:%M:%S.%f', '%d-%m-%Y']
+
+# Captured request headers that must not be replayed as-is
+REPLAY_SKIP_HEADERS = {'content-length', 'host', 'connection', 'cookie'}
+
+def walk_json(value, path=()):
+    """Yield (path, value) for every node of a parsed JSON document"""
+    yield path, value
+    if isinstance(value, dict):
+        for key, item in value.items():
+            yield from walk_json(item, path + (key,))
+    elif isinstance(value, list):
+        for index, item in enumerate(value):
+            yield from walk_json(item, path + (index,))
+
+def set_json_path(document, path, value):
+    target = document
+    for key in path[:-1]:
+        target = target[key]
+    target[path[-1]] = value
+
+# Words in a date field's key that say which end of the range it holds
+DATE_ROLE_WORDS = {'from': {'from', 'start', 'begin'}, 'to': {'to', 'end', 'until'}}
+
+def date_role_from_key(path):
+    """'from' or 'to' from the nearest key naming a date field (fromDate, end_date, ...), or None"""
+    key = next((key for key in reversed(path) if isinstance(key, str)), "")
+    words = {word.lower() for word in re.findall(r'[A-Z]?[a-z]+|[A-Z]+(?![a-z])', key)}
+    roles = [role for role, role_words in DATE_ROLE_WORDS.items() if words & role_words]
+    return roles[0] if len(roles) == 1 else None
+
+def build_report_request_template(url, method, headers, post_data, probe_name, from_date, to_date):
+    """
+    Work out where a captured report request carries the location names and the dates.
+    The request must have been made with probe_name as the only selected location and
+    from_date/to_date (DD/MM/YYYY) in the date inputs.
+    Returns a template dict for fill_report_request_body, or None if the body cannot be mapped.
+    """
+    try:
+        body = json.loads(post_data)
+    except (TypeError, ValueError):
+        print("Captured report request does not have a JSON body.")
+        return None
+
+    # The location list is the array of strings that contains the probe name
+    name_paths = [path for path, value in walk_json(body)
+                  if isinstance(value, list) and probe_name in value and all(isinstance(item, str) for item in value)]
+    if not name_paths:
+        print(f"Could not find '{probe_name}' in a list of names in the captured request.")
+        return None
+
+    wanted = {'from': datetime.strptime(from_date, "%d/%m/%Y").date(), 'to': datetime.strptime(to_date, "%d/%m/%Y").date()}
+    date_slots = []
+    for path, value in walk_json(body):
+        if not isinstance(value, str):
+            continue
+        for date_format in REPORT_DATE_FORMATS:
+            try:
+                parsed = datetime.strptime(value, date_format)
+            except ValueError:
+                continue
+            role = next((role for role, date in wanted.items() if date == parsed.date()), None)
+            if role:
+                date_slots.append({'path': list(path), 'role': role, 'format': date_format, 'original': value})
+            break
+
+    if not date_slots:
+        print(f"Could not find the report dates ({from_date} to {to_date}) in the captured request.")
+        return None
+
+    # With From = To every slot matched 'from'; tell them apart by key name, else by order (From comes first)
+    if wanted['from'] == wanted['to']:
+        for slot in date_slots:
+            slot['role'] = date_role_from_key(slot['path'])
+        if len(date_slots) == 2 and not any(slot['role'] for slot in date_slots):
+            date_slots[0]['role'], date_slots[1]['role'] = 'from', 'to'
+        roles = {slot['role'] for slot in date_slots}
+        if None in roles or roles != {'from', 'to'}:
+            print("The captured request was made with the same From and To date and its date fields cannot be "
+                  "told apart - capture it again with a range of more than one day.")
+            return None
+
+    return {
+        'url': url,
+        'method': method,
+        'headers': {name: value for name, value in headers.items()
+                    if name.lower() not in REPLAY_SKIP_HEADERS and not name.startswith(':')},
+        'body': body,
+        'name_paths': [list(path) for path in name_paths],
+        'date_slots': date_slots
+    }
+
+def fill_report_request_body(template, names, from_date, to_date):
+    """Return the JSON body of the template's report request for other names and dates"""
+    body = json.loads(json.dumps(template['body']))
+    for path in template['name_paths']:
+        set_json_path(body, path, list(names))
+
+    dates = {'from': datetime.strptime(from_date, "%d/%m/%Y"), 'to': datetime.strptime(to_date, "%d/%m/%Y")}
+    for slot in template['date_slots']:
+        # Keep the time of day the page sent (e.g. 23:59:59 on the To date)
+        original = datetime.strptime(slot['original'], slot['format'])
+        date = dates[slot['role']]
+        value = original.replace(year=date.year, month=date.month, day=date.day).strftime(slot['format'])
+        if slot['format'].endswith('.%fZ'):
+            value = value[:-4] + 'Z' # JavaScript toISOString() sends milliseconds
+        set_json_path(body, slot['path'], value)
+    return json.dumps(body)
+
+def report_payload_to_frame(payload):
+    """
+    Turn a report API response into a DataFrame. Understands {columns, rows},
+    a list of row objects, or an object holding a list of row objects.
+    """
+    if isinstance(payload, dict) and 'columns' in payload and 'rows' in payload:
+        columns = [column['headerName'] if isinstance(column, dict) and 'headerName' in column else column
+                   for column in payload['columns']]
+        return pd.DataFrame(payload['rows'], columns=columns)
+    if isinstance(payload, list):
+        return pd.DataFrame(payload)
+    if isinstance(payload, dict):
+        for value in payload.values():
+            if isinstance(value, list) and (not value or isinstance(value[0], dict)):
+                return pd.DataFrame(value)
+    raise ValueError("Unrecognised report response format")
+
+# ============= ADAPTIVE CHUNK SIZING =============
+
+class AdaptiveChunkScheduler:
+    """
+    Picks the size of upcoming chunks so each report takes about target_seconds.
+    Report time is modelled as overhead_seconds + row_cost * expected rows, where row_cost (seconds
+    per CSV row) is a running average over chunks whose row count is known, and the expected rows
+    of a chunk come from its locations' row count history (or the rows per location per day seen so far).
+    Until a row count is known, cost (seconds per location per day of the date range) is used instead.
+    A timed-out report raises the estimates straight away instead of averaging them in.
+    """
+
+    def __init__(self, days, target_seconds=30.0, initial_size=50, min_size=5, max_size=200,
+                 overhead_seconds=3.0, smoothing=0.5, state=None):
+        self.days = max(1, days)
+        self.target_seconds = target_seconds
+        self.initial_size = initial_size
+        self.min_size = min_size
+        self.max_size = max_size
+        self.overhead_seconds = overhead_seconds
+        self.smoothing = smoothing
+        self.cost = None
+        self.row_cost = None
+        self.row_density = None
+        self.history = []
+        if state:
+            self.cost = state.get('cost')
+            self.row_cost = state.get('row_cost')
+            self.row_density = state.get('row_density')
+            self.history = state.get('history', [])
+
+    def average(self, estimate, sample, timed_out=False):
+        if timed_out:
+            # The real time is unknown but at least this long - never let it pull the estimate down
+            return max(estimate or 0, sample)
+        if estimate is None:
+            return sample
+        return (1 - self.smoothing) * estimate + self.smoothing * sample
+
+    def record(self, locations, seconds, rows=None, timed_out=False):
+        """Add one chunk's measured report time (and CSV row count, if known) to the estimates"""
+        if not locations or seconds is None:
+            return
+        busy = max(seconds - self.overhead_seconds, 0.1)
+        self.cost = self.average(self.cost, busy / (locations * self.days), timed_out)
+        if rows and not timed_out:
+            self.row_cost = self.average(self.row_cost, busy / rows)
+            self.row_density = self.average(self.row_density, rows / (locations * self.days))
+        elif timed_out and self.row_cost is not None:
+            self.row_cost = self.average(self.row_cost, busy / (locations * self.days * self.row_density), True)
+        self.history.append({'locations': locations, 'seconds': round(seconds, 2), 'rows': rows, 'timed_out': timed_out})
+
+    def next_size(self, current_size=None, rows_per_location=None):
+        """
+        Chunk size expected to hit target_seconds, growing by at most 2x per step.
+        rows_per_location is the expected rows per location per day of the upcoming locations, if known.
+        """
+        if self.row_cost is not None:
+            cost = self.row_cost * (rows_per_location or self.row_density)
+        elif self.cost is not None:
+            cost = self.cost
+        else:
+            return self.initial_size
+        size = int((self.target_seconds - self.overhead_seconds) / (cost * self.days))
+        if current_size:
+            size = min(size, current_size * 2)
+        return max(self.min_size, min(self.max_size, size))
+
+    def state(self):
+        return {'cost': self.cost, 'row_cost': self.row_cost, 'row_density': self.row_density,
+                'history': self.history[-50:]}
+
+# ============= COST-BALANCED CHUNK PACKING =============
+
+class LocationRowCounts:
+    """
+    Persisted table of past MAR row counts per location, used to pack chunks of similar report size.
+    Stored as JSON keyed by normalized Location Name; the Business ID is recorded with each entry for
+    reference only, since one Business ID covers many locations. Counts are kept as rows per day of the
+    report range.
+    """
+
+    def __init__(self, path, smoothing=0.5):
+        self.path = path
+        self.smoothing = smoothing
+        self.locations = {}
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    self.locations = json.load(f).get('locations', {})
+            except (OSError, ValueError) as e:
+                print(f"Could not read row count table '{path}': {e}")
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'updated_at': datetime.now().isoformat(), 'locations': self.locations}, f, indent=2)
+        except OSError as e:
+            print(f"Error saving row count table: {e}")
+
+    def update(self, counts, days, business_ids=None):
+        """Blend one run's {location: rows} (for a days-long date range) into the table"""
+        business_ids = business_ids or {}
+        for name, rows in counts.items():
+            observed = rows / max(1, days)
+            entry = self.locations.get(name)
+            if entry:
+                entry['rows_per_day'] = (1 - self.smoothing) * entry['rows_per_day'] + self.smoothing * observed
+                entry['observations'] += 1
+            else:
+                entry = self.locations[name] = {'rows_per_day': observed, 'observations': 1}
+            if business_ids.get(name):
+                entry['business_id'] = business_ids[name]
+            entry['updated_at'] = datetime.now().isoformat()
+
+    def rows_per_day(self, name):
+        entry = self.locations.get(name)
+        return entry['rows_per_day'] if entry else None
+
+    def expected_rows(self, names, days):
+        """Expected report rows per name; locations without history get the median of those with it"""
+        known = [self.rows_per_day(name) for name in names]
+        history = sorted(rate for rate in known if rate is not None)
+        default = history[len(history) // 2] if history else 1.0
+        return [(rate if rate is not None else default) * days for rate in known]
+
+def pack_balanced_chunks(names, costs, chunk_count, max_items):
+    """
+    Longest-processing-time-first bin packing: assign the most expensive names first,
+    each to the chunk with the lowest expected cost that still has room.
+    Returns lists of indexes into names, each kept in the original file order.
+    """
+    chunk_count = max(1, min(chunk_count, len(names)))
+    max_items = max(max_items, math.ceil(len(names) / chunk_count))
+    bins = [[] for _ in range(chunk_count)]
+    heap = [(0.0, index) for index in range(chunk_count)]
+    for item in sorted(range(len(names)), key=lambda i: costs[i], reverse=True):
+        full = []
+        load, index = heapq.heappop(heap)
+        while len(bins[index]) >= max_items:
+            full.append((load, index))
+            load, index = heapq.heappop(heap)
+        bins[index].append(item)
+        heapq.heappush(heap, (load + costs[item], index))
+        for entry in full:
+            heapq.heappush(heap, entry)
+    return sorted((sorted(chunk) for chunk in bins if chunk), key=lambda chunk: chunk[0])
+
+def count_rows_per_location(merged_file_path, read_chunk_rows=100000):
+    """
+    Count a consolidated report's rows per normalized Care Service.
+    Returns ({location: rows}, {location: Business ID}); raises ValueError without a 'Care Service' column.
+    """
+    header = pd.read_csv(merged_file_path, nrows=0).columns
+    if 'Care Service' not in header:
+        raise ValueError("no 'Care Service' column")
+    columns = ['Care Service'] + (['Business ID'] if 'Business ID' in header else [])
+
+    counts = {}
+    business_ids = {}
+    for df in pd.read_csv(merged_file_path, usecols=columns, chunksize=read_chunk_rows, dtype=str):
+        services = normalize_text_series(df['Care Service'].dropna())
+        for service, count in services.value_counts().items():
+            counts[service] = counts.get(service, 0) + int(count)
+        if 'Business ID' in df.columns:
+            business_ids.update((service, bid) for service, bid in zip(services, df.loc[services.index, 'Business ID'])
+                                if isinstance(bid, str))
+    return counts, business_ids
+
+def update_location_row_counts(row_counts_file, merged_files, days, names=None):
+    """
+    Blend the row counts of consolidated reports covering a days-long date range into the table.
+    names (if given) are the locations that were requested; any without rows are recorded as empty.
+    """
+    counts = dict.fromkeys(names or [], 0)
+    business_ids = {}
+    for merged_file_path in merged_files:
+        try:
+            file_counts, file_business_ids = count_rows_per_location(merged_file_path)
+        except Exception as e:
+            print(f"Could not count rows in '{merged_file_path}': {e}")
+            continue
+        for name, count in file_counts.items():
+            counts[name] = counts.get(name, 0) + count
+        business_ids.update(file_business_ids)
+
+    if not counts:
+        return
+    table = LocationRowCounts(row_counts_file)
+    table.update(counts, days, business_ids)
+    table.save()
+    print(f"Row count table updated for {len(counts)} locations ({row_counts_file})")
+
+# ============= INCREMENTAL STORE =============
+
+def parse_report_dates(values):
+    """Parse MAR date strings (DD/MM/YYYY, optionally followed by a time) into a datetime Series, NaT if unparseable"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        return pd.Series(values) # already parsed by MarReportReader
+    values = pd.Series(values, dtype=object).astype(str).str.strip()
+    dates = pd.to_datetime(values.str.slice(0, 10), format="%d/%m/%Y", errors='coerce')
+    missing = dates.isna() & values.ne('') & values.ne('nan')
+    if missing.any():
+        dates[missing] = pd.to_datetime(values[missing], dayfirst=True, errors='coerce')
+    return dates
+
+class IncrementalStore:
+    """
+    Persistent MAR store for incremental runs, kept as one CSV per month (mar_YYYY_MM.csv, plus
+    mar_undated.csv for rows without a usable date) next to incremental_state.json.
+    The state holds each location's high-water mark: 'through' is the last day of the newest report
+    window merged for it and 'latest_row' the newest date seen in its rows. Region marks are the
+    oldest 'through' of the region's locations.
+    """
+
+    STATE_FILE = "incremental_state.json"
+
+    def __init__(self, directory, date_column=None):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+        self.state_path = os.path.join(directory, self.STATE_FILE)
+        self.state = {'date_column': date_column, 'columns': [], 'locations': {}, 'regions': {}}
+        if os.path.exists(self.state_path):
+            try:
+                with open(self.state_path, 'r') as f:
+                    self.state.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Could not read incremental state '{self.state_path}': {e}")
+        if date_column:
+            self.state['date_column'] = date_column
+
+    def save(self):
+        self.state['updated_at'] = datetime.now().isoformat()
+        temp_path = self.state_path + ".tmp"
+        with open(temp_path, 'w') as f:
+            json.dump(self.state, f, indent=2)
+        os.replace(temp_path, self.state_path)
+
+    def through(self, name):
+        entry = self.state['locations'].get(name)
+        return datetime.strptime(entry['through'], "%d/%m/%Y") if entry else None
+
+    def plan_windows(self, names, to_date, overlap_days=2, default_from_date="01/09/2024", merge_days=7):
+        """
+        Group names into (from_date, names) report windows ending at to_date.
+        Each location starts overlap_days before its high-water mark (or at default_from_date if it has none);
+        locations whose start dates are within merge_days of each other share the earliest start.
+        Locations already covered through to_date are left out.
+        """
+        end = datetime.strptime(to_date, "%d/%m/%Y")
+        default_start = datetime.strptime(default_from_date, "%d/%m/%Y")
+        starts = {}
+        for name in names:
+            through = self.through(name)
+            if through is None:
+                starts[name] = default_start
+            elif through < end:
+                starts[name] = min(end, max(default_start, through - timedelta(days=overlap_days)))
+
+        windows = []
+        for name in sorted(starts, key=lambda n: starts[n]):
+            if windows and (starts[name] - windows[-1][0]).days <= merge_days:
+                windows[-1][1].append(name)
+            else:
+                windows.append((starts[name], [name]))
+        # Keep each window's names in the file order so chunking behaves as in a full run
+        order = {name: i for i, name in enumerate(names)}
+        return [(start.strftime("%d/%m/%Y"), sorted(window, key=order.get)) for start, window in windows]
+
+    def detect_date_column(self, columns):
+        """The configured date column, else the first column with 'date' in its name"""
+        column = find_date_column(columns, self.state.get('date_column'))
+        if column is None:
+            raise ValueError(f"no date column found in {list(columns)} - set the date column explicitly")
+        if column != self.state.get('date_column'):
+            self.state['date_column'] = column
+            print(f"Using '{column}' as the incremental date column")
+        return column
+
+    def partition_name(self, date):
+        return "mar_undated.csv" if pd.isna(date) else f"mar_{date.year:04d}_{date.month:02d}.csv"
+
+    def merge(self, merged_file, from_date, to_date, names, read_chunk_rows=50000):
+        """
+        Merge one consolidated report covering from_date..to_date into the store.
+        Stored rows of the reported locations (names plus any Care Service in the new rows) dated inside
+        the window are replaced by the new rows, so the overlap with the previous run is not duplicated.
+        Returns {location: newest row date} for the new rows.
+        """
+        start = datetime.strptime(from_date, "%d/%m/%Y")
+        end = datetime.strptime(to_date, "%d/%m/%Y") + timedelta(days=1)
+        header = pd.read_csv(merged_file, nrows=0).columns.tolist()
+        if 'Care Service' not in header:
+            raise ValueError("no 'Care Service' column in the consolidated report")
+        date_column = self.detect_date_column(header)
+        for column in header:
+            if column not in self.state['columns']:
+                self.state['columns'].append(column)
+        columns = self.state['columns']
+
+        # Split the new rows into per-partition staging files
+        staging_dir = os.path.join(self.directory, "_staging")
+        shutil.rmtree(staging_dir, ignore_errors=True)
+        os.makedirs(staging_dir)
+        staged = set()
+        replaced_names = set(names)
+        latest = {}
+        new_rows = 0
+        for df in pd.read_csv(merged_file, chunksize=read_chunk_rows, dtype=str, keep_default_na=False):
+            services = normalize_text_series(df['Care Service'])
+            dates = parse_report_dates(df[date_column])
+            replaced_names.update(services.unique())
+            for service, newest in dates.groupby(services).max().dropna().items():
+                if service not in latest or newest > latest[service]:
+                    latest[service] = newest
+            partitions = dates.map(self.partition_name)
+            for partition, rows in df.groupby(partitions, sort=False):
+                staging_path = os.path.join(staging_dir, partition)
+                rows.reindex(columns=columns).to_csv(staging_path, mode='a', header=partition not in staged, index=False)
+                staged.add(partition)
+            new_rows += len(df)
+
+        # Every month the window touches is rewritten, even if it gained no rows
+        month = datetime(start.year, start.month, 1)
+        touched = set(staged)
+        while month < end:
+            touched.add(self.partition_name(month))
+            month = datetime(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+        removed_rows = 0
+        for partition in sorted(touched):
+            store_path = os.path.join(self.directory, partition)
+            staging_path = os.path.join(staging_dir, partition)
+            if not os.path.exists(store_path) and partition not in staged:
+                continue
+            temp_path = store_path + ".tmp"
+            if partition == "mar_undated.csv":
+                # Undated rows cannot be placed in a window, so only exact repeats are dropped
+                frames = [pd.read_csv(path, dtype=str, keep_default_na=False)
+                          for path in (store_path, staging_path) if os.path.exists(path)]
+                undated = pd.concat(frames, ignore_index=True).reindex(columns=columns).fillna('')
+                deduplicated = undated.drop_duplicates()
+                removed_rows += len(undated) - len(deduplicated)
+                deduplicated.to_csv(temp_path, index=False)
+                os.replace(temp_path, store_path)
+                continue
+            with open(temp_path, 'w', newline='', encoding='utf-8') as out:
+                header_written = False
+                if os.path.exists(store_path):
+                    for df in pd.read_csv(store_path, chunksize=read_chunk_rows, dtype=str, keep_default_na=False):
+                        dates = parse_report_dates(df[date_column])
+                        keep = ~(normalize_text_series(df['Care Service']).isin(replaced_names) &
+                                 (dates >= start) & (dates < end))
+                        removed_rows += int((~keep).sum())
+                        df[keep].reindex(columns=columns).to_csv(out, header=not header_written, index=False)
+                        header_written = True
+                if partition in staged:
+                    for df in pd.read_csv(staging_path, chunksize=read_chunk_rows, dtype=str, keep_default_na=False):
+                        df.reindex(columns=columns).to_csv(out, header=not header_written, index=False)
+                        header_written = True
+                if not header_written:
+                    pd.DataFrame(columns=columns).to_csv(out, index=False)
+            os.replace(temp_path, store_path)
+        shutil.rmtree(staging_dir, ignore_errors=True)
+
+        print(f"Incremental store: {new_rows} rows merged for {from_date} - {to_date}, "
+              f"{removed_rows} overlapping rows replaced ({len(touched)} partitions)")
+        return latest
+
+    def advance(self, names, to_date, latest=None, region_of=None):
+        """Move the high-water marks of names (locations fully extracted through to_date) forward"""
+        latest = latest or {}
+        end = datetime.strptime(to_date, "%d/%m/%Y")
+        locations = self.state['locations']
+        for name in names:
+            entry = locations.setdefault(name, {})
+            through = self.through(name)
+            entry['through'] = max(end, through).strftime("%d/%m/%Y") if through else to_date
+            if name in latest:
+                newest = latest[name].strftime("%d/%m/%Y")
+                if not entry.get('latest_row') or latest[name] > datetime.strptime(entry['latest_row'], "%d/%m/%Y"):
+                    entry['latest_row'] = newest
+            if region_of and region_of.get(name):
+                entry['region'] = region_of[name]
+
+        regions = {}
+        for name, entry in locations.items():
+            if entry.get('region'):
+                through = datetime.strptime(entry['through'], "%d/%m/%Y")
+                regions[entry['region']] = min(regions.get(entry['region'], through), through)
+        self.state['regions'] = {region: through.strftime("%d/%m/%Y") for region, through in sorted(regions.items())}
+
+    def read(self, columns=None):
+        """Load the whole store (or some columns) as one DataFrame, oldest month first"""
+        partitions = sorted(f for f in os.listdir(self.directory) if f.startswith("mar_") and f.endswith(".csv"))
+        usecols = (lambda column: column in columns) if columns else None
+        frames = [pd.read_csv(os.path.join(self.directory, f), dtype=str, keep_default_na=False, usecols=usecols)
+                  for f in partitions]
+        return pd.concat(frames, ignore_index=True) if frames else pd.DataFrame(columns=columns or self.state['columns'])
+
+# ============= DATE-RANGE SHARDING =============
+
+SHARD_FILE_PATTERN = re.compile(r"shard_(\d{8})-(\d{8})_chunk_(\d+)")
+
+def split_date_range(from_date, to_date, shard):
+    """
+    Split a DD/MM/YYYY from..to range into consecutive, non-overlapping (from, to) shards:
+    'week' (7 days), 'month' (calendar months) or a number of days. A falsy shard returns the whole range.
+    """
+    start = datetime.strptime(from_date, "%d/%m/%Y")
+    end = datetime.strptime(to_date, "%d/%m/%Y")
+    if not shard:
+        return [(from_date, to_date)]
+
+    shards = []
+    while start <= end:
+        if shard == "month":
+            shard_end = datetime(start.year + start.month // 12, start.month % 12 + 1, 1) - timedelta(days=1)
+        else:
+            shard_end = start + timedelta(days=(7 if shard == "week" else int(shard)) - 1)
+        shard_end = min(shard_end, end)
+        shards.append((start.strftime("%d/%m/%Y"), shard_end.strftime("%d/%m/%Y")))
+        start = shard_end + timedelta(days=1)
+    return shards
+
+DATE_COLUMN_HINTS = ("administ", "schedul", "due", "given")
+
+def find_date_column(columns, preferred=None):
+    """
+    preferred if the report has it, else the first 'date' column named like an administration date,
+    else the first other 'date' column that is not a date of birth (None if there is none)
+    """
+    if preferred in columns:
+        return preferred
+    candidates = [column for column in columns if 'date' in str(column).lower() and 'birth' not in str(column).lower()]
+    for hint in DATE_COLUMN_HINTS:
+        for column in candidates:
+            if hint in str(column).lower():
+                return column
+    return candidates[0] if candidates else None
+
+def rows_within_dates(df, from_date, to_date, date_column=None):
+    """
+    Keep only the rows dated from_date..to_date (inclusive), so shard reports that overlap at
+    their edges do not duplicate rows. Rows without a parseable date and reports without a date column are kept.
+    """
+    date_column = find_date_column(df.columns, date_column)
+    if date_column is None or not len(df):
+        return df
+    dates = parse_report_dates(df[date_column])
+    start = datetime.strptime(from_date, "%d/%m/%Y")
+    end = datetime.strptime(to_date, "%d/%m/%Y") + timedelta(days=1)
+    return df[dates.isna() | ((dates >= start) & (dates < end))]
+
+# ============= DOWNLOAD TRACKING =============
+
+CHUNK_FILE_PATTERN = re.compile(r"chunk_(\d+)")
+
+def chunk_download_name(chunk, chunk_num):
+    """File name a chunk's report is saved under: chunk_<n>.csv, or shard_<from>-<to>_chunk_<n>.csv for a date shard"""
+    if 'from_date' not in chunk:
+        return f"chunk_{chunk_num:04d}.csv"
+
+    def compact(date):
+        return datetime.strptime(date, "%d/%m/%Y").strftime("%Y%m%d")
+
+    return f"shard_{compact(chunk['from_date'])}-{compact(chunk['to_date'])}_chunk_{chunk_num:04d}.csv"
+
+def download_sort_key(filename):
+    """Order chunk downloads by shard start date, then chunk number; other files keep their relative order, first"""
+    chunk = CHUNK_FILE_PATTERN.search(filename)
+    if not chunk:
+        return (0, "", 0)
+    shard = SHARD_FILE_PATTERN.search(filename)
+    return (1, shard.group(1) if shard else "", int(chunk.group(1)))
+
+class DownloadTracker:
+    """
+    Polls one download directory and ties each new CSV to the chunk whose report triggered it.
+    A file counts as complete once Chrome has no partial download in progress and its size is
+    unchanged over stable_polls polls; it is then renamed to the chunk's file name straight away.
+    Reports whose file has not arrived by the claim timeout stay pending for later claims and finish().
+    While more than one chunk is waiting, a file is attributed from its content (the locations and
+    dates in it); a file that cannot be attributed is moved to the Unattributed folder and reported.
+    """
+
+    PARTIAL_SUFFIXES = ('.crdownload', '.tmp', '.part')
+    UNATTRIBUTED_DIR = "Unattributed"
+
+    def __init__(self, directory, stable_polls=2, poll_interval=0.25):
+        self.directory = directory
+        self.stable_polls = stable_polls
+        self.poll_interval = poll_interval
+        self.known = set(os.listdir(directory)) if os.path.isdir(directory) else set()
+        self.claimed = {} # chunk number -> path
+        self.pending = [] # (chunk number, chunk) still waiting for their download
+        self.unattributed = []
+        self.sizes = {}
+
+    def new_complete_files(self):
+        """New CSVs whose size has been stable for stable_polls polls, oldest first"""
+        files = os.listdir(self.directory)
+        downloading = any(f.endswith(self.PARTIAL_SUFFIXES) for f in files)
+        ready = []
+        for filename in files:
+            if not filename.endswith('.csv') or filename in self.known:
+                continue
+            try:
+                size = os.path.getsize(os.path.join(self.directory, filename))
+            except OSError:
+                continue
+            last_size, polls = self.sizes.get(filename, (None, 0))
+            polls = polls + 1 if size == last_size else 1
+            self.sizes[filename] = (size, polls)
+            if polls >= self.stable_polls and not downloading:
+                ready.append(filename)
+        return sorted(ready, key=lambda f: os.path.getmtime(os.path.join(self.directory, f)))
+
+    def move(self, filename, target):
+        """Rename a completed download to target (made unique if needed); returns the new path"""
+        base, extension = os.path.splitext(target)
+        attempt = 1
+        while os.path.exists(target):
+            attempt += 1
+            target = f"{base}_{attempt}{extension}"
+        os.replace(os.path.join(self.directory, filename), target)
+        self.known.update((filename, os.path.basename(target)))
+        self.sizes.pop(filename, None)
+        return target
+
+    def identify(self, filename, candidates):
+        """
+        The chunk number in candidates [(chunk number, chunk)] that a file's rows belong to: the chunk
+        holding most of the file's Care Services whose date shard (if any) contains the middle of the
+        file's dates. None if no chunk or more than one chunk fits equally well.
+        """
+        path = os.path.join(self.directory, filename)
+        services = set()
+        first = last = None
+        try:
+            header = pd.read_csv(path, nrows=0).columns.tolist()
+            date_column = find_date_column(header)
+            usecols = [column for column in ('Care Service', date_column) if column in header]
+            for df in pd.read_csv(path, usecols=usecols, dtype=str, keep_default_na=False, chunksize=100000):
+                if 'Care Service' in df.columns:
+                    services.update(normalize_text_series(df['Care Service']).unique())
+                if date_column:
+                    dates = parse_report_dates(df[date_column]).dropna()
+                    if len(dates):
+                        first = min(first, dates.min()) if first is not None else dates.min()
+                        last = max(last, dates.max()) if last is not None else dates.max()
+        except (OSError, ValueError) as e:
+            print(f"Could not read download '{filename}' to identify its chunk: {e}")
+            return None
+
+        middle = first + (last - first) / 2 if first is not None else None
+        scores = []
+        for chunk_num, chunk in candidates:
+            if middle is not None and 'from_date' in chunk:
+                shard_start = datetime.strptime(chunk['from_date'], "%d/%m/%Y")
+                shard_end = datetime.strptime(chunk['to_date'], "%d/%m/%Y") + timedelta(days=1)
+                if not shard_start <= middle < shard_end:
+                    continue
+            overlap = len(services.intersection(chunk['items']))
+            if overlap:
+                scores.append((overlap, chunk_num))
+        scores.sort(reverse=True)
+        if not scores or (len(scores) > 1 and scores[0][0] == scores[1][0]):
+            return None
+        return scores[0][1]
+
+    def attribute(self, filename, candidates):
+        """Give a completed download to the one candidate chunk it can belong to, or set it aside"""
+        chunk_num = candidates[0][0] if len(candidates) == 1 else self.identify(filename, candidates)
+        if chunk_num is None:
+            os.makedirs(os.path.join(self.directory, self.UNATTRIBUTED_DIR), exist_ok=True)
+            path = self.move(filename, os.path.join(self.directory, self.UNATTRIBUTED_DIR, filename))
+            self.unattributed.append(path)
+            print(f"Could not tell which chunk download '{filename}' belongs to - moved to '{path}'")
+            return
+        chunk = dict(candidates)[chunk_num]
+        if (chunk_num, chunk) in self.pending:
+            self.pending.remove((chunk_num, chunk))
+            print(f"Late download '{filename}' matched to chunk {chunk_num}")
+        self.claimed[chunk_num] = self.move(filename, os.path.join(self.directory, chunk_download_name(chunk, chunk_num)))
+
+    def claim(self, chunk_num, chunk, timeout=30):
+        """
+        Wait for the download of chunk_num's report and rename it to the chunk's file name.
+        Returns the new path, or None if it has not arrived yet (it is then kept pending for finish()).
+        Files that arrive meanwhile may belong to earlier timed-out chunks and are attributed by content.
+        """
+        deadline = time.time() + timeout
+        while True:
+            for filename in self.new_complete_files():
+                candidates = [(chunk_num, chunk)] if chunk_num not in self.claimed else []
+                candidates += self.pending
+                if candidates:
+                    self.attribute(filename, candidates)
+            if chunk_num in self.claimed:
+                return self.claimed[chunk_num]
+            if time.time() >= deadline:
+                print(f"No download for chunk {chunk_num} after {timeout}s - will look again before consolidation")
+                self.pending.append((chunk_num, chunk))
+                return None
+            time.sleep(self.poll_interval)
+
+    def finish(self, timeout=60):
+        """
+        Wait until every pending chunk has its file (or timeout), attributing late downloads by content.
+        Returns the claimed paths in chunk order.
+        """
+        deadline = time.time() + timeout
+        while self.pending and time.time() < deadline:
+            for filename in self.new_complete_files():
+                if self.pending:
+                    self.attribute(filename, list(self.pending))
+            if self.pending:
+                time.sleep(self.poll_interval)
+        if self.pending:
+            print(f"Downloads never arrived for chunks: {[num for num, _ in self.pending]}")
+        if self.unattributed:
+            print(f"{len(self.unattributed)} downloads could not be matched to a chunk and were left out of "
+                  f"consolidation: {self.unattributed}")
+        return [self.claimed[num] for num in sorted(self.claimed)]
+
+# ============= REPORT SCHEMA =============
+
+MAR_REQUIRED_COLUMNS = ('Care Service',)
+MAR_INTEGER_HINTS = ("quantity", "qty", "count", "number of")
+MAR_CATEGORY_HINTS = ("service", "resident", "medication", "medicine", "dose", "route", "outcome", "status", "reason",
+                      "recorded", "given by", "time", "region", "business id", "address")
+MAR_INTEGER_DTYPE = "Int32"
+
+def mar_column_type(column):
+    """Declared type of a MAR report column from its name: 'date', 'integer', 'category' or 'text'"""
+    name = str(column).lower()
+    if 'date' in name:
+        return 'date'
+    if any(hint in name for hint in MAR_INTEGER_HINTS):
+        return 'integer'
+    if any(hint in name for hint in MAR_CATEGORY_HINTS):
+        return 'category'
+    return 'text'
+
+def report_text(values):
+    """A report column as text for storage (None where missing), with parsed dates back in DD/MM/YYYY"""
+    if pd.api.types.is_datetime64_any_dtype(values):
+        text = values.dt.strftime("%d/%m/%Y")
+    else:
+        text = values.astype(object).map(str)
+    return text.astype(object).where(values.notna(), None)
+
+class ReportHeaderError(ValueError):
+    """A report whose header does not match the schema; problems lists what is wrong"""
+
+    def __init__(self, problems):
+        super().__init__("; ".join(problems))
+        self.problems = problems
+
+class MarReportReader:
+    """
+    Schema-aware chunked reader for downloaded MAR reports. Every column is read as text (only empty
+    fields are missing), then typed from its name: Care Service, resident, medication and similar
+    repeating columns become categoricals, DD/MM/YYYY date columns are parsed once into datetimes and
+    quantity/count columns become Int32. A column whose values do not fit its type stays text.
+    Uses pyarrow's multithreaded streaming CSV parser when pyarrow is installed and pandas' C parser
+    otherwise; both give the same dtypes. The first file's header is the one later files are checked against.
+    """
+
+    def __init__(self, read_chunk_rows=50000):
+        self.read_chunk_rows = read_chunk_rows
+        self.columns = None
+
+    def validate_header(self, header, name):
+        """Print what is wrong with a file's header compared to the schema; returns the list of problems"""
+        problems = []
+        missing_required = [column for column in MAR_REQUIRED_COLUMNS if column not in header]
+        if missing_required:
+            problems.append(f"missing required column(s) {missing_required}")
+        duplicates = sorted({column for column in header if header.count(column) > 1})
+        if duplicates:
+            problems.append(f"duplicate column(s) {duplicates}")
+        if self.columns is None:
+            if not missing_required:
+                self.columns = list(header)
+        else:
+            missing = [column for column in self.columns if column not in header]
+            extra = [column for column in header if column not in self.columns]
+            if missing:
+                problems.append(f"missing {missing} compared to the first report")
+            if extra:
+                problems.append(f"extra {extra} compared to the first report")
+        for problem in problems:
+            print(f"  Header check '{name}': {problem}")
+        return problems
+
+    def read(self, path, name=None, strict=False):
+        """
+        Yield the file as typed DataFrames (one empty frame with the header if it has no rows).
+        With strict, a header problem raises ReportHeaderError before any rows are read.
+        """
+        with open(path, 'r', newline='', encoding='utf-8-sig', errors='replace') as f:
+            header = next(csv.reader(f), None)
+        if not header:
+            raise ValueError("the file is empty")
+        problems = self.validate_header(header, name or os.path.basename(path))
+        if problems and strict:
+            raise ReportHeaderError(problems)
+
+        # pyarrow keeps duplicate column names, so those files go through pandas, which renames them
+        chunks = self.arrow_chunks(path, header) if pacsv is not None and len(set(header)) == len(header) \
+            else pd.read_csv(path, chunksize=self.read_chunk_rows, dtype=str, keep_default_na=False, na_values=[''])
+        empty = True
+        for df in chunks:
+            empty = False
+            yield self.apply_types(df)
+        if empty:
+            yield self.apply_types(pd.DataFrame({column: pd.Series(dtype=str) for column in header}))
+
+    def arrow_chunks(self, path, header):
+        column_types = {column: pa.dictionary(pa.int32(), pa.string()) if mar_column_type(column) == 'category'
+                        else pa.string() for column in header}
+        reader = pacsv.open_csv(
+            path,
+            read_options=pacsv.ReadOptions(use_threads=True, block_size=max(1 << 20, self.read_chunk_rows * 256)),
+            convert_options=pacsv.ConvertOptions(column_types=column_types, strings_can_be_null=True, null_values=['']))
+        for batch in reader:
+            yield batch.to_pandas()
+
+    def apply_types(self, df):
+        for column in df.columns:
+            kind = mar_column_type(column)
+            values = df[column]
+            present = values.notna()
+            if kind == 'category':
+                if not isinstance(values.dtype, pd.CategoricalDtype):
+                    df[column] = values.astype('category')
+            elif kind == 'date':
+                dates = pd.to_datetime(values, format="%d/%m/%Y", errors='coerce')
+                if dates.notna().sum() == present.sum() and values[present].str.len().eq(10).all():
+                    df[column] = dates
+            elif kind == 'integer':
+                numbers = pd.to_numeric(values, errors='coerce')
+                whole = numbers.dropna()
+                if len(whole) == present.sum() and (whole % 1 == 0).all() and (whole.abs() < 2 ** 31).all():
+                    df[column] = numbers.astype(MAR_INTEGER_DTYPE)
+        return df
+
+# ============= BACKGROUND CONSOLIDATION =============
+
+class ConsolidationPipeline:
+    """
+    Consolidates chunk downloads in a background thread while the browser moves on to the next chunk.
+    Each submitted CSV is parsed by a MarReportReader in chunks of read_chunk_rows, trimmed to its date shard and enriched
+    with the location columns into its own part file under Merged_Reports/_parts; finish() then only
+    has to concatenate the parts into the consolidated report. With a MAR database, every chunk is
+    upserted as it is read, in one transaction per file that is only committed if the whole file is
+    processed (the MarDatabase is opened by the consumer thread). With columnar output, each finished
+    part is streamed back into the ColumnarReportWriter, so a failed file leaves nothing behind and
+    memory stays bounded by read_chunk_rows either way. A download whose header fails the schema check
+    is moved to REJECTED_DIR without being merged; finish() lists it with every other skipped file.
+    """
+
+    REJECTED_DIR = "Rejected_Reports"
+
+    def __init__(self, automator, directory, read_chunk_rows=50000):
+        self.automator = automator
+        self.directory = directory
+        self.read_chunk_rows = read_chunk_rows
+        self.merged_dir = os.path.join(directory, "Merged_Reports")
+        self.parts_dir = os.path.join(self.merged_dir, "_parts")
+        shutil.rmtree(self.parts_dir, ignore_errors=True)
+        os.makedirs(self.parts_dir)
+        self.reader = MarReportReader(read_chunk_rows)
+        self.location_lookup = None
+        self.lookup_loaded = False
+        self.parts = {} # part name -> {'path', 'columns', 'rows', 'regions'}
+        self.skipped = {} # name -> why the file was left out of the consolidated report
+        self.submitted = set()
+        self.stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        self.columnar = automator.open_columnar_writer(os.path.join(self.merged_dir, f"Consolidated_MAR_Report_{self.stamp}"))
+        self.database_file = automator.database_file
+        self.database = None
+        self.queue = queue.Queue()
+        self.thread = threading.Thread(target=self.run, name="consolidation", daemon=True)
+        self.thread.start()
+
+    def submit(self, path, name=None):
+        """Queue a finished download; name is the part's name if the file will be moved (defaults to its file name)"""
+        name = name or os.path.basename(path)
+        self.submitted.add(name)
+        self.queue.put((path, name))
+
+    def drain(self):
+        """Wait until every submitted file has been processed"""
+        self.queue.join()
+
+    def run(self):
+        while True:
+            item = self.queue.get()
+            try:
+                if item is None:
+                    if self.database is not None:
+                        self.database.close()
+                    return
+                self.process_file(*item)
+            finally:
+                self.queue.task_done()
+
+    def process_file(self, file_path, name):
+        """Parse, trim and enrich one download into its part file; a failed file leaves no part"""
+        if not self.lookup_loaded:
+            self.location_lookup = self.automator.load_location_lookup()
+            self.lookup_loaded = True
+        location_lookup = self.location_lookup
+
+        part_path = os.path.join(self.parts_dir, name)
+        shard = SHARD_FILE_PATTERN.search(name)
+        columns = None
+        file_rows = 0
+        mapped_rows = 0
+        unmapped_services = []
+        file_region_counts = {}
+        database = self.open_database()
+        database_error = None
+        changes_before = database.connection.total_changes if database else 0
+        start_time = time.time()
+        try:
+            with open(part_path, 'w', newline='', encoding='utf-8') as part:
+                for df in self.reader.read(file_path, name, strict=True):
+                    if shard:
+                        df = rows_within_dates(df, datetime.strptime(shard.group(1), "%Y%m%d").strftime("%d/%m/%Y"),
+                                               datetime.strptime(shard.group(2), "%Y%m%d").strftime("%d/%m/%Y"))
+                    df = self.automator.add_location_columns(df, location_lookup, name, quiet=columns is not None)
+
+                    if location_lookup is not None and 'Care Service' in df.columns:
+                        unmapped = df['Region'] == 'Unknown Region'
+                        mapped_rows += int((~unmapped).sum())
+                        for service in df.loc[unmapped, 'Care Service'].unique():
+                            if len(unmapped_services) < 5 and service not in unmapped_services:
+                                unmapped_services.append(service)
+
+                    if columns is None:
+                        columns = df.columns.tolist()
+                    df.reindex(columns=columns).to_csv(part, header=part.tell() == 0, index=False, date_format="%d/%m/%Y")
+                    file_rows += len(df)
+                    if database and database_error is None:
+                        try:
+                            database.upsert_rows(df)
+                        except Exception as e:
+                            database_error = e
+                            database.rollback()
+
+                    # Region is categorical, so value_counts() also lists regions with no rows in this chunk
+                    for region, count in df['Region'].value_counts()[lambda counts: counts > 0].items():
+                        file_region_counts[region] = file_region_counts.get(region, 0) + int(count)
+        except Exception as e:
+            if os.path.exists(part_path):
+                os.remove(part_path)
+            if database and database_error is None:
+                database.rollback()
+            if isinstance(e, ReportHeaderError):
+                self.skipped[name] = f"header check failed ({e}), moved to {self.quarantine(file_path, name)}"
+                print(f"[Consolidation] '{name}' does not match the report schema. Skipping this file.")
+            else:
+                self.skipped[name] = str(e)
+                print(f"[Consolidation] Error processing '{name}': {e}. Skipping this file.")
+            return
+
+        if database_error is not None:
+            print(f"[Consolidation] Could not load '{name}' into the MAR database: {database_error}")
+        elif database:
+            database.connection.commit()
+            print(f"[Consolidation] '{name}': {database.connection.total_changes - changes_before} rows upserted "
+                  f"into '{self.database_file}'")
+
+        if self.columnar and file_rows:
+            try:
+                for df in MarReportReader(self.read_chunk_rows).read(part_path, name):
+                    self.columnar.write(df)
+            except Exception as e:
+                print(f"[Consolidation] Columnar output stopped after an error on '{name}': {e}")
+                self.columnar = None
+
+        print(f"[Consolidation] '{name}': {file_rows} rows processed in {time.time() - start_time:.1f}s")
+        if location_lookup is not None and file_rows:
+            print(f"  Successfully mapped {mapped_rows}/{file_rows} records to regions")
+            if unmapped_services:
+                print(f"  Sample unmapped Care Services: {unmapped_services}")
+        self.parts[name] = {'path': part_path, 'columns': columns or [], 'rows': file_rows, 'regions': file_region_counts}
+
+    def quarantine(self, file_path, name):
+        """Move a rejected download into REJECTED_DIR so it is kept for inspection but never consolidated again"""
+        rejected_dir = os.path.join(self.directory, self.REJECTED_DIR)
+        try:
+            os.makedirs(rejected_dir, exist_ok=True)
+            shutil.move(file_path, os.path.join(rejected_dir, name))
+        except OSError as e:
+            print(f"[Consolidation] Could not move '{name}' to '{rejected_dir}': {e}")
+            return file_path
+        return os.path.join(rejected_dir, name)
+
+    def open_database(self):
+        """The MAR database, opened on first use; None if there is none or it cannot be opened"""
+        if self.database is None and self.database_file:
+            try:
+                self.database = MarDatabase(self.database_file, self.automator.database_key_columns)
+            except Exception as e:
+                print(f"[Consolidation] Could not open the MAR database '{self.database_file}': {e}")
+                self.database_file = None
+        return self.database
+
+    def finish(self, downloaded_files_count=None):
+        """
+        Process any CSV in the directory that was not submitted (e.g. from a resumed session), wait for the
+        worker, and concatenate the parts in download order. Returns the consolidated file path, or None.
+        """
+        print("\n" + "="*50)
+        print("CONSOLIDATING CSV FILES WITH REGION MAPPING")
+        print("="*50)
+
+        csv_files = [f for f in os.listdir(self.directory) if f.endswith('.csv')]
+        for filename in csv_files:
+            if filename not in self.submitted:
+                self.submit(os.path.join(self.directory, filename))
+        self.queue.put(None)
+        self.thread.join()
+
+        if self.columnar:
+            self.columnar.close()
+
+        if not self.submitted:
+            print("No CSV files found to consolidate.")
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+            return None
+
+        print(f"Consolidated {len(self.submitted)} CSV files from '{self.directory}'.")
+        if downloaded_files_count is not None and len(self.submitted) != downloaded_files_count:
+            print(f"WARNING: Expected {downloaded_files_count} files, but found {len(self.submitted)}. "
+                  f"Some files may not have finished downloading. Proceeding anyway...")
+
+        merged_file_path = os.path.join(self.merged_dir, f"Consolidated_MAR_Report_{self.stamp}.csv")
+        names = sorted(self.parts, key=download_sort_key)
+        output_columns = []
+        for name in names:
+            for column in self.parts[name]['columns']:
+                if column not in output_columns:
+                    output_columns.append(column)
+
+        # Parts that already have the final columns are copied as text; the rest are re-read and aligned
+        total_records = 0
+        region_counts = {}
+        try:
+            with open(merged_file_path, 'w', newline='', encoding='utf-8') as merged_file:
+                pd.DataFrame(columns=output_columns).to_csv(merged_file, index=False)
+                for name in names:
+                    part = self.parts[name]
+                    if not part['rows']:
+                        continue
+                    if part['columns'] == output_columns:
+                        with open(part['path'], 'r', newline='', encoding='utf-8') as part_file:
+                            part_file.readline()
+                            shutil.copyfileobj(part_file, merged_file)
+                    else:
+                        for df in pd.read_csv(part['path'], chunksize=self.read_chunk_rows, dtype=str, keep_default_na=False):
+                            df.reindex(columns=output_columns).to_csv(merged_file, header=False, index=False)
+                    total_records += part['rows']
+                    for region, count in part['regions'].items():
+                        region_counts[region] = region_counts.get(region, 0) + count
+        except OSError as e:
+            print(f"Error saving consolidated file: {e}")
+            return None
+        finally:
+            shutil.rmtree(self.parts_dir, ignore_errors=True)
+
+        print(f"\nConsolidation complete!")
+        print(f"Final merged report saved to: '{merged_file_path}'")
+        print(f"Total consolidated records: {total_records}")
+        self.print_skipped()
+
+        if self.database_file and os.path.exists(self.database_file):
+            self.automator.print_database_summary()
+
+        # Show region distribution if regions were mapped
+        if region_counts and self.location_lookup is not None:
+            print(f"\nRegion distribution in consolidated file:")
+            sorted_counts = sorted(region_counts.items(), key=lambda item: item[1], reverse=True)
+            for region, count in sorted_counts[:10]:
+                print(f"  {region}: {count} records")
+            if len(sorted_counts) > 10:
+                print(f"  ... and {len(sorted_counts) - 10} more regions")
+
+        return merged_file_path
+
+    def print_skipped(self):
+        if not self.skipped:
+            return
+        print(f"\n{len(self.skipped)} file(s) were left out of the consolidated report:")
+        for name in sorted(self.skipped, key=download_sort_key):
+            print(f"  {name}: {self.skipped[name]}")
+
+# ============= COLUMNAR OUTPUT =============
+
+DICTIONARY_COLUMNS = ('Care Service', 'Region', 'Business ID', 'Location Address')
+
+class ColumnarReportWriter:
+    """
+    Columnar copy of the consolidated report, written batch by batch as chunks are consolidated:
+    Parquet files partitioned by Region and month (hive layout, so pandas.read_parquet on the folder
+    can filter on both) and/or one Arrow IPC file that can be memory-mapped. Values are stored as text;
+    Care Service, Region, Business ID and Location Address are dictionary-encoded and load as categoricals.
+    The first batch fixes the columns; columns that only appear later are dropped with a warning. Needs pyarrow.
+    """
+
+    def __init__(self, base_path, parquet=True, arrow=False):
+        self.parquet_dir = base_path + "_parquet" if parquet else None
+        self.arrow_path = base_path + ".arrow" if arrow else None
+        self.columns = None
+        self.date_column = None
+        self.schema = None
+        self.dictionaries = {} # column -> (values, {value: code}), only ever appended to
+        self.parquet_writers = {}
+        self.arrow_file = None
+        self.arrow_writer = None
+        self.rows = 0
+        self.dropped = set()
+
+    def encode(self, column, values):
+        """Dictionary-encode values against the column's growing dictionary, so IPC only needs dictionary deltas"""
+        dictionary, codes = self.dictionaries.setdefault(column, ([], {}))
+        for value in pd.unique(values[values.notna()]):
+            if value not in codes:
+                codes[value] = len(dictionary)
+                dictionary.append(value)
+        indices = pa.array(values.map(codes), type=pa.int32(), from_pandas=True)
+        return pa.DictionaryArray.from_arrays(indices, pa.array(dictionary, type=pa.string()))
+
+    def to_batch(self, df):
+        arrays = []
+        for column in self.columns:
+            values = df[column] if column in df.columns else pd.Series(None, index=df.index, dtype=object)
+            values = report_text(values)
+            if column in DICTIONARY_COLUMNS:
+                arrays.append(self.encode(column, values))
+            else:
+                arrays.append(pa.array(values.tolist(), type=pa.string()))
+        return pa.RecordBatch.from_arrays(arrays, schema=self.schema)
+
+    def write(self, df):
+        """Append one enriched chunk of report rows"""
+        if not len(df):
+            return
+        if self.columns is None:
+            self.columns = [str(column) for column in df.columns]
+            self.date_column = find_date_column(self.columns)
+            self.schema = pa.schema([(column, pa.dictionary(pa.int32(), pa.string()) if column in DICTIONARY_COLUMNS
+                                      else pa.string()) for column in self.columns])
+        new_columns = set(map(str, df.columns)) - set(self.columns) - self.dropped
+        if new_columns:
+            print(f"Columnar output: dropping columns not in the first batch: {sorted(new_columns)}")
+            self.dropped.update(new_columns)
+
+        batch = self.to_batch(df)
+        self.rows += len(df)
+
+        if self.arrow_path:
+            if self.arrow_writer is None:
+                self.arrow_file = pa.OSFile(self.arrow_path, 'wb')
+                self.arrow_writer = pa.ipc.new_file(self.arrow_file, self.schema,
+                                                    options=pa.ipc.IpcWriteOptions(emit_dictionary_deltas=True))
+            self.arrow_writer.write_batch(batch)
+
+        if self.parquet_dir:
+            # Region and month live in the folder names, so they are not repeated inside the files
+            regions = df['Region'].astype(object).where(df['Region'].notna(), 'Unknown Region').astype(str) \
+                if 'Region' in df.columns else pd.Series('Unknown Region', index=df.index)
+            months = parse_report_dates(df[self.date_column]).dt.strftime("%Y-%m") if self.date_column in df.columns \
+                else pd.Series(None, index=df.index, dtype=object)
+            months = months.astype(object).where(months.notna(), 'unknown')
+            file_batch = batch.drop_columns(['Region']) if 'Region' in self.columns else batch
+            positions = pd.Series(range(len(df)), index=df.index)
+            for (region, month), group in positions.groupby([regions.to_numpy(), months.to_numpy()]):
+                self.parquet_writer(region, month, file_batch.schema).write_batch(file_batch.take(pa.array(group.to_numpy())))
+
+    def parquet_writer(self, region, month, schema):
+        key = (region, month)
+        if key not in self.parquet_writers:
+            directory = os.path.join(self.parquet_dir, f"Region={quote(region, safe='')}", f"month={month}")
+            os.makedirs(directory, exist_ok=True)
+            self.parquet_writers[key] = pq.ParquetWriter(os.path.join(directory, "part-0.parquet"), schema)
+        return self.parquet_writers[key]
+
+    def close(self):
+        """Finish every file; returns the paths written"""
+        for writer in self.parquet_writers.values():
+            writer.close()
+        if self.arrow_writer is not None:
+            self.arrow_writer.close()
+            self.arrow_file.close()
+        written = []
+        if self.parquet_writers:
+            written.append(self.parquet_dir)
+            print(f"Parquet output: {self.rows} rows in {len(self.parquet_writers)} Region/month partitions under '{self.parquet_dir}'")
+        if self.arrow_writer is not None:
+            written.append(self.arrow_path)
+            print(f"Arrow IPC output: '{self.arrow_path}'")
+        return written
+
+# ============= LOCATION INDEX =============
+
+def read_master_file(file_path):
+    """Read the master location list (CSV with or without BOM, or Excel)"""
+    if file_path.endswith('.csv'):
+        return pd.read_csv(file_path, encoding='utf-8-sig') # Handle BOM
+    if file_path.endswith(('.xlsx', '.xls')):
+        return pd.read_excel(file_path)
+    raise ValueError("File must be CSV or Excel format")
+
+def build_location_lookup(master_df):
+    """
+    Build the enrichment table from the master list: one row per normalized Location Name
+    with Region, Business ID and Location Address (whichever the master file has) as categoricals.
+    """
+    columns = [c for c in ('Region', 'Business ID', 'Location Address') if c in master_df.columns]
+    master = master_df[master_df['Location Name'].notna() & master_df['Region'].notna()]
+
+    lookup = pd.DataFrame({column: master[column].astype(str).str.strip() for column in columns})
+    lookup.index = normalize_text_series(master['Location Name'].astype(str))
+
+    # Later rows win, matching the old dict-based lookup
+    lookup = lookup[~lookup.index.duplicated(keep='last')]
+    return lookup.astype('category')
+
+def unique_search_prefixes(names, min_length=3):
+    """
+    Shortest prefix of each name (at least min_length characters, not ending in a space) that no
+    other name contains, ignoring case - what react-select's 'contains' filter needs to narrow its
+    menu down to that name. Names whose full text appears inside another name keep the full text.
+    """
+    lowered = [name.lower() for name in names]
+    haystack = "\n".join(lowered)
+    prefixes = {}
+    for name, low in zip(names, lowered):
+        if haystack.count(low) > 1:
+            prefixes[name] = name
+            continue
+        # A prefix found only once can only be found in this name; longer prefixes stay unique
+        lo, hi = min(min_length, len(low)), len(low)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if haystack.count(low[:mid]) == 1:
+                hi = mid
+            else:
+                lo = mid + 1
+        while lo < len(name) and name[lo - 1] == ' ':
+            lo += 1
+        prefixes[name] = name[:lo]
+    return prefixes
+
+def file_digest(file_path):
+    digest = hashlib.sha1()
+    with open(file_path, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+class LocationIndex:
+    """
+    The master location list, read and normalized once and shared by name loading, region filtering,
+    chunk balancing, consolidation and dropdown search. Every named row is kept once in three parallel lists (original
+    text, normalized name, master row label), normalized in a single vectorized step, plus hash maps
+    name -> master row, name -> Region / Business ID, Region -> names and Business ID -> names,
+    the rows per region, each name's shortest unique search prefix and the enrichment lookup table
+    (None without Location Name and Region columns).
+    load() keeps indexes in memory for the run and saves the costly string work (normalized names and
+    search prefixes) as JSON next to the master file (<master>_index.json), keyed by the file's size,
+    mtime and SHA-1. The master file itself is always re-read, so the cache holds no pandas objects;
+    it is used while the size and mtime are unchanged, or while the SHA-1 still matches after the
+    file was only touched, and any cache that cannot be read or does not fit is rebuilt.
+    """
+
+    VERSION = 4
+    loaded = {} # (absolute path, column name) -> LocationIndex
+
+    def __init__(self, df, column_name="Location Name", names=None, search_prefixes=None):
+        """names and search_prefixes are the cached results for the same df, if there are any"""
+        self.df = df
+        self.column = column_name if column_name in df.columns else df.columns[1]
+        values = df[self.column]
+        present = values.notna()
+        text = values[present].astype(str)
+        self.originals = text.tolist()
+        self.names = names if names is not None else normalize_text_series(text).tolist()
+        self.row_index = text.index.tolist()
+        self.rows = dict(zip(self.names, self.row_index)) # later rows win
+        self.search_prefixes = search_prefixes if search_prefixes is not None else \
+            unique_search_prefixes(list(dict.fromkeys(self.names)))
+
+        self.region_of = {}
+        self.names_by_region = {}
+        self.region_counts = {}
+        if 'Region' in df.columns:
+            for name, region in zip(self.names, df.loc[present, 'Region']):
+                if pd.notna(region):
+                    self.region_of[name] = str(region)
+                    self.names_by_region.setdefault(region, []).append(name)
+            self.region_counts = {region: int(count) for region, count in df['Region'].value_counts().items()}
+
+        self.business_id_of = {}
+        self.names_by_business_id = {}
+        if 'Business ID' in df.columns:
+            self.business_id_of = dict(zip(self.names, df.loc[present, 'Business ID']))
+            for name, business_id in self.business_id_of.items():
+                if pd.notna(business_id):
+                    self.names_by_business_id.setdefault(business_id, []).append(name)
+
+        self.lookup = build_location_lookup(df) if 'Location Name' in df.columns and 'Region' in df.columns else None
+        self.signature = None
+
+    @classmethod
+    def load(cls, file_path, column_name="Location Name"):
+        """Index of the master file from memory, the disk cache or a fresh read, in that order"""
+        stat = os.stat(file_path)
+        signature = {'size': stat.st_size, 'mtime': stat.st_mtime_ns}
+        key = (os.path.abspath(file_path), column_name)
+        index = cls.loaded.get(key)
+        if index is not None and index.signature == signature:
+            return index
+
+        cache_path = os.path.splitext(file_path)[0] + "_index.json"
+        state = None
+        if os.path.exists(cache_path):
+            try:
+                with open(cache_path, 'r', encoding='utf-8') as f:
+                    state = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not read location index cache '{cache_path}': {e}")
+        if not (isinstance(state, dict) and state.get('version') == cls.VERSION and state.get('column_name') == column_name):
+            state = None
+
+        digest = None
+        if state is not None and state.get('signature') != signature:
+            digest = file_digest(file_path)
+            if digest != state.get('sha1'):
+                state = None
+
+        df = read_master_file(file_path)
+        index = None
+        if state is not None:
+            try:
+                index = cls(df, column_name, state['names'], state['search_prefixes'])
+                if len(index.names) != len(index.originals) or not isinstance(index.search_prefixes, dict):
+                    raise ValueError("cached names do not fit the master file")
+                print(f"Location index loaded from cache '{cache_path}' ({len(index.names)} locations)")
+            except (KeyError, TypeError, ValueError) as e:
+                print(f"Location index cache '{cache_path}' is unusable ({e}) - rebuilding it")
+                state = index = None
+        if index is None:
+            index = cls(df, column_name)
+            print(f"Location index built for '{file_path}' ({len(index.names)} locations, "
+                  f"{len(index.region_counts)} regions)")
+        index.signature = signature
+
+        if state is None or digest is not None:
+            try:
+                with open(cache_path, 'w', encoding='utf-8') as f:
+                    json.dump({'version': cls.VERSION, 'column_name': column_name, 'signature': signature,
+                               'sha1': digest or file_digest(file_path), 'names': index.names,
+                               'search_prefixes': index.search_prefixes}, f)
+            except OSError as e:
+                print(f"Could not save location index cache '{cache_path}': {e}")
+        cls.loaded[key] = index
+        return index
+
+    def normalization_diffs(self):
+        """Generator of (row, original, normalized) for the names normalization changed"""
+        return ((row, original, name) for row, original, name in zip(self.row_index, self.originals, self.names)
+                if original != name)
+
+    def show_normalization_diffs(self, limit=10):
+        """Print the first limit normalization changes; the rest are only counted"""
+        diffs = self.normalization_diffs()
+        for shown, (row, original, name) in enumerate(diffs):
+            if shown == limit:
+                print(f"... and {1 + sum(1 for _ in diffs)} more names normalized")
+                break
+            print(f"Normalized (row {row}): '{original}' → '{name}'")
+
+    def regions(self):
+        """Regions of the master list, sorted"""
+        return sorted(self.region_counts)
+
+    def names_in_region(self, region):
+        return list(self.names_by_region.get(region, []))
+
+# ============= LOCATION ALIASES =============
+
+def match_key(text):
+    """Normalized, lower-cased text with punctuation as single spaces, for fuzzy label comparison"""
+    return ' '.join(re.sub(r'[^0-9a-z]+', ' ', normalize_text(str(text)).lower()).split())
+
+def trigrams(key):
+    padded = f"  {key} "
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+def abbreviates(short, long):
+    """True if short could be an abbreviation of long: same first letter, letters in order ('rd' of 'road')"""
+    remaining = iter(long)
+    return short[:1] == long[:1] and all(c in remaining for c in short)
+
+def words_agree(name_words, label_words):
+    """
+    True unless both texts have words the other lacks that cannot be paired as abbreviations
+    ('dover rd' and 'dover road' agree, 'tg east view' and 'tg west view' do not).
+    Words only added or dropped on one side are allowed.
+    """
+    only_name = name_words - label_words
+    only_label = label_words - name_words
+    fewer, more = sorted((only_name, only_label), key=len)
+    return all(any(abbreviates(a, b) or abbreviates(b, a) for b in more) for a in fewer)
+
+class LabelMatcher:
+    """
+    Trigram index over every dropdown option label, for names that match no label exactly.
+    Candidates are the labels sharing trigrams with the name (found through the inverted index),
+    scored by the Dice similarity of the two trigram sets. Labels whose numbers differ from the
+    name's (house numbers such as '4' vs '5a'), or whose differing words are not abbreviations of
+    each other ('East' vs 'West'), are never candidates.
+    """
+
+    def __init__(self, labels):
+        self.labels = list(dict.fromkeys(labels))
+        self.keys = [match_key(label) for label in self.labels]
+        self.grams = [trigrams(key) for key in self.keys]
+        self.numbers = [{token for token in key.split() if any(c.isdigit() for c in token)} for key in self.keys]
+        self.words = [set(key.split()) - numbers for key, numbers in zip(self.keys, self.numbers)]
+        self.postings = {}
+        for position, grams in enumerate(self.grams):
+            for gram in grams:
+                self.postings.setdefault(gram, []).append(position)
+        self.by_key = {}
+        for position, key in enumerate(self.keys):
+            self.by_key.setdefault(key, position)
+
+    def candidates(self, name, limit=3):
+        """[(label, score)] for the best limit labels, best first"""
+        key = match_key(name)
+        if key in self.by_key:
+            return [(self.labels[self.by_key[key]], 1.0)]
+        grams = trigrams(key)
+        numbers = {token for token in key.split() if any(c.isdigit() for c in token)}
+        words = set(key.split()) - numbers
+        shared = {}
+        for gram in grams:
+            for position in self.postings.get(gram, ()):
+                shared[position] = shared.get(position, 0) + 1
+        scored = [(2 * count / (len(grams) + len(self.grams[position])), position) for position, count in shared.items()
+                  if self.numbers[position] == numbers and words_agree(words, self.words[position])]
+        return [(self.labels[position], score) for score, position in heapq.nlargest(limit, scored)]
+
+    def best_match(self, name, threshold=0.75, margin=0.05):
+        """(label, score) of the best candidate if it clears threshold and beats the runner-up by margin, else None"""
+        candidates = self.candidates(name, 2)
+        if not candidates or candidates[0][1] < threshold:
+            return None
+        if len(candidates) > 1 and candidates[0][1] - candidates[1][1] < margin:
+            return None
+        return candidates[0]
+
+class LocationAliases:
+    """
+    Master-file location names mapped to the dropdown labels they were confirmed to match
+    (renamed homes, encoding differences), so later runs select those labels directly.
+    Matches found by unattended runs are kept apart as proposals until someone confirms them.
+    Stored as JSON; confirm() and propose() save straight away and are safe to call from pool workers.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.aliases = {}
+        self.proposed = {}
+        self.lock = threading.Lock()
+        if os.path.exists(path):
+            try:
+                with open(path, 'r') as f:
+                    stored = json.load(f)
+                self.aliases = stored.get('aliases', {})
+                self.proposed = stored.get('proposed', {})
+            except (OSError, ValueError) as e:
+                print(f"Could not read location aliases '{path}': {e}")
+
+    def label_for(self, name):
+        entry = self.aliases.get(name)
+        return entry['label'] if entry else name
+
+    def confirm(self, name, label, score):
+        with self.lock:
+            self.aliases[name] = {'label': label, 'score': round(score, 3), 'confirmed_at': datetime.now().isoformat()}
+            self.proposed.pop(name, None)
+            self.save()
+
+    def propose(self, name, candidates):
+        """Record the [(label, score)] candidates of a name nobody was there to confirm"""
+        with self.lock:
+            self.proposed[name] = {'candidates': [{'label': label, 'score': round(score, 3)} for label, score in candidates],
+                                   'proposed_at': datetime.now().isoformat()}
+            self.save()
+
+    def save(self):
+        try:
+            with open(self.path, 'w') as f:
+                json.dump({'updated_at': datetime.now().isoformat(), 'aliases': self.aliases, 'proposed': self.proposed},
+                          f, indent=2)
+        except OSError as e:
+            print(f"Error saving location aliases: {e}")
+
+    def extend_lookup(self, lookup):
+        """The location lookup plus a row for each alias label, copied from its master name's row"""
+        pairs = [(name, entry['label']) for name, entry in self.aliases.items()
+                 if name in lookup.index and entry['label'] not in lookup.index]
+        if not pairs:
+            return lookup
+        extra = lookup.loc[[name for name, _ in pairs]]
+        extra.index = pd.Index([label for _, label in pairs])
+        return pd.concat([lookup, extra])
+
+# ============= MAR DATABASE =============
+
+# Name fragments that identify the resident and medication columns of the upsert key
+MAR_KEY_HINTS = {
+    'key_resident': ("resident", "service user", "patient"),
+    'key_medication': ("medication", "medicine", "drug"),
+}
+
+# The key's date and time are the dose's scheduled ones: administration dates and times are empty
+# or change until the dose is recorded, so keying on them would store one dose as several rows
+MAR_SCHEDULED_HINTS = ("schedul", "due", "planned")
+MAR_ADMINISTERED_HINTS = ("administ", "given", "recorded", "actual", "signed")
+
+# Key parts that can be mapped to a report column explicitly (MarDatabase key_columns, --database-key)
+MAR_KEY_PARTS = {'service': 'key_service', 'resident': 'key_resident', 'medication': 'key_medication',
+                 'date': 'mar_date', 'time': 'key_time'}
+
+def scheduled_column(columns, kind):
+    """
+    The report's scheduled 'date' or 'time' column for the upsert key: the first named like a scheduled
+    or due one, else the first not named like an administration one (None if there is only the latter)
+    """
+    candidates = [column for column in columns if kind in column.lower() and 'birth' not in column.lower()
+                  and not (kind == 'time' and 'date' in column.lower())]
+    for column in candidates:
+        if any(hint in column.lower() for hint in MAR_SCHEDULED_HINTS):
+            return column
+    return next((column for column in candidates
+                 if not any(hint in column.lower() for hint in MAR_ADMINISTERED_HINTS)), None)
+
+def quote_identifier(name):
+    return '"' + str(name).replace('"', '""') + '"'
+
+class MarDatabase:
+    """
+    Local SQLite store of MAR rows across runs. Rows are upserted on (Care Service, resident, medication,
+    scheduled date, scheduled time), so a re-downloaded row replaces its earlier copy, and indexed on Region,
+    Business ID and date. Report columns are kept as TEXT columns named as in the report (added as they first
+    appear) next to the normalized key columns; mar_date is the ISO scheduled date for range queries. Use each instance from one thread only.
+    key_columns maps key parts (see MAR_KEY_PARTS) to report columns; parts it leaves out are found from the
+    column names, and a report in which any key part has no column is refused rather than collapsed.
+    """
+
+    TABLE = "mar_rows"
+    KEY_COLUMNS = ('key_service', 'key_resident', 'key_medication', 'mar_date', 'key_time')
+
+    def __init__(self, path, key_columns=None):
+        self.path = path
+        unknown = set(key_columns or {}) - set(MAR_KEY_PARTS)
+        if unknown:
+            raise ValueError(f"unknown MAR key parts {sorted(unknown)} - use {', '.join(MAR_KEY_PARTS)}")
+        self.key_columns = {MAR_KEY_PARTS[part]: column for part, column in (key_columns or {}).items()}
+        self.connection = sqlite3.connect(path)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        key_definitions = ", ".join(f"{column} TEXT NOT NULL" for column in self.KEY_COLUMNS)
+        self.connection.execute(f"CREATE TABLE IF NOT EXISTS {self.TABLE} ({key_definitions}, loaded_at TEXT, "
+                                f"PRIMARY KEY ({', '.join(self.KEY_COLUMNS)}))")
+        self.connection.execute(f"CREATE INDEX IF NOT EXISTS idx_mar_date ON {self.TABLE} (mar_date)")
+        self.connection.commit()
+        self.columns = [row[1] for row in self.connection.execute(f"PRAGMA table_info({self.TABLE})")]
+
+    def ensure_columns(self, columns):
+        """Add report columns the table does not have yet; Region and Business ID get an index"""
+        for column in columns:
+            if column in self.columns:
+                continue
+            self.connection.execute(f"ALTER TABLE {self.TABLE} ADD COLUMN {quote_identifier(column)} TEXT")
+            self.columns.append(column)
+        for index_name, column in (("idx_region", "Region"), ("idx_business_id", "Business ID")):
+            if column in self.columns:
+                self.connection.execute(f"CREATE INDEX IF NOT EXISTS {index_name} ON {self.TABLE} ({quote_identifier(column)})")
+
+    def resolve_key_columns(self, columns):
+        """{key column: report column} for every part of the upsert key; raises ValueError if any part has no column"""
+        resolved = {'key_service': 'Care Service', 'mar_date': scheduled_column(columns, 'date'),
+                    'key_time': scheduled_column(columns, 'time')}
+        for key, hints in MAR_KEY_HINTS.items():
+            resolved[key] = next((c for c in columns if any(hint in c.lower() for hint in hints) and 'date' not in c.lower()), None)
+        resolved.update(self.key_columns)
+        missing = [part for part, key in MAR_KEY_PARTS.items() if resolved[key] not in columns]
+        if missing:
+            raise ValueError(f"no report column for upsert key part(s) {', '.join(missing)} in {columns} - "
+                             f"map it explicitly (e.g. --database-key {missing[0]}=COLUMN)")
+        return resolved
+
+    def key_values(self, df):
+        """The five upsert key columns for a chunk of report rows"""
+        df = df.rename(columns=str)
+        resolved = self.resolve_key_columns(df.columns.tolist())
+        keys = {key: report_text(df[column]).fillna('').str.strip() for key, column in resolved.items()}
+        keys['key_service'] = normalize_text_series(keys['key_service'])
+        keys['mar_date'] = parse_report_dates(df[resolved['mar_date']]).dt.strftime("%Y-%m-%d").fillna('')
+        return keys
+
+    def upsert(self, frames):
+        """
+        Insert or replace the rows of one or more DataFrames in a single transaction; returns the number of
+        rows SQLite inserted or updated. Nothing is written if a frame's key columns cannot be resolved.
+        """
+        frames = [df for df in frames if len(df)]
+        if not frames:
+            return 0
+        changes_before = self.connection.total_changes
+        try:
+            for df in frames:
+                self.upsert_rows(df)
+        except Exception:
+            self.rollback()
+            raise
+        self.connection.commit()
+        return self.connection.total_changes - changes_before
+
+    def upsert_rows(self, df):
+        """Insert or replace one DataFrame's rows in the open transaction; commit() or rollback() ends it"""
+        if not len(df):
+            return
+        loaded_at = datetime.now().isoformat(timespec='seconds')
+        report_columns = [str(column) for column in df.columns if str(column) not in self.KEY_COLUMNS + ('loaded_at',)]
+        keys = self.key_values(df)
+        self.ensure_columns(report_columns)
+        values = df.rename(columns=str)[report_columns]
+        values = pd.DataFrame({column: report_text(values[column]) for column in report_columns})
+
+        columns = list(self.KEY_COLUMNS) + ['loaded_at'] + report_columns
+        updates = ", ".join(f"{quote_identifier(c)} = excluded.{quote_identifier(c)}" for c in ['loaded_at'] + report_columns)
+        sql = (f"INSERT INTO {self.TABLE} ({', '.join(map(quote_identifier, columns))}) "
+               f"VALUES ({', '.join('?' * len(columns))}) "
+               f"ON CONFLICT ({', '.join(self.KEY_COLUMNS)}) DO UPDATE SET {updates}")
+        key_rows = zip(*(keys[key].tolist() for key in self.KEY_COLUMNS))
+        self.connection.executemany(sql, ((*key_row, loaded_at, *row) for key_row, row in
+                                          zip(key_rows, values.itertuples(index=False, name=None))))
+
+    def rollback(self):
+        """Discard the open transaction, including any columns it added"""
+        self.connection.rollback()
+        self.columns = [row[1] for row in self.connection.execute(f"PRAGMA table_info({self.TABLE})")]
+
+    def region_counts(self):
+        """[(region, rows)] for the whole database, largest first"""
+        if "Region" not in self.columns:
+            return []
+        return self.connection.execute(f'SELECT "Region", COUNT(*) FROM {self.TABLE} GROUP BY "Region" '
+                                       f'ORDER BY COUNT(*) DESC').fetchall()
+
+    def row_count(self):
+        return self.connection.execute(f"SELECT COUNT(*) FROM {self.TABLE}").fetchone()[0]
+
+    def close(self):
+        self.connection.close()
 
 class FixedDropdownAutomator:
-    def __init__(self, download_path=None, driver_path=None):
+    def __init__(self, download_path=None, driver_path=None, batch_selection=True, interactive=True,
+                 user_data_dir=None, session_file="camascope_session.json", headless=False, capture_network=False):
         """Initialize the automation tool with enhanced element selection"""
         print("Starting browser setup...")
 
         # Set up Chrome driver
         options = webdriver.ChromeOptions()
-        options.add_argument("--start-maximized")
+        if headless:
+            # Scheduled batch runs have no display; a fixed window size keeps the layout stable
+            options.add_argument("--headless=new")
+            options.add_argument("--window-size=1920,1080")
+        else:
+            options.add_argument("--start-maximized")
         # This line suppresses the "DevTools listening on..." message and other verbose logs
         options.add_experimental_option('excludeSwitches', ['enable-logging'])
 
+        # DevTools network logging lets the report API request be captured and replayed
+        if capture_network:
+            options.set_capability('goog:loggingPrefs', {'performance': 'ALL'})
+
+        # A dedicated Chrome profile keeps the login between runs
+        if user_data_dir:
+            options.add_argument(f"--user-data-dir={os.path.abspath(user_data_dir)}")
+
         if download_path:
             prefs = {
                 "download.default_directory": download_path,
@@ -58,10 +2261,46 @@ class FixedDropdownAutomator:
         self.wait = WebDriverWait(self.driver, 20)
         self.short_wait = WebDriverWait(self.driver, 5)
         self.progress_file = "chunking_progress.json"
-
-    def automated_login(self, target_url):
+        self.row_counts_file = "location_row_counts.json"
+        self.location_aliases = LocationAliases("location_aliases.json") # confirmed name -> dropdown label
+        self.label_matcher = None # LabelMatcher over every dropdown label, built on the first unmatched name
+        self.fuzzy_threshold = 0.75
+        self.last_report = None
+        self.csv_link_timed_out = False
+
+        # Batch selection resolves a whole chunk in one injected script call
+        self.batch_selection = batch_selection
+        self.driver.set_script_timeout(300)
+
+        # Non-interactive automators (e.g. pool workers, scheduled batch runs) never block on input()
+        self.interactive = interactive
+        self.headless = headless
+        self.download_path = download_path
+        self.target_url = None
+        self.from_date = None
+        self.to_date = None
+        self.page_dates = None # (from, to) currently entered on the report page
+        self.parquet_output = False # also write the consolidated report as Region/month-partitioned Parquet
+        self.arrow_output = False # ... and/or as an Arrow IPC file
+        self.database_file = None # SQLite file the consolidated rows are upserted into
+        self.database_key_columns = None # {key part: report column} overrides for the database's upsert key
+        self.location_index = None # LocationIndex of the names file last loaded
+        self.option_index = None # {'generation', 'elements': {label: element}} of the open dropdown menu
+        self.search_selection = True # resolve options by typing into the dropdown's search input
+
+        # Saved cookies/web storage let the next run skip the login
+        self.user_data_dir = user_data_dir
+        self.session_file = session_file
+
+        # Report API replay: captured request template and a pooled HTTP client
+        self.capture_network = capture_network
+        self.report_api_template = None
+        self.http = urllib3.PoolManager(maxsize=8)
+
+    def automated_login(self, target_url, from_date=None, to_date=None):
         """
         Automates the 3-step login process and navigates to the reports page.
+        If from_date/to_date are given (DD/MM/YYYY) the date prompt is skipped.
         """
         print("=== AUTOMATED LOGIN PROCESS ===")
         print("Reading credentials from 'camascope login.txt'...")
@@ -116,10 +2355,14 @@ class FixedDropdownAutomator:
             print("Entered password and clicked 'Sign In'.")
 
             print("Login sequence complete. Waiting for the dashboard to load.")
-            time.sleep(3) # Short pause for pop-ups to appear
+            self.wait_for_page_to_settle() # Returns once pop-ups have finished appearing
 
-            print("Please manually clear any pop-ups and press Enter to continue...")
-            input()
+            if self.interactive:
+                print("Please manually clear any pop-ups and press Enter to continue...")
+                input()
+            else:
+                print("Non-interactive login - dismissing any pop-ups with Escape...")
+                ActionChains(self.driver).send_keys(Keys.ESCAPE).perform()
 
             # --- Step 4: Click the 'Reports' menu option ---
             print("Clicking 'Reports' menu option...")
@@ -137,46 +2380,16 @@ class FixedDropdownAutomator:
             mar_report_link.click()
             print("Clicked 'MAR Report'.")
 
-            time.sleep(2) # Allow the page to render
+            self.wait_for_page_to_settle() # Allow the page to render
 
             # --- Get date input from user and fill fields ---
-            date_choice = input("Enter 'D' to use default dates (01/09/2024 to today's date), or 'C' to enter custom dates: ").strip().lower()
+            from_date, to_date = self.choose_report_dates(from_date, to_date)
+            self.enter_report_dates(from_date, to_date)
 
-            if date_choice == 'd':
-                from_date = "01/09/2024"
-                to_date = datetime.now().strftime("%d/%m/%Y")
-                print("Using default dates.")
-            elif date_choice == 'c':
-                from_date = input("Please enter the 'From' date in DD/MM/YYYY format: ")
-                to_date = input("Please enter the 'To' date in DD/MM/YYYY format: ")
-            else:
-                print("Invalid choice. Using default dates.")
-                from_date = "01/09/2024"
-                to_date = datetime.now().strftime("%d/%m/%Y")
-
-            # Clear and enter 'From' date
-            print(f"Entering '{from_date}' into the 'From' date field.")
-            from_date_input = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Start Date']"))
-            )
-            ActionChains(self.driver).click(from_date_input).perform()
-            self.driver.execute_script("arguments[0].value = '';", from_date_input)
-            from_date_input.send_keys(from_date)
-            from_date_input.send_keys(Keys.ENTER)
-            print("Successfully entered 'From' date.")
-
-            time.sleep(1)
-
-            # Clear and enter 'To' date
-            print(f"Entering '{to_date}' into the 'To' date field.")
-            to_date_input = WebDriverWait(self.driver, 10).until(
-                EC.presence_of_element_located((By.XPATH, "//input[@placeholder='End Date']"))
-            )
-            ActionChains(self.driver).click(to_date_input).perform()
-            self.driver.execute_script("arguments[0].value = '';", to_date_input)
-            to_date_input.send_keys(to_date)
-            to_date_input.send_keys(Keys.ENTER)
-            print("Successfully entered 'To' date.")
+            # Remember the session settings so worker browsers can repeat them
+            self.target_url = target_url
+            self.from_date = from_date
+            self.to_date = to_date
 
             print("Login and navigation complete. Proceeding with main script logic.")
 
@@ -184,120 +2397,390 @@ class FixedDropdownAutomator:
             print(f"An error occurred during login or navigation: {e}")
             raise
 
-    def get_current_first_selection(self):
-        """Dynamically get the current first/top selected item from the dropdown"""
+    def start_session(self, target_url, from_date=None, to_date=None, persist=True):
+        """
+        Open the MAR report page, reusing a saved session when it is still valid.
+        Falls back to the full automated_login (and saves the new session) when it has expired.
+        """
+        print("=== STARTING SESSION ===")
+        if self.restore_session(target_url):
+            print("Saved session is still valid - skipping login.")
+            from_date, to_date = self.choose_report_dates(from_date, to_date)
+            self.enter_report_dates(from_date, to_date)
+
+            self.target_url = target_url
+            self.from_date = from_date
+            self.to_date = to_date
+            print("Navigation complete. Proceeding with main script logic.")
+            return
+
+        print("No valid saved session - running the full login.")
+        self.automated_login(target_url, from_date, to_date)
+        if persist:
+            self.save_session()
+
+    def save_session(self):
+        """Save the logged-in app's cookies and web storage to the session file"""
         try:
-            # Strategy 1: Look for "All units" first (appears when many selections are made)
-            try:
-                all_units_element = self.driver.find_element(By.XPATH, "//span[text()='All units']")
-                return "All units"
-            except:
-                pass
+            session_data = {
+                'saved_at': datetime.now().isoformat(),
+                'url': self.driver.current_url,
+                'cookies': self.driver.get_cookies(),
+                'local_storage': self.driver.execute_script("return Object.assign({}, window.localStorage);"),
+                'session_storage': self.driver.execute_script("return Object.assign({}, window.sessionStorage);")
+            }
+            with open(self.session_file, 'w') as f:
+                json.dump(session_data, f)
+            os.chmod(self.session_file, 0o600)
+            print(f"Session saved to {self.session_file}")
+        except Exception as e:
+            print(f"Error saving session: {e}")
 
-            # Strategy 2: Look for the first selected item badge/span
-            try:
-                # Look for the first span inside the badge container
-                first_selection = self.driver.find_element(By.CSS_SELECTOR, ".badge.border.border-primary.text-primary")
-                # Get the text content, excluding the X button
-                text_content = first_selection.text.strip()
-                # Remove the × character if present
-                if text_content.endswith('×'):
-                    text_content = text_content[:-1].strip()
-                if text_content:
-                    return text_content
-            except:
-                pass
+    def restore_session(self, target_url):
+        """
+        Try to open target_url already logged in, either through the Chrome profile
+        or by replaying the saved cookies and web storage. Returns True if the report page loaded.
+        """
+        if self.user_data_dir:
+            print("Checking the Chrome profile for an existing login...")
+            self.driver.get(target_url)
+            if self.is_logged_in():
+                return True
 
-            # Strategy 3: Alternative selector for selected items
-            try:
-                selected_spans = self.driver.find_elements(By.CSS_SELECTOR, ".css-1pahdxg-control .badge span")
-                if selected_spans:
-                    first_text = selected_spans[0].text.strip()
-                    if first_text and first_text != '×':
-                        return first_text
-            except:
-                pass
+        if not os.path.exists(self.session_file):
+            return False
 
-            # Strategy 4: Look for any selected item in the control container
-            try:
-                control_container = self.driver.find_element(By.CSS_SELECTOR, ".css-1pahdxg-control, .css-yk16xz-control")
-                spans = control_container.find_elements(By.TAG_NAME, "span")
-                for span in spans:
-                    text = span.text.strip()
-                    if text and text != '×' and 'Select' not in text:
-                        return text
-            except:
-                pass
+        try:
+            with open(self.session_file, 'r') as f:
+                session_data = json.load(f)
+
+            # Load a static resource on the app's origin so its storage can be written
+            # before the app gets a chance to redirect to the login page
+            parsed = urlparse(session_data['url'])
+            origin = f"{parsed.scheme}://{parsed.netloc}"
+            print(f"Restoring saved session from {session_data.get('saved_at', 'unknown time')}...")
+            self.driver.get(origin + "/favicon.ico")
+
+            for cookie in session_data.get('cookies', []):
+                try:
+                    self.driver.add_cookie(cookie)
+                except Exception:
+                    pass
+            self.driver.execute_script("""
+                var local = arguments[0], session = arguments[1];
+                Object.keys(local).forEach(function (key) { window.localStorage.setItem(key, local[key]); });
+                Object.keys(session).forEach(function (key) { window.sessionStorage.setItem(key, session[key]); });
+            """, session_data.get('local_storage', {}), session_data.get('session_storage', {}))
 
-            print("Could not detect current first selection")
+            self.driver.get(target_url)
+            self.driver.refresh()
+            return self.is_logged_in()
+
+        except Exception as e:
+            print(f"Could not restore saved session: {e}")
+            return False
+
+    def is_logged_in(self, timeout=15):
+        """Wait until either the MAR report's date inputs or the login screen appear"""
+        report_page = (By.XPATH, "//input[@placeholder='Start Date']")
+        login_page = (By.XPATH, "//div[contains(@class, 'otherUserDetailsBox')] | //input[@id='signInName']")
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                EC.any_of(EC.presence_of_element_located(report_page), EC.presence_of_element_located(login_page))
+            )
+        except TimeoutException:
+            print("Neither the report page nor the login page appeared.")
+            return False
+        return len(self.driver.find_elements(*report_page)) > 0
+
+    def choose_report_dates(self, from_date=None, to_date=None):
+        """Return the (from, to) report dates, prompting for them unless both are supplied"""
+        if from_date and to_date:
+            date_choice = None
+            print(f"Using supplied dates: {from_date} to {to_date}")
+        elif self.interactive:
+            date_choice = input("Enter 'D' to use default dates (01/09/2024 to today's date), or 'C' to enter custom dates: ").strip().lower()
+        else:
+            date_choice = 'd'
+
+        if date_choice is None:
+            pass
+        elif date_choice == 'd':
+            from_date = "01/09/2024"
+            to_date = datetime.now().strftime("%d/%m/%Y")
+            print("Using default dates.")
+        elif date_choice == 'c':
+            from_date = input("Please enter the 'From' date in DD/MM/YYYY format: ")
+            to_date = input("Please enter the 'To' date in DD/MM/YYYY format: ")
+        else:
+            print("Invalid choice. Using default dates.")
+            from_date = "01/09/2024"
+            to_date = datetime.now().strftime("%d/%m/%Y")
+
+        return from_date, to_date
+
+    def enter_report_dates(self, from_date, to_date):
+        """Type the From/To dates (DD/MM/YYYY) into the MAR report's date inputs"""
+        # Clear and enter 'From' date
+        print(f"Entering '{from_date}' into the 'From' date field.")
+        from_date_input = WebDriverWait(self.driver, 10).until(
+            EC.presence_of_element_located((By.XPATH, "//input[@placeholder='Start Date']"))
+        )
+        ActionChains(self.driver).click(from_date_input).perform()
+        self.driver.execute_script("arguments[0].value = '';", from_date_input)
+        from_date_input.send_keys(from_date)
+        from_date_input.send_keys(Keys.ENTER)
+        print("Successfully entered 'From' date.")
+
+        self.wait_for_dropdown_state('dom_quiet', 300, timeout=2) # Let the date picker close
+
+        # Clear and enter 'To' date
+        print(f"Entering '{to_date}' into the 'To' date field.")
+        to_date_input = WebDriverWait(self.driver, 10).until(
+            EC.presence_of_element_located((By.XPATH, "//input[@placeholder='End Date']"))
+        )
+        ActionChains(self.driver).click(to_date_input).perform()
+        self.driver.execute_script("arguments[0].value = '';", to_date_input)
+        to_date_input.send_keys(to_date)
+        to_date_input.send_keys(Keys.ENTER)
+        print("Successfully entered 'To' date.")
+        self.page_dates = (from_date, to_date)
+
+    def get_selection_state(self):
+        """
+        Read the full multi-select state with a single execute_script call.
+        Returns a dict with 'selected' (list of labels), 'all_units', 'menu_open',
+        'anchor' (element to click to open the dropdown), 'anchor_text' and
+        'control_found', or None if the page could not be queried.
+        """
+        try:
+            return self.driver.execute_script(SELECTION_STATE_SCRIPT)
+        except Exception as e:
+            print(f"Error reading selection state: {e}")
             return None
 
+    def is_selected(self, label):
+        """True if the dropdown currently shows label among its selected values (or shows 'All units')"""
+        state = self.get_selection_state()
+        if state is None:
+            return False
+        return state['all_units'] or normalize_text(label) in {normalize_text(selected) for selected in state['selected']}
+
+    def get_current_first_selection(self):
+        """Dynamically get the current first/top selected item from the dropdown"""
+        state = self.get_selection_state()
+        if state is None:
+            return None
+
+        if state['all_units']:
+            return "All units"
+        if state['selected']:
+            return state['selected'][0]
+
+        print("Could not detect current first selection")
+        return None
+
+    def get_dropdown_anchor(self):
+        """Wait until the dropdown anchor is available and return (anchor element, state)"""
+        def anchor_ready(driver):
+            state = self.get_selection_state()
+            return state if state and state['anchor'] else False
+
+        state = self.wait.until(anchor_ready)
+        return state['anchor'], state
+
+    def wait_for_dropdown_state(self, condition, param=None, timeout=5, click_element=None):
+        """
+        Wait for the page to reach a dropdown condition using an injected MutationObserver.
+        Returns as soon as the condition holds (True) or when the timeout expires (False).
+        If click_element is given it is clicked inside the same script before waiting,
+        and errors are raised so the caller can fall back to a native click.
+        """
+        try:
+            outcome = self.driver.execute_async_script(
+                WAIT_FOR_STATE_SCRIPT, condition, param, int(timeout * 1000), click_element
+            )
         except Exception as e:
-            print(f"Error detecting current first selection: {e}")
+            if click_element is not None:
+                raise
+            print(f"Error waiting for '{condition}': {e}")
+            return False
+
+        if outcome and outcome.get('error'):
+            print(f"Error waiting for '{condition}': {outcome['error']}")
+        reached = bool(outcome and outcome.get('reached'))
+        if not reached:
+            print(f"Timed out after {timeout}s waiting for '{condition}'")
+        return reached
+
+    def wait_for_page_to_settle(self, timeout=10, quiet_ms=500):
+        """Wait for the document to finish loading and the DOM to stop changing"""
+        try:
+            WebDriverWait(self.driver, timeout).until(
+                lambda driver: driver.execute_script("return document.readyState") == "complete"
+            )
+        except TimeoutException:
+            print("Page did not finish loading in time. Continuing...")
+            return False
+        return self.wait_for_dropdown_state('dom_quiet', quiet_ms, timeout=timeout)
+
+    def count_csv_rows(self, path):
+        """Number of data rows in a CSV file, or None if it cannot be read"""
+        try:
+            return sum(len(df) for df in pd.read_csv(path, usecols=[0], chunksize=100000))
+        except Exception:
             return None
 
-    def normalize_text(self, text):
-        """Normalize text to handle encoding issues"""
-        if not text:
-            return text
-
-        # Common character replacements for HTML entities and encoding issues
-        replacements = {
-            'ÃƒÂ¢Ã¢â€šÂ¬"': '—', # em dash
-            'ÃƒÂ¢Ã¢â€šÂ¬"': '—', # em dash (alternative encoding)
-            'ÃƒÂ¢Ã¢â€šÂ¬Ã‹Å"': ''', # left single quotation mark
-            'ÃƒÂ¢Ã¢â€šÂ¬Ã¢â€žÂ¢': ''', # right single quotation mark
-            'ÃƒÂ¢Ã¢â€šÂ¬Ã…"': '"', # left double quotation mark
-            'ÃƒÂ¢Ã¢â€šÂ¬': '"', # right double quotation mark
-            'ÃƒÂ¢Ã¢â€šÂ¬Ã‚Â¦': '…', # horizontal ellipsis
-            '&amp;': '&', # ampersand
-            '&lt;': '<', # less than
-            '&gt;': '>', # greater than
-            '&quot;': '"', # quotation mark
-            '&#39;': "'", # apostrophe
-        }
+    def audit_chunk_selections(self, expected_names):
+        """
+        Compare the dropdown's selected labels against the names a chunk should have selected.
+        Returns a dict with 'missing' and 'unexpected' lists (both empty when 'All units' is shown).
+        """
+        state = self.get_selection_state()
+        if state is None:
+            print("Selection audit skipped - could not read dropdown state")
+            return {'missing': [], 'unexpected': []}
+
+        if state['all_units']:
+            print("Selection audit: dropdown shows 'All units' - every location is selected")
+            return {'missing': [], 'unexpected': []}
 
-        normalized = text
-        for old, new in replacements.items():
-            normalized = normalized.replace(old, new)
+        expected_names = [self.location_aliases.label_for(name) for name in expected_names]
+        selected = set(state['selected'])
+        expected = set(expected_names)
+        missing = [name for name in expected_names if name not in selected]
+        unexpected = [label for label in state['selected'] if label not in expected]
 
-        return normalized.strip()
+        print(f"Selection audit: {len(selected)} selected, {len(missing)} missing, {len(unexpected)} unexpected")
+        for name in missing[:5]:
+            print(f"  Missing: '{name}'")
+        for label in unexpected[:5]:
+            print(f"  Unexpected: '{label}'")
+
+        return {'missing': missing, 'unexpected': unexpected}
+
+    def normalize_text(self, text):
+        """Normalize text to handle encoding issues"""
+        return normalize_text(text)
 
     def load_names_from_file(self, file_path, column_name="Location Name"):
-        """Load names from CSV or Excel file with text normalization"""
-        if file_path.endswith('.csv'):
-            df = pd.read_csv(file_path, encoding='utf-8-sig') # Handle BOM
-        elif file_path.endswith(('.xlsx', '.xls')):
-            df = pd.read_excel(file_path)
-        else:
-            raise ValueError("File must be CSV or Excel format")
+        """
+        Load names from CSV or Excel file with text normalization.
+        The file is read and indexed once through LocationIndex, which is kept in self.location_index.
+        """
+        index = LocationIndex.load(file_path, column_name)
+        self.location_index = index
+        df = index.df
 
         print(f"Columns in your file: {list(df.columns)}")
 
-        # Use the Location Name column specifically
-        if column_name in df.columns:
-            names = df[column_name].tolist()
+        # Use the Location Name column specifically, falling back to the second column
+        if index.column == column_name:
             print(f"Using column: '{column_name}'")
         else:
-            # Fallback to second column if "Location Name" not found
-            names = df.iloc[:, 1].tolist()
-            print(f"Using second column: '{df.columns[1]}'")
+            print(f"Using second column: '{index.column}'")
+
+        index.show_normalization_diffs()
+
+        return list(index.names), df
 
-        # Remove any NaN values, convert to strings, and normalize text
-        names = [self.normalize_text(str(name)) for name in names if pd.notna(name)]
+    def prompt_for_region(self, all_names):
+        """Ask which region of the loaded names file to process; returns (region or None, names)"""
+        index = self.location_index
+        if not index.region_counts:
+            print("No 'Region' column found in the file. Using all locations.")
+            return None, all_names
 
-        # Show which names were normalized
-        original_names = [str(name) for name in df[column_name if column_name in df.columns else df.columns[1]].tolist() if pd.notna(name)]
-        for i, (orig, norm) in enumerate(zip(original_names, names)):
-            if orig != norm:
-                print(f"Normalized: '{orig}' → '{norm}'")
+        regions = index.regions()
+        print(f"\nAvailable regions:")
+        for i, region in enumerate(regions, 1):
+            print(f"  {i}. {region} ({index.region_counts[region]} locations)")
 
-        return names, df
+        try:
+            region_choice = int(input(f"Select region number (1-{len(regions)}): ").strip())
+        except ValueError:
+            print("Invalid input. Using all locations.")
+            return None, all_names
+        if not 1 <= region_choice <= len(regions):
+            print("Invalid number. Using all locations.")
+            return None, all_names
+
+        selected_region = regions[region_choice - 1]
+        names = index.names_in_region(selected_region)
+        print(f"Filtered to {len(names)} locations in {selected_region}")
+        return selected_region, names
+
+    def build_option_index(self):
+        """Snapshot the open menu into a normalized label -> option element index with one script call"""
+        try:
+            snapshot = self.driver.execute_script(OPTION_INDEX_SCRIPT)
+        except Exception as e:
+            print(f"Could not index the dropdown options: {e}")
+            self.option_index = None
+            return None
+
+        elements = {}
+        for label, element in zip(snapshot['labels'], snapshot['elements']):
+            elements.setdefault(label, element)
+        self.option_index = {'generation': snapshot['generation'], 'elements': elements}
+        print(f"Indexed {len(elements)} dropdown options")
+        return self.option_index
+
+    def check_option_index(self, state):
+        """Drop the option index unless the page state shows the menu it was built from is unchanged"""
+        page_index = state.get('option_index') if state else None
+        if self.option_index and not (page_index and not page_index['stale']
+                                      and page_index['generation'] == self.option_index['generation']):
+            self.option_index = None
+
+    def search_texts(self, names):
+        """What to type into the dropdown's search input for each name: its unique prefix in the names file"""
+        prefixes = self.location_index.search_prefixes if self.location_index else {}
+        return {name: prefixes.get(name, name) for name in names}
+
+    def search_for_option(self, target_text, timeout=5):
+        """
+        Type target_text's unique prefix into the dropdown's search input and return its option from the
+        filtered menu, so virtualized menus that have not rendered it yet do not matter. Returns None if
+        the option is not there; switches searching off for the session if typing does not filter the menu.
+        """
+        text = self.search_texts([target_text])[target_text]
+        try:
+            outcome = self.driver.execute_async_script(SEARCH_OPTION_SCRIPT, target_text, text, int(timeout * 1000))
+        except Exception as e:
+            print(f"Searching the dropdown for '{target_text}' failed: {e}")
+            return None
+
+        status = outcome.get('status') if outcome else None
+        if status == 'found':
+            print(f"Found '{target_text}' by searching '{text}'")
+            return outcome['element']
+        if status == 'timeout':
+            print("Typing into the dropdown does not filter its options - turning search off for this session")
+            self.search_selection = False
+        elif status == 'not_found':
+            print(f"Searching '{text}' did not show '{target_text}'")
+        return None
 
     def find_clickable_dropdown_option(self, target_text):
         """
-        Find the actual clickable dropdown option element using multiple strategies
+        Find the clickable option element for target_text in the open menu.
+        Uses the option index while the menu it was built from is unchanged, then the search input,
+        then a fresh option index, and only then the XPath strategies.
         """
+        label = ' '.join(str(target_text).split())
+        element = self.option_index['elements'].get(label) if self.option_index else None
+        if element is None and self.search_selection:
+            element = self.search_for_option(target_text)
+            if element is not None:
+                return element
+        if element is None:
+            index = self.build_option_index()
+            element = index['elements'].get(label) if index else None
+        if element is not None:
+            print(f"Found '{target_text}' in the option index")
+            return element
+
         print(f"Finding clickable element for: '{target_text}'")
 
         # Strategy 1: Target dropdown menu options specifically
@@ -343,21 +2826,70 @@ class FixedDropdownAutomator:
         return None
 
     def click_dropdown_and_select(self, target_text):
+        """
+        Select a location, through its saved alias if it has one. When no option matches, the closest
+        dropdown label is tried instead (see select_fuzzy_match). Returns True if something was selected.
+        """
+        label = self.location_aliases.label_for(target_text)
+        if self.select_dropdown_option(label):
+            return True
+        return self.select_fuzzy_match(target_text, tried=label)
+
+    def snapshot_dropdown_labels(self, timeout=30):
+        """Every option label of the dropdown, read in one script call that scrolls through virtualized menus"""
+        try:
+            outcome = self.driver.execute_async_script(LABEL_SNAPSHOT_SCRIPT, int(timeout * 1000))
+        except Exception as e:
+            print(f"Could not read the dropdown labels: {e}")
+            return []
+        if outcome.get('error'):
+            print(f"Reading the dropdown labels: {outcome['error']}")
+        labels = [label for label in outcome.get('labels', []) if label != 'Select All']
+        print(f"Read {len(labels)} dropdown labels for fuzzy matching")
+        return labels
+
+    def select_fuzzy_match(self, name, tried=None):
+        """
+        Select the dropdown label closest to a name that matched no option, if it scores at least
+        fuzzy_threshold, clearly beats the runner-up and the user confirms it. A confirmed match is
+        saved as the name's alias, so later runs select it directly. Non-interactive runs cannot
+        confirm: they save the candidates as a proposal for the next interactive run and skip the name.
+        """
+        if self.label_matcher is None:
+            labels = self.snapshot_dropdown_labels()
+            if not labels:
+                return False
+            self.label_matcher = LabelMatcher(labels)
+
+        match = self.label_matcher.best_match(name, self.fuzzy_threshold)
+        if match is None or match[0] in (name, tried):
+            print(f"No confident dropdown match for '{name}'")
+            return False
+
+        label, score = match
+        print(f"Closest dropdown label for '{name}': '{label}' (score {score:.2f})")
+        if not self.interactive:
+            candidates = self.label_matcher.candidates(name)
+            self.location_aliases.propose(name, candidates)
+            print(f"Not selected without confirmation - candidates {candidates} saved as a proposal "
+                  f"in '{self.location_aliases.path}'")
+            return False
+        if input("Select it and remember it for this location? (y/n): ").strip().lower() != 'y':
+            return False
+        if not self.select_dropdown_option(label):
+            return False
+
+        self.location_aliases.confirm(name, label, score)
+        print(f"Saved alias '{name}' → '{label}' in '{self.location_aliases.path}'")
+        return True
+
+    def select_dropdown_option(self, target_text):
         """
         Enhanced dropdown selection with better element targeting
         """
         print(f"Attempting to select: '{target_text}'")
 
-        # Get the current first selection dynamically
-        current_anchor = self.get_current_first_selection()
-
-        if current_anchor:
-            print(f"Using current anchor: '{current_anchor}'")
-            dropdown_xpath = f"//div[./span[text()='{current_anchor}']]"
-        else:
-            # No selections yet - look for 'Select...' text
-            print("No selections found - using 'Select...' as anchor")
-            dropdown_xpath = "//div[text()='Select...']"
+        current_anchor = None
 
         try:
             # Step 1: Click the dropdown to open it with retries for stale elements
@@ -367,11 +2899,18 @@ class FixedDropdownAutomator:
             max_retries = 3
             for attempt in range(max_retries):
                 try:
-                    dropdown_button = self.wait.until(
-                        EC.element_to_be_clickable((By.XPATH, dropdown_xpath))
-                    )
+                    # Read the anchor and menu state in one round trip
+                    dropdown_button, state = self.get_dropdown_anchor()
+                    current_anchor = state['anchor_text']
+                    print(f"Using current anchor: '{current_anchor if current_anchor else 'Select...'}'")
+
+                    if state['menu_open']:
+                        print("Dropdown is already open")
+                        self.check_option_index(state)
+                        break
 
                     print("Clicking dropdown button...")
+                    self.option_index = None # the menu renders afresh
                     dropdown_button.click()
                     print("Successfully opened dropdown")
                     break # Success, exit retry loop
@@ -379,20 +2918,14 @@ class FixedDropdownAutomator:
                 except Exception as dropdown_error:
                     if "stale element" in str(dropdown_error).lower() and attempt < max_retries - 1:
                         print(f"Stale element on attempt {attempt + 1}, refreshing anchor...")
-                        # Refresh the anchor and try again
-                        current_anchor = self.get_current_first_selection()
-                        if current_anchor:
-                            dropdown_xpath = f"//div[./span[text()='{current_anchor}']]"
-                        else:
-                            dropdown_xpath = "//div[text()='Select...']"
-                        time.sleep(0.08) # Brief pause before retry
+                        self.wait_for_dropdown_state('dom_quiet', 50, timeout=1) # Let the control re-render
                         continue
                     else:
                         raise dropdown_error # Re-raise if not stale element or max retries reached
 
             # Step 2: Wait for dropdown to load and find the clickable element
             print(f"Looking for clickable option: '{target_text}'...")
-            time.sleep(0.08) # Give dropdown time to fully load
+            self.wait_for_dropdown_state('menu_open') # Returns as soon as the options render
 
             # Use enhanced element finding
             option_element = self.find_clickable_dropdown_option(target_text)
@@ -405,38 +2938,99 @@ class FixedDropdownAutomator:
 
             # Step 3: Try JavaScript click first (solves the Apple House issue)
             try:
-                self.driver.execute_script("arguments[0].click();", option_element)
-                print(f"Successfully selected using JavaScript click: '{target_text}'")
-                return True
+                # Click inside the wait script so the selection change is observed in the same call
+                changed = self.wait_for_dropdown_state('selection_changed', timeout=2, click_element=option_element)
             except Exception as js_error:
                 print(f"JavaScript click failed: {js_error}")
+                self.option_index = None
 
                 # Fallback to standard click
                 try:
                     option_element.click()
-                    print(f"Successfully selected using standard click: '{target_text}'")
-                    return True
                 except Exception as std_error:
                     print(f"Standard click also failed: {std_error}")
                     return False
+                if not self.is_selected(target_text):
+                    print(f"Standard click did not select '{target_text}'")
+                    return False
+                print(f"Successfully selected using standard click: '{target_text}'")
+                return True
+
+            # The change may have landed just after the wait gave up, so look at the selection itself
+            if not changed and not self.is_selected(target_text):
+                print(f"Click on '{target_text}' did not register")
+                self.option_index = None
+                return False
+            print(f"Successfully selected using JavaScript click: '{target_text}'")
+            return True
 
         except Exception as e:
             print(f"Failed to select '{target_text}': {str(e)}")
             print(f"   Attempted anchor: '{current_anchor if current_anchor else 'Select...'}'")
             return False
 
+    def select_names_in_batch(self, names, step_timeout_ms=5000):
+        """
+        Select a whole list of names with one injected script call.
+        The script types each name's unique prefix into the dropdown's search input and clicks the exact
+        match in the filtered menu (or, with searching off, opens the menu and scans its labels),
+        reopening the menu only when the control closes it after a selection.
+        Names with a saved alias are selected by their label. Names the script cannot find, or whose
+        click never showed up as a badge, are retried with click_dropdown_and_select, which falls back
+        to fuzzy matching.
+        Returns a dict mapping each name to True (selected) or False (failed).
+        """
+        print(f"Batch selecting {len(names)} names...")
+        start_time = time.time()
+        labels = {name: self.location_aliases.label_for(name) for name in names}
+
+        try:
+            search_texts = self.search_texts(labels.values()) if self.search_selection else None
+            outcome = self.driver.execute_async_script(BATCH_SELECT_SCRIPT, [labels[name] for name in names],
+                                                       step_timeout_ms, search_texts)
+        except Exception as e:
+            print(f"Batch selection script failed: {e}")
+            outcome = None
+
+        if not outcome:
+            print("Falling back to one-by-one selection...")
+            return {name: self.click_dropdown_and_select(name) for name in names}
+
+        if outcome.get('error'):
+            print(f"Batch selection stopped early: {outcome['error']}")
+        if outcome.get('search_disabled'):
+            print("Typing into the dropdown does not filter its options - turning search off for this session")
+            self.search_selection = False
+
+        statuses = outcome.get('results') or {}
+        results = {}
+        for name in names:
+            if name in results:
+                continue
+            status = statuses.get(labels[name])
+            if status in ('selected', 'already_selected'):
+                results[name] = True
+            else:
+                print(f"Batch could not resolve '{name}' ({status or 'not attempted'}) - retrying individually...")
+                results[name] = self.click_dropdown_and_select(name)
+
+        selected_count = sum(1 for ok in results.values() if ok)
+        print(f"Batch selection complete: {selected_count}/{len(results)} selected in {time.time() - start_time:.1f}s")
+        return results
+
     def clear_all_selections(self):
         """Clear all selections using the Select All double-click method"""
         try:
             print("Clearing all selections...")
 
-            # Get current anchor dynamically
-            current_anchor = self.get_current_first_selection()
+            # Read the current selection state in one round trip
+            state = self.get_selection_state()
 
-            if not current_anchor:
+            if not state or not (state['selected'] or state['all_units']):
                 print("No selections to clear - dropdown is already empty")
                 return True
 
+            current_anchor = state['anchor_text']
             print(f"Current anchor detected: '{current_anchor}'")
 
             # Use the proven Select All double-click method
@@ -445,10 +3039,9 @@ class FixedDropdownAutomator:
 
                 # Step 1: Open dropdown using current anchor
                 print(f"Opening dropdown using '{current_anchor}' as anchor...")
-                dropdown_xpath = f"//div[./span[text()='{current_anchor}']]"
-                dropdown_button = self.driver.find_element(By.XPATH, dropdown_xpath)
-                dropdown_button.click()
-                time.sleep(.05)
+                if not state['menu_open']:
+                    state['anchor'].click()
+                self.wait_for_dropdown_state('menu_open')
                 print("Dropdown opened")
 
                 # Step 2: Click Select All to select everything (this creates "All units")
@@ -458,34 +3051,35 @@ class FixedDropdownAutomator:
                 )
 
                 print("Clicking 'Select All' to select everything...")
-                select_all_element.click()
-                time.sleep(.05) # Wait for all selections to register
+                self.wait_for_dropdown_state('selection_changed', click_element=select_all_element) # Wait for all selections to register
                 print("All items selected (including 'All units')")
 
                 # Step 3: Get fresh anchor - should now be "All units"
-                fresh_anchor = self.get_current_first_selection()
-                print(f"Opening dropdown again using fresh anchor: '{fresh_anchor}'...")
+                fresh_dropdown_button, fresh_state = self.get_dropdown_anchor()
+                print(f"Opening dropdown again using fresh anchor: '{fresh_state['anchor_text']}'...")
 
-                fresh_dropdown_xpath = f"//div[./span[text()='{fresh_anchor}']]"
-                fresh_dropdown_button = self.wait.until(
-                    EC.element_to_be_clickable((By.XPATH, fresh_dropdown_xpath))
-                )
-                fresh_dropdown_button.click()
-                time.sleep(0.08)
+                if not fresh_state['menu_open']:
+                    fresh_dropdown_button.click()
+                self.wait_for_dropdown_state('menu_open')
                 print("Dropdown reopened")
 
                 # Step 4: Click Select All again to deselect everything
                 print("Looking for 'Select All' element again to deselect...")
-                time.sleep(0.08)
                 select_all_elements = self.driver.find_elements(By.XPATH, "//*[text()='Select All']")
 
                 if select_all_elements:
                     select_all_fresh = select_all_elements[0]
                     print("Clicking 'Select All' again to deselect everything...")
 
-                    # Use JavaScript click to avoid stale element issues
-                    self.driver.execute_script("arguments[0].click();", select_all_fresh)
-                    time.sleep(0.08) # Wait for deselection to complete
+                    # Use JavaScript click to avoid stale element issues, waiting for deselection to complete
+                    self.wait_for_dropdown_state('selection_empty', click_element=select_all_fresh)
+
+                    # Verify the control is back to its empty state
+                    cleared_state = self.get_selection_state()
+                    if cleared_state and (cleared_state['selected'] or cleared_state['all_units']):
+                        remaining = 'All units' if cleared_state['all_units'] else len(cleared_state['selected'])
+                        print(f"Clear verification failed - selections still present: {remaining}")
+                        return False
 
                     print("All selections cleared!")
                     return True
@@ -495,6 +3089,10 @@ class FixedDropdownAutomator:
             except Exception as select_all_error:
                 print(f"Select All method failed: {select_all_error}")
 
+                if not self.interactive:
+                    print("Automatic clearing failed (non-interactive - no manual fallback).")
+                    return False
+
                 # Manual fallback
                 print("Automatic clearing failed. Manual intervention required.")
                 print("Please manually clear the selections:")
@@ -507,8 +3105,9 @@ class FixedDropdownAutomator:
 
         except Exception as e:
             print(f"Error during clear operation: {str(e)}")
-            print("Please manually clear selections and press Enter...")
-            input()
+            if self.interactive:
+                print("Please manually clear selections and press Enter...")
+                input()
             return False
 
     def select_all_from_dropdown(self):
@@ -516,15 +3115,12 @@ class FixedDropdownAutomator:
         try:
             print("Opening dropdown to access 'Select All' option...")
 
-            # Open dropdown using Select... anchor (since we start with empty selection)
-            dropdown_xpath = "//div[text()='Select...']"
-
+            # Open dropdown using the current anchor ('Select...' when the selection is empty)
             try:
-                dropdown_button = self.wait.until(
-                    EC.element_to_be_clickable((By.XPATH, dropdown_xpath))
-                )
-                dropdown_button.click()
-                time.sleep(0.08)
+                dropdown_button, state = self.get_dropdown_anchor()
+                if not state['menu_open']:
+                    dropdown_button.click()
+                self.wait_for_dropdown_state('menu_open')
                 print("Dropdown opened successfully")
             except Exception as e:
                 print(f"Failed to open dropdown: {e}")
@@ -538,13 +3134,13 @@ class FixedDropdownAutomator:
                 )
 
                 print("Clicking 'Select All'...")
-                # Use JavaScript click for reliability
-                self.driver.execute_script("arguments[0].click();", select_all_element)
-                time.sleep(0.08) # Wait for all selections to register
+                # Use JavaScript click for reliability, waiting for all selections to register
+                self.wait_for_dropdown_state('selection_nonempty', click_element=select_all_element)
 
                 # Verify selection worked by checking for "All units" or selected items
-                current_selection = self.get_current_first_selection()
-                if current_selection:
+                state = self.get_selection_state()
+                if state and (state['all_units'] or state['selected']):
+                    current_selection = 'All units' if state['all_units'] else state['selected'][0]
                     print(f"Success! Current selection shows: '{current_selection}'")
                     return True
                 else:
@@ -641,6 +3237,7 @@ class FixedDropdownAutomator:
         Finds and clicks the 'Generate CSV' link, waiting for it to become clickable.
         """
         print("Waiting for 'Generate CSV' link to become clickable...")
+        self.csv_link_timed_out = False
         try:
             long_wait = WebDriverWait(self.driver, 60)
 
@@ -653,6 +3250,7 @@ class FixedDropdownAutomator:
             return True
         except TimeoutException:
             print("Timed out waiting for 'Generate CSV' link to be clickable. Report generation may have failed or taken too long.")
+            self.csv_link_timed_out = True
             return False
         except Exception as e:
             print(f"An error occurred while clicking the generate CSV link: {e}")
@@ -667,6 +3265,10 @@ class FixedDropdownAutomator:
         print("GENERATING REPORT FOR CURRENT SELECTIONS")
         print("="*50)
 
+        # Timing of this report, read by the adaptive chunk scheduler
+        report_start = time.time()
+        self.last_report = {'seconds': None, 'timed_out': False, 'no_records': False}
+
         # Step 1: Click Generate Report button
         if not self.find_and_click_generate_button():
             print("Failed to click Generate Report button")
@@ -678,10 +3280,14 @@ class FixedDropdownAutomator:
         # Step 3: Check for No Records message
         if self.check_for_no_records_message():
             print("No records found for current selections - skipping CSV download")
+            self.last_report.update(seconds=time.time() - report_start, no_records=True)
             return True # This is actually successful - just no data
 
         # Step 4: Download CSV if records exist
-        if not self.find_and_click_generate_csv():
+        csv_clicked = self.find_and_click_generate_csv()
+        self.last_report['seconds'] = time.time() - report_start
+        if not csv_clicked:
+            self.last_report['timed_out'] = self.csv_link_timed_out
             print("Failed to download CSV")
             return False
 
@@ -730,6 +3336,104 @@ class FixedDropdownAutomator:
             })
         return chunks
 
+    def create_balanced_chunks(self, names, chunk_size, table=None):
+        """
+        Split names into as many chunks as create_chunks would, but packed so every chunk has
+        about the same expected row count (from the row count table). A chunk may hold up to
+        twice chunk_size names. Falls back to create_chunks when there is no history.
+        Chunk start/end indexes number the names in packed order.
+        Pass an already loaded table to re-pack quietly (as adaptive rescheduling does).
+        """
+        announce = table is None
+        table = table or LocationRowCounts(self.row_counts_file)
+        if not table.locations or len(names) <= chunk_size:
+            return self.create_chunks(names, chunk_size)
+
+        costs = table.expected_rows(names, self.report_days())
+        if announce:
+            known = sum(1 for name in names if table.rows_per_day(name) is not None)
+            print(f"Balancing chunks by expected report size ({known}/{len(names)} locations have row count history)")
+
+        chunks = []
+        position = 1
+        for indexes in pack_balanced_chunks(names, costs, math.ceil(len(names) / chunk_size), chunk_size * 2):
+            chunks.append({
+                'items': [names[i] for i in indexes],
+                'start_index': position,
+                'end_index': position + len(indexes) - 1,
+                'size': len(indexes),
+                'expected_rows': int(sum(costs[i] for i in indexes))
+            })
+            position += len(indexes)
+        return chunks
+
+    def record_location_row_counts(self, merged_file_path, names):
+        """
+        Count the consolidated report's rows per location and blend them into the row count table.
+        names are the locations whose reports succeeded; any without rows are recorded as empty.
+        """
+        if not merged_file_path or not os.path.exists(merged_file_path):
+            return
+        update_location_row_counts(self.row_counts_file, [merged_file_path], self.report_days(), names)
+
+    def split_chunk(self, chunks, index):
+        """Replace chunks[index] with its two halves (both keep the chunk's shard dates)"""
+        chunk = chunks[index]
+        half = (chunk['size'] + 1) // 2
+        dates = {key: chunk[key] for key in ('from_date', 'to_date') if key in chunk}
+        first = {'items': chunk['items'][:half], 'start_index': chunk['start_index'],
+                 'end_index': chunk['start_index'] + half - 1, 'size': half, **dates}
+        second = {'items': chunk['items'][half:], 'start_index': chunk['start_index'] + half,
+                  'end_index': chunk['end_index'], 'size': chunk['size'] - half, **dates}
+        chunks[index:index + 1] = [first, second]
+
+    def reschedule_remaining_chunks(self, chunks, completed, chunk_size, table=None):
+        """
+        Re-split every chunk after the first `completed` into chunks of chunk_size, in place.
+        Consecutive chunks of the same date shard are re-split together, never across shards.
+        With a row count table the names are re-packed by expected report size (create_balanced_chunks).
+        """
+        remaining = chunks[completed:]
+        if not remaining:
+            return
+
+        groups = []
+        for chunk in remaining:
+            dates = (chunk.get('from_date'), chunk.get('to_date'))
+            if groups and groups[-1][0] == dates:
+                groups[-1][1].append(chunk)
+            else:
+                groups.append((dates, [chunk]))
+
+        new_chunks = []
+        for (from_date, to_date), group in groups:
+            offset = group[0]['start_index'] - 1
+            items = [item for chunk in group for item in chunk['items']]
+            packed = self.create_balanced_chunks(items, chunk_size, table) if table else self.create_chunks(items, chunk_size)
+            for chunk in packed:
+                chunk['start_index'] += offset
+                chunk['end_index'] += offset
+                if from_date:
+                    chunk['from_date'], chunk['to_date'] = from_date, to_date
+                new_chunks.append(chunk)
+        chunks[completed:] = new_chunks
+
+    def report_days(self, chunk=None):
+        """Number of days in the chunk's shard, or the session's report date range (30 if the dates are unknown)"""
+        chunk = chunk or {}
+        try:
+            from_date = datetime.strptime(chunk.get('from_date', self.from_date), "%d/%m/%Y")
+            to_date = datetime.strptime(chunk.get('to_date', self.to_date), "%d/%m/%Y")
+        except (TypeError, ValueError):
+            return 30
+        return max(1, (to_date - from_date).days + 1)
+
+    def apply_chunk_dates(self, chunk):
+        """Per-chunk page setup: enter the chunk's shard dates (or the session dates) if the page shows other dates"""
+        dates = (chunk.get('from_date', self.from_date), chunk.get('to_date', self.to_date))
+        if dates[0] and dates[1] and dates != self.page_dates:
+            self.enter_report_dates(*dates)
+
     def process_chunk(self, chunk, chunk_num, total_chunks):
         """Process a single chunk of items (original manual version)"""
         print(f"\n{'='*70}")
@@ -791,8 +3495,6 @@ class FixedDropdownAutomator:
                 failed_selections.append(name)
                 consecutive_failures += 1
 
-            time.sleep(0.08) # Small delay between selections
-
         # Chunk summary
         print(f"\n{'='*50}")
         print(f"CHUNK {chunk_num} SUMMARY")
@@ -827,17 +3529,23 @@ class FixedDropdownAutomator:
         successful_selections = 0
         failed_selections = []
 
-        for i, name in enumerate(chunk['items'], 1):
-            print(f"\nSelecting {i}/{chunk['size']}: '{name}'")
+        if self.batch_selection:
+            selection_results = self.select_names_in_batch(chunk['items'])
+            successful_selections = sum(1 for ok in selection_results.values() if ok)
+            failed_selections = [name for name, ok in selection_results.items() if not ok]
+        else:
+            for i, name in enumerate(chunk['items'], 1):
+                print(f"\nSelecting {i}/{chunk['size']}: '{name}'")
 
-            success = self.click_dropdown_and_select(name)
+                success = self.click_dropdown_and_select(name)
 
-            if success:
-                successful_selections += 1
-            else:
-                failed_selections.append(name)
+                if success:
+                    successful_selections += 1
+                else:
+                    failed_selections.append(name)
 
-            time.sleep(0.08) # Small delay between selections
+        # Audit the control against what this chunk should have selected
+        self.audit_chunk_selections([name for name in chunk['items'] if name not in failed_selections])
 
         # Chunk selection summary
         print(f"\n{'='*50}")
@@ -857,134 +3565,116 @@ class FixedDropdownAutomator:
 
         return successful_selections, failed_selections, report_success
         
-    def consolidate_csv_files(self, directory, downloaded_files_count):
-        """Consolidates multiple CSV files from a directory into a single file with Region mapping."""
-        print("\n" + "="*50)
-        print("CONSOLIDATING CSV FILES WITH REGION MAPPING")
-        print("="*50)
-
-        # Get the list of all CSV files in the download directory
-        csv_files = [f for f in os.listdir(directory) if f.endswith('.csv')]
-        
-        if not csv_files:
-            print("No CSV files found to consolidate.")
-            return
+    def consolidate_csv_files(self, directory, downloaded_files_count, read_chunk_rows=50000):
+        """
+        Consolidates multiple CSV files from a directory into a single file with Region mapping.
+        Every file goes through a ConsolidationPipeline: it is read in chunks of read_chunk_rows into an
+        enriched part file, then the parts are concatenated, so memory use is bounded by the chunk size.
+        Date-shard downloads (shard_<from>-<to>_chunk_<n>.csv) are stitched in shard date order and
+        trimmed to their own date range, so shards that overlap at the edges do not duplicate rows.
+        """
+        return ConsolidationPipeline(self, directory, read_chunk_rows).finish(downloaded_files_count)
 
-        print(f"Found {len(csv_files)} CSV files in '{directory}'.")
-        
-        # Check if the downloaded count matches the found count
-        if len(csv_files) != downloaded_files_count:
-            print(f"WARNING: Expected {downloaded_files_count} files, but found {len(csv_files)}. "
-                  f"Some files may not have finished downloading. Proceeding anyway...")
+    def open_columnar_writer(self, base_path):
+        """ColumnarReportWriter for the enabled columnar formats, or None if none are enabled or pyarrow is missing"""
+        if not (self.parquet_output or self.arrow_output):
+            return None
+        if pa is None:
+            print("pyarrow is not installed - skipping the Parquet/Arrow output (pip install pyarrow)")
+            return None
+        return ColumnarReportWriter(base_path, parquet=self.parquet_output, arrow=self.arrow_output)
+
+    def write_columnar_copy(self, csv_path, read_chunk_rows=50000):
+        """Stream an existing consolidated CSV into the enabled columnar formats; returns the paths written"""
+        writer = self.open_columnar_writer(os.path.splitext(csv_path)[0])
+        if writer is None or not os.path.exists(csv_path):
+            return []
+        for df in MarReportReader(read_chunk_rows).read(csv_path):
+            writer.write(df)
+        return writer.close()
+
+    def load_into_database(self, csv_path, read_chunk_rows=50000):
+        """Upsert an existing consolidated CSV into the MAR database, one transaction per read chunk"""
+        if not self.database_file or not csv_path or not os.path.exists(csv_path):
+            return 0
+        database = MarDatabase(self.database_file, self.database_key_columns)
+        try:
+            rows = sum(database.upsert([df]) for df in MarReportReader(read_chunk_rows).read(csv_path))
+        except ValueError as e:
+            print(f"Could not load '{csv_path}' into the MAR database: {e}")
+            return 0
+        finally:
+            database.close()
+        print(f"{rows} rows upserted into the MAR database '{self.database_file}'")
+        return rows
+
+    def print_database_summary(self):
+        """Row total and region distribution of the whole MAR database, from its indexes"""
+        database = MarDatabase(self.database_file)
+        try:
+            print(f"\nMAR database '{self.database_file}': {database.row_count()} rows across all runs")
+            for region, count in database.region_counts()[:10]:
+                print(f"  {region}: {count} records")
+        finally:
+            database.close()
 
-        # Load the master list for region mapping
+    def load_location_lookup(self):
+        """
+        The location lookup table of the master list (the global NAMES_FILE), from its LocationIndex.
+        Returns None if the file cannot be read or lacks 'Location Name' and 'Region'.
+        """
         master_file_path = NAMES_FILE  # Use the global NAMES_FILE variable
         print(f"Loading master list from: '{master_file_path}'")
-        
+
         try:
-            if master_file_path.endswith('.csv'):
-                master_df = pd.read_csv(master_file_path, encoding='utf-8-sig')
-            elif master_file_path.endswith(('.xlsx', '.xls')):
-                master_df = pd.read_excel(master_file_path)
-            else:
-                print("Master file must be CSV or Excel format. Proceeding without region mapping.")
-                master_df = None
+            index = LocationIndex.load(master_file_path)
         except Exception as e:
             print(f"Error loading master file: {e}. Proceeding without region mapping.")
-            master_df = None
-
-        # Create region lookup dictionary if master file loaded successfully
-        region_lookup = {}
-        if master_df is not None and 'Location Name' in master_df.columns and 'Region' in master_df.columns:
-            print("Creating region lookup dictionary...")
-            for _, row in master_df.iterrows():
-                if pd.notna(row['Location Name']) and pd.notna(row['Region']):
-                    location_name = self.normalize_text(str(row['Location Name']))
-                    region = str(row['Region']).strip()
-                    region_lookup[location_name] = region
-            print(f"Region lookup created with {len(region_lookup)} entries")
-        else:
-            print("Master file doesn't have required columns 'Location Name' and 'Region'. Proceeding without region mapping.")
+            return None
 
-        # Create a new directory for the merged file
-        merged_dir = os.path.join(directory, "Merged_Reports")
-        if not os.path.exists(merged_dir):
-            os.makedirs(merged_dir)
-            print(f"Created directory for merged reports: '{merged_dir}'")
-        
-        merged_file_path = os.path.join(merged_dir, f"Consolidated_MAR_Report_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
-        
-        # Initialize consolidated dataframe
-        consolidated_df = pd.DataFrame()
-        
-        # Process each CSV file
-        for i, filename in enumerate(csv_files):
-            file_path = os.path.join(directory, filename)
-            try:
-                df = pd.read_csv(file_path)
-                print(f"Processing file {i+1}/{len(csv_files)}: '{filename}' ({len(df)} rows)")
-                
-                # Add Region column if we have the lookup data and the file has 'Care Service' column
-                if region_lookup and 'Care Service' in df.columns:
-                    print("  Mapping regions based on Care Service...")
-                    
-                    # Create Region column by mapping Care Service to Location Name in master list
-                    df['Region'] = df['Care Service'].apply(lambda x: 
-                        region_lookup.get(self.normalize_text(str(x)) if pd.notna(x) else '', 'Unknown Region')
-                    )
-                    
-                    # Count successful mappings
-                    mapped_count = len(df[df['Region'] != 'Unknown Region'])
-                    total_count = len(df)
-                    print(f"  Successfully mapped {mapped_count}/{total_count} records to regions")
-                    
-                    if mapped_count < total_count:
-                        unmapped_services = df[df['Region'] == 'Unknown Region']['Care Service'].unique()[:5]
-                        print(f"  Sample unmapped Care Services: {list(unmapped_services)}")
-                
-                elif not region_lookup:
-                    print("  No region lookup available - adding placeholder Region column")
-                    df['Region'] = 'No Region Data'
-                elif 'Care Service' not in df.columns:
-                    print(f"  WARNING: 'Care Service' column not found in {filename}. Available columns: {list(df.columns)}")
-                    df['Region'] = 'Missing Care Service Column'
-                
-                # Append to consolidated dataframe
-                if consolidated_df.empty:
-                    consolidated_df = df
-                else:
-                    # Use concat instead of append (which is deprecated)
-                    consolidated_df = pd.concat([consolidated_df, df], ignore_index=True)
-                    
-            except Exception as e:
-                print(f"  Error processing '{filename}': {e}. Skipping this file.")
-        
-        # Save the consolidated file
-        try:
-            consolidated_df.to_csv(merged_file_path, index=False)
-            print(f"\nConsolidation complete!")
-            print(f"Final merged report saved to: '{merged_file_path}'")
-            print(f"Total consolidated records: {len(consolidated_df)}")
-            
-            # Show region distribution if regions were mapped
-            if 'Region' in consolidated_df.columns and region_lookup:
-                print(f"\nRegion distribution in consolidated file:")
-                region_counts = consolidated_df['Region'].value_counts()
-                for region, count in region_counts.head(10).items():
-                    print(f"  {region}: {count} records")
-                if len(region_counts) > 10:
-                    print(f"  ... and {len(region_counts) - 10} more regions")
-                    
-        except Exception as e:
-            print(f"Error saving consolidated file: {e}")  
-            # print("Cleanup complete.")
+        if index.lookup is None:
+            print("Master file doesn't have required columns 'Location Name' and 'Region'. Proceeding without region mapping.")
+            return None
+        lookup = self.location_aliases.extend_lookup(index.lookup)
+        print(f"Location lookup ready with {len(lookup)} entries")
+        return lookup
 
+    def add_location_columns(self, df, location_lookup, filename, quiet=False):
+        """
+        Add Region (plus Business ID and Location Address when available) to one chunk of a MAR report.
+        Each distinct Care Service is normalized once and all columns are joined in a single reindex.
+        """
+        defaults = {'Region': 'Unknown Region', 'Business ID': 'Unknown Business ID', 'Location Address': 'Unknown Address'}
+
+        if location_lookup is not None and 'Care Service' in df.columns:
+            if not quiet:
+                print("  Mapping locations based on Care Service...")
+
+            # Join every enrichment column in one pass over the chunk
+            matched = location_lookup.reindex(normalize_text_series(df['Care Service']).to_numpy())
+            for column in location_lookup.columns:
+                values = matched[column]
+                if defaults[column] not in values.cat.categories:
+                    values = values.cat.add_categories([defaults[column]])
+                df[column] = values.fillna(defaults[column]).array
+
+        elif location_lookup is None:
+            if not quiet:
+                print("  No region lookup available - adding placeholder Region column")
+            df['Region'] = 'No Region Data'
+        elif 'Care Service' not in df.columns:
+            if not quiet:
+                print(f"  WARNING: 'Care Service' column not found in {filename}. Available columns: {list(df.columns)}")
+            for column in location_lookup.columns:
+                df[column] = 'Missing Care Service Column'
+
+        return df
 
     def process_in_chunks(self, names_file, column_name="Location Name"):
         """Main function for chunked processing (manual report generation)"""
 
         # Check for existing progress
-        existing_progress = self.load_chunking_progress("chunking_progress.json")
+        existing_progress = self.load_chunking_progress(self.progress_file)
         resume_session = False
 
         if existing_progress:
@@ -1011,20 +3701,14 @@ class FixedDropdownAutomator:
                 print("Resuming previous session...")
             elif resume_choice == "2":
                 print("Starting new chunking session...")
-                self.clear_chunking_progress("chunking_progress.json")
+                self.clear_chunking_progress(self.progress_file)
             else:
                 print("Cancelled.")
                 return
 
         if not resume_session:
             # Load names from file
-            all_names, df = self.load_names_from_file(names_file, column_name)
-
-            # Determine which column was actually used
-            if column_name in df.columns:
-                actual_column = column_name
-            else:
-                actual_column = df.columns[1]
+            all_names, _ = self.load_names_from_file(names_file, column_name)
 
             print(f"Loaded {len(all_names)} total names from file")
 
@@ -1039,33 +3723,7 @@ class FixedDropdownAutomator:
             region_filter = None
 
             if filter_choice == "2":
-                if "Region" not in df.columns:
-                    print("No 'Region' column found in the file. Using all locations.")
-                    names = all_names
-                else:
-                    regions = df["Region"].dropna().unique().tolist()
-                    regions.sort()
-
-                    print(f"\nAvailable regions:")
-                    for i, region in enumerate(regions, 1):
-                        count = len(df[df["Region"] == region])
-                        print(f"  {i}. {region} ({count} locations)")
-
-                    try:
-                        region_choice = int(input(f"Select region number (1-{len(regions)}): ").strip())
-                        if 1 <= region_choice <= len(regions):
-                            selected_region = regions[region_choice - 1]
-                            region_filter = selected_region
-                            filtered_df = df[df["Region"] == selected_region]
-                            names = filtered_df[actual_column].dropna().tolist()
-                            names = [self.normalize_text(str(name)) for name in names]
-                            print(f"Filtered to {len(names)} locations in {selected_region}")
-                        else:
-                            print("Invalid number. Using all locations.")
-                            names = all_names
-                    except ValueError:
-                        print("Invalid input. Using all locations.")
-                        names = all_names
+                region_filter, names = self.prompt_for_region(all_names)
             else:
                 names = all_names
 
@@ -1167,7 +3825,6 @@ class FixedDropdownAutomator:
                 clear_success = self.clear_all_selections()
                 if not clear_success:
                     print("Clear failed - continuing anyway...")
-                time.sleep(0.08)
 
             # Process the chunk
             successful, failed = self.process_chunk(chunk, chunk_num, total_chunks)
@@ -1207,7 +3864,7 @@ class FixedDropdownAutomator:
         print(f"You should now have {total_chunks} separate report files")
 
         # Clear progress file
-        self.clear_chunking_progress("chunking_progress.json")
+        self.clear_chunking_progress(self.progress_file)
 
         # Next actions menu
         print(f"\nWhat would you like to do next?")
@@ -1227,13 +3884,14 @@ class FixedDropdownAutomator:
             print("\nEnding script...")
             input("Press Enter to close browser...")
 
-    def process_in_chunks_with_auto_reports(self, names_file, column_name="Location Name", download_directory=None):
+    def prompt_for_previous_session(self, resume_policy=None):
         """
-        Main function for chunked processing with automatic report generation.
+        Check for a saved chunking session and ask whether to resume it.
+        Non-interactive runs, and callers that pass a resume_policy ('resume', 'restart' or 'fail'), follow it instead of asking.
+        Returns (existing_progress, resume_session), or (None, None) if the user cancelled.
         """
-
         # Check for existing progress
-        existing_progress = self.load_chunking_progress("chunking_progress.json")
+        existing_progress = self.load_chunking_progress(self.progress_file)
         resume_session = False
 
         if existing_progress:
@@ -1254,29 +3912,58 @@ class FixedDropdownAutomator:
             print(f"2. Start new session (choose new chunk size)")
             print(f"3. Cancel")
 
-            resume_choice = input("Select option (1, 2, or 3): ").strip()
+            if self.interactive and resume_policy is None:
+                resume_choice = input("Select option (1, 2, or 3): ").strip()
+            else:
+                resume_choice = {'resume': "1", 'restart': "2"}.get(resume_policy, "3")
+                print(f"Resume policy '{resume_policy}' selected option {resume_choice}")
             if resume_choice == "1":
                 resume_session = True
                 print("Resuming previous session...")
             elif resume_choice == "2":
                 print("Starting new chunking session...")
-                self.clear_chunking_progress("chunking_progress.json")
+                self.clear_chunking_progress(self.progress_file)
             else:
                 print("Cancelled.")
-                return
+                return None, None
 
-        if not resume_session:
-            # Load names from file
-            all_names, df = self.load_names_from_file(names_file, column_name)
+        return existing_progress, resume_session
 
-            # Determine which column was actually used
-            if column_name in df.columns:
-                actual_column = column_name
-            else:
-                actual_column = df.columns[1]
+    def prompt_for_shard(self):
+        """Ask whether to split the report date range into weekly or monthly time shards"""
+        shard_input = input("Split the date range into time shards? (w = weekly, m = monthly, blank = no): ").strip().lower()
+        return {'w': "week", 'm': "month"}.get(shard_input)
 
-            print(f"Loaded {len(all_names)} total names from file")
+    def plan_automated_chunking_session(self, names_file, column_name="Location Name", region_filter=None, chunk_size=None,
+                                        target_report_seconds=None, names=None, shard=None):
+        """
+        Load the names, ask for the region filter and chunk size, and save the new
+        chunking plan as progress data. Returns the progress data, or None if cancelled.
+        Non-interactive automators use region_filter (None for all regions) and chunk_size instead of prompting.
+        target_report_seconds is stored with the plan so a resumed session keeps adaptive sizing.
+        names (normalized) plans exactly those locations without asking anything: the caller (e.g. one
+        incremental window) has already chosen them and the chunk size.
+        shard ('week', 'month' or a number of days) splits the session's date range into time shards;
+        every location chunk then runs once per shard, shard by shard, with the shard dates on the chunk.
+        """
+        # Load names from file
+        all_names, _ = self.load_names_from_file(names_file, column_name)
+
+        print(f"Loaded {len(all_names)} total names from file")
 
+        names_given = names is not None
+        if names_given:
+            names = list(names)
+            print(f"Planning {len(names)} preselected locations")
+        elif not self.interactive:
+            names = all_names
+            if region_filter:
+                if region_filter not in self.location_index.region_counts:
+                    print(f"Region '{region_filter}' not found in the file.")
+                    return None
+                names = self.location_index.names_in_region(region_filter)
+                print(f"Filtered to {len(names)} locations in {region_filter}")
+        else:
             # Region filtering (keep existing logic)
             print(f"\n{'='*50}")
             print("REGION FILTER FOR CHUNKING")
@@ -1288,89 +3975,122 @@ class FixedDropdownAutomator:
             region_filter = None
 
             if filter_choice == "2":
-                if "Region" not in df.columns:
-                    print("No 'Region' column found in the file. Using all locations.")
-                    names = all_names
-                else:
-                    regions = df["Region"].dropna().unique().tolist()
-                    regions.sort()
-
-                    print(f"\nAvailable regions:")
-                    for i, region in enumerate(regions, 1):
-                        count = len(df[df["Region"] == region])
-                        print(f"  {i}. {region} ({count} locations)")
-
-                    try:
-                        region_choice = int(input(f"Select region number (1-{len(regions)}): ").strip())
-                        if 1 <= region_choice <= len(regions):
-                            selected_region = regions[region_choice - 1]
-                            region_filter = selected_region
-                            filtered_df = df[df["Region"] == selected_region]
-                            names = filtered_df[actual_column].dropna().tolist()
-                            names = [self.normalize_text(str(name)) for name in names]
-                            print(f"Filtered to {len(names)} locations in {selected_region}")
-                        else:
-                            print("Invalid number. Using all locations.")
-                            names = all_names
-                    except ValueError:
-                        print("Invalid input. Using all locations.")
-                        names = all_names
+                region_filter, names = self.prompt_for_region(all_names)
             else:
                 names = all_names
 
-            # Chunk size configuration
-            print(f"\n{'='*50}")
-            print("CHUNK SIZE CONFIGURATION")
-            print(f"{'='*50}")
-            print(f"Total items to process: {len(names)}")
+        # Chunk size configuration
+        print(f"\n{'='*50}")
+        print("CHUNK SIZE CONFIGURATION")
+        print(f"{'='*50}")
+        print(f"Total items to process: {len(names)}")
 
-            default_chunk_size = 50
+        default_chunk_size = 50
+        if not self.interactive or names_given:
+            chunk_input = str(chunk_size) if chunk_size else ""
+            print(f"Chunk size: {chunk_input or default_chunk_size}")
+        else:
             chunk_input = input(f"Enter chunk size (default {default_chunk_size}): ").strip()
 
-            try:
-                chunk_size = int(chunk_input) if chunk_input else default_chunk_size
-                if chunk_size <= 0:
-                    chunk_size = default_chunk_size
-                    print(f"Invalid chunk size. Using default: {default_chunk_size}")
-            except ValueError:
+        try:
+            chunk_size = int(chunk_input) if chunk_input else default_chunk_size
+            if chunk_size <= 0:
                 chunk_size = default_chunk_size
-                print(f"Invalid input. Using default chunk size: {default_chunk_size}")
-
-            # Create chunks
-            chunks = self.create_chunks(names, chunk_size)
+                print(f"Invalid chunk size. Using default: {default_chunk_size}")
+        except ValueError:
+            chunk_size = default_chunk_size
+            print(f"Invalid input. Using default chunk size: {default_chunk_size}")
 
-            print(f"\n{'='*50}")
-            print("AUTOMATED CHUNKING PLAN")
-            print(f"{'='*50}")
-            print(f"Total items: {len(names)}")
-            print(f"Chunk size: {chunk_size}")
-            print(f"Total chunks: {len(chunks)}")
-            print(f"This will create {len(chunks)} separate reports AUTOMATICALLY")
-            print("Reports will be generated and downloaded without manual intervention")
+        # Create chunks, balanced by expected report size when there is row count history
+        chunks = self.create_balanced_chunks(names, chunk_size)
 
-            for i, chunk in enumerate(chunks, 1):
-                print(f"  Chunk {i}: Items {chunk['start_index']}-{chunk['end_index']} ({chunk['size']} items)")
+        shards = []
+        if shard and self.from_date and self.to_date:
+            shards = split_date_range(self.from_date, self.to_date, shard)
+            chunks = [dict(chunk, from_date=shard_from, to_date=shard_to) for shard_from, shard_to in shards for chunk in chunks]
+        elif shard:
+            print("Date sharding needs the session's report dates - running the whole range per chunk.")
 
+        print(f"\n{'='*50}")
+        print("AUTOMATED CHUNKING PLAN")
+        print(f"{'='*50}")
+        print(f"Total items: {len(names)}")
+        print(f"Chunk size: {chunk_size}")
+        if shards:
+            print(f"Date shards: {len(shards)} ({shard}) from {self.from_date} to {self.to_date}")
+        print(f"Total chunks: {len(chunks)}")
+        print(f"This will create {len(chunks)} separate reports AUTOMATICALLY")
+        print("Reports will be generated and downloaded without manual intervention")
+
+        for i, chunk in enumerate(chunks, 1):
+            expected = f", ~{chunk['expected_rows']} rows" if 'expected_rows' in chunk else ""
+            dates = f" [{chunk['from_date']} - {chunk['to_date']}]" if 'from_date' in chunk else ""
+            print(f"  Chunk {i}: Items {chunk['start_index']}-{chunk['end_index']} ({chunk['size']} items{expected}){dates}")
+
+        proceed = 'y'
+        if self.interactive and not names_given:
             proceed = input(f"\nProceed with AUTOMATED chunked processing? (y/n): ").strip().lower()
-            if proceed != 'y':
-                print("Chunking cancelled.")
-                return
+        if proceed != 'y':
+            print("Chunking cancelled.")
+            return None
 
-            # Initialize progress tracking
-            progress_data = {
-                'file_path': names_file,
-                'column_name': column_name,
-                'total_items': len(names),
-                'chunk_size': chunk_size,
-                'total_chunks': len(chunks),
-                'current_chunk': 1,
-                'region_filter': region_filter,
-                'chunks': chunks,
-                'names': names,
-                'started_at': datetime.now().isoformat()
-            }
+        # Initialize progress tracking
+        progress_data = {
+            'file_path': names_file,
+            'column_name': column_name,
+            'total_items': len(names),
+            'chunk_size': chunk_size,
+            'total_chunks': len(chunks),
+            'current_chunk': 1,
+            'region_filter': region_filter,
+            'target_report_seconds': target_report_seconds,
+            'shard': shard if shards else None,
+            'chunks': chunks,
+            'names': names,
+            'started_at': datetime.now().isoformat()
+        }
 
-            self.save_chunking_progress(progress_data)
+        self.save_chunking_progress(progress_data)
+        return progress_data
+
+    def process_in_chunks_with_auto_reports(self, names_file, column_name="Location Name", download_directory=None,
+                                            region_filter=None, chunk_size=None, resume_policy=None, target_report_seconds=None,
+                                            names=None, shard=None):
+        """
+        Main function for chunked processing with automatic report generation.
+        With target_report_seconds set, chunk sizes adapt to the measured report times
+        (see AdaptiveChunkScheduler) and a chunk whose report timed out is split and retried.
+        names (normalized) replaces the names file's list, e.g. for one incremental date window; the caller
+        has then asked any questions already, so the run does not prompt and skips the next-action menu.
+        shard splits the date range into time shards (see plan_automated_chunking_session).
+        Returns a summary dict (successful_reports, failed_reports, failed_chunks, failed_names, merged_file),
+        or None if cancelled. failed_names covers failed chunks and names that could not be selected.
+        """
+        prompt = self.interactive and names is None
+
+        # Check for existing progress
+        existing_progress, resume_session = self.prompt_for_previous_session(resume_policy)
+        if resume_session is None:
+            return None
+
+        if not resume_session:
+            if prompt and target_report_seconds is None:
+                target_input = input("Target seconds per report for adaptive chunk sizing (blank for a fixed chunk size): ").strip()
+                try:
+                    target_report_seconds = float(target_input) if target_input else None
+                except ValueError:
+                    print("Invalid input. Using a fixed chunk size.")
+            if prompt and shard is None:
+                shard = self.prompt_for_shard()
+
+            progress_data = self.plan_automated_chunking_session(names_file, column_name, region_filter, chunk_size,
+                                                                 target_report_seconds, names, shard)
+            if progress_data is None:
+                return None
+
+            chunks = progress_data['chunks']
+            names = progress_data['names']
+            chunk_size = progress_data['chunk_size']
 
         else:
             # Resume existing session
@@ -1383,36 +4103,91 @@ class FixedDropdownAutomator:
 
         # Process chunks starting from current position
         start_chunk = progress_data['current_chunk']
-        total_chunks = len(chunks)
         successful_reports = 0
         failed_reports = 0
+        failed_chunks = []
+        failed_selections = []
+
+        # Adaptive sizing re-plans chunks[chunk_num:] after every report, so the chunk count can change
+        scheduler = None
+        if progress_data.get('target_report_seconds'):
+            scheduler = AdaptiveChunkScheduler(self.report_days(chunks[start_chunk - 1] if start_chunk <= len(chunks) else None),
+                                               progress_data['target_report_seconds'],
+                                               initial_size=chunk_size, state=progress_data.get('adaptive'))
+            row_counts = LocationRowCounts(self.row_counts_file)
 
         print(f"\n{'='*70}")
         print(f"STARTING AUTOMATED CHUNK PROCESSING")
         print(f"Starting from chunk: {start_chunk}")
-        print(f"Total chunks: {total_chunks}")
+        print(f"Total chunks: {len(chunks)}")
+        if scheduler:
+            print(f"Adaptive chunk sizing: targeting {scheduler.target_seconds:.0f}s per report")
+        if progress_data.get('shard'):
+            print(f"Date shards: {progress_data['shard']}")
         print(f"Reports will be generated automatically for each chunk!")
         print(f"{'='*70}")
 
-        for chunk_num in range(start_chunk, total_chunks + 1):
+        # Downloads are consolidated in the background while the browser works on the next chunk
+        tracker = DownloadTracker(download_directory) if download_directory else None
+        pipeline = ConsolidationPipeline(self, download_directory) if download_directory else None
+        chunk_num = start_chunk
+        needs_clear = resume_session or start_chunk > 1
+        while chunk_num <= len(chunks):
             chunk = chunks[chunk_num - 1] # Convert to 0-based index
 
             # Clear any existing selections before starting new chunk
-            if chunk_num > 1 or resume_session:
+            if needs_clear:
                 print("Clearing previous selections...")
                 clear_success = self.clear_all_selections()
                 if not clear_success:
                     print("Clear failed - continuing anyway...")
-                time.sleep(0.08)
-
-            # Process the chunk with automatic report generation
-            successful, failed, report_success = self.process_chunk_with_auto_report(chunk, chunk_num, total_chunks)
+            needs_clear = True
+
+            # Enter this chunk's shard dates, then process it with automatic report generation
+            self.apply_chunk_dates(chunk)
+            successful, failed, report_success = self.process_chunk_with_auto_report(chunk, chunk_num, len(chunks))
+
+            # Tie the report's download to this chunk and give it the chunk's file name
+            new_file = None
+            if report_success and tracker and not (self.last_report or {}).get('no_records'):
+                new_file = tracker.claim(chunk_num, chunk)
+                if new_file:
+                    pipeline.submit(new_file)
+
+            if scheduler and self.last_report and self.last_report['seconds'] is not None:
+                report = self.last_report
+                rows = 0 if report['no_records'] else None
+                if report_success and rows is None and new_file:
+                    rows = self.count_csv_rows(new_file)
+                scheduler.record(chunk['size'], report['seconds'], rows, report['timed_out'])
+                progress_data['adaptive'] = scheduler.state()
+                print(f"Chunk {chunk_num}: {chunk['size']} locations, report took {report['seconds']:.1f}s"
+                      + (f", {rows} rows" if rows is not None else ""))
+
+                if not report_success and report['timed_out'] and chunk['size'] > scheduler.min_size:
+                    print(f"Report timed out - splitting chunk {chunk_num} into two halves and retrying")
+                    self.split_chunk(chunks, chunk_num - 1)
+                    progress_data['total_chunks'] = len(chunks)
+                    self.save_chunking_progress(progress_data)
+                    continue
 
-            # Track report success
+                # Scale the next chunks by the expected report size of the locations still to run
+                remaining = [name for later in chunks[chunk_num:] for name in later['items']]
+                rows_per_location = None
+                if row_counts.locations and remaining:
+                    rows_per_location = sum(row_counts.expected_rows(remaining, 1)) / len(remaining)
+                next_size = scheduler.next_size(chunk['size'], rows_per_location)
+                self.reschedule_remaining_chunks(chunks, chunk_num, next_size, row_counts)
+                progress_data['total_chunks'] = len(chunks)
+                print(f"Next chunk size: {next_size} ({len(chunks) - chunk_num} chunks left)")
+
+            # Track report success; names that could not be selected are missing from a successful report
             if report_success:
                 successful_reports += 1
+                failed_selections.extend(failed)
             else:
                 failed_reports += 1
+                failed_chunks.append(chunk_num)
 
             # Update progress
             progress_data['current_chunk'] = chunk_num + 1
@@ -1420,15 +4195,13 @@ class FixedDropdownAutomator:
 
             print(f"\n{'='*70}")
             print(f"CHUNK {chunk_num} COMPLETE")
-            print(f"Progress: {chunk_num}/{total_chunks} chunks completed")
+            print(f"Progress: {chunk_num}/{len(chunks)} chunks completed")
             print(f"Reports generated: {successful_reports}")
             print(f"Report failures: {failed_reports}")
             print(f"{'='*70}")
+            chunk_num += 1
 
-            # Brief pause between chunks
-            if chunk_num < total_chunks:
-                print("Brief pause before next chunk...")
-                time.sleep(0.08)
+        total_chunks = len(chunks)
 
         # Final summary
         print(f"\n{'='*70}")
@@ -1438,17 +4211,39 @@ class FixedDropdownAutomator:
         print(f"Total items processed: {len(names)}")
         print(f"Successful reports: {successful_reports}")
         print(f"Failed reports: {failed_reports}")
+        if failed_selections:
+            print(f"Locations missing from successful reports (selection failed): {len(set(failed_selections))}")
 
         # Add the consolidation logic here
+        merged_file = None
         if download_directory:
-            print("\nWaiting for a few seconds to ensure all files are downloaded before consolidation...")
-            time.sleep(5)
-            self.consolidate_csv_files(download_directory, successful_reports)
+            print("\nWaiting for any late downloads before consolidation...")
+            tracker.finish() # late files are picked up by the pipeline's final directory scan
+            for num, _ in tracker.pending:
+                # The report was generated but its file never arrived, so the chunk's locations are missing
+                successful_reports -= 1
+                failed_reports += 1
+                failed_chunks.append(num)
+            failed_chunks.sort()
+            merged_file = pipeline.finish(successful_reports)
+            self.record_location_row_counts(merged_file, [name for num, chunk in enumerate(chunks, 1) if num not in failed_chunks
+                                                          for name in chunk['items'] if name not in failed_selections])
 
         print(f"You should now have a consolidated report and {successful_reports} report files downloaded")
 
         # Clear progress file
-        self.clear_chunking_progress("chunking_progress.json")
+        self.clear_chunking_progress(self.progress_file)
+
+        summary = {
+            'successful_reports': successful_reports,
+            'failed_reports': failed_reports,
+            'failed_chunks': failed_chunks,
+            'failed_names': list(dict.fromkeys([name for num in failed_chunks for name in chunks[num - 1]['items']]
+                                               + failed_selections)),
+            'merged_file': merged_file,
+        }
+        if not prompt:
+            return summary
 
         # Next actions menu
         print(f"\nWhat would you like to do next?")
@@ -1468,6 +4263,629 @@ class FixedDropdownAutomator:
             print("\nEnding script...")
             input("Press Enter to close browser...")
 
+        return summary
+
+    # ============= WORKER POOL METHODS =============
+
+    def browser_alive(self):
+        """False once the browser has crashed or its WebDriver session has gone away"""
+        try:
+            self.driver.title
+            return True
+        except WebDriverException:
+            return False
+
+    def set_download_directory(self, directory):
+        """Point this browser's downloads at a different directory without restarting it"""
+        os.makedirs(directory, exist_ok=True)
+        self.driver.execute_cdp_cmd("Page.setDownloadBehavior", {"behavior": "allow", "downloadPath": os.path.abspath(directory)})
+        self.download_path = directory
+
+    def start_pool_worker_browser(self, worker_dir):
+        """Start and log in a non-interactive automator that repeats this session's URL and dates"""
+        worker = FixedDropdownAutomator(download_path=os.path.abspath(worker_dir), batch_selection=self.batch_selection,
+                                        interactive=False, session_file=self.session_file, headless=self.headless)
+        worker.location_index = self.location_index # search prefixes for the dropdown
+        worker.location_aliases = self.location_aliases
+        worker.fuzzy_threshold = self.fuzzy_threshold
+        try:
+            worker.start_session(self.target_url, self.from_date, self.to_date, persist=False)
+        except Exception:
+            worker.close()
+            raise
+        return worker
+
+    def run_pool_worker(self, worker_id, chunk_queue, pool_state, worker_dir, use_self=False):
+        """
+        Worker thread body: take chunk numbers from the shared queue until every chunk is finished.
+        A chunk whose report fails is put back on the queue until it reaches max_attempts.
+        A worker whose browser has died (a WebDriver error, or a failed liveness check after a failed
+        chunk) retires and hands its chunk back without counting the attempt, so a live worker gets it.
+        """
+        chunks = pool_state['progress']['chunks']
+        total_chunks = len(chunks)
+        automator = None
+
+        try:
+            if use_self:
+                automator = self
+                automator.set_download_directory(worker_dir)
+            else:
+                print(f"[Worker {worker_id}] Starting browser and logging in...")
+                automator = self.start_pool_worker_browser(worker_dir)
+        except Exception as e:
+            print(f"[Worker {worker_id}] Could not start: {e}")
+            return
+
+        tracker = DownloadTracker(worker_dir)
+        while True:
+            with pool_state['lock']:
+                if pool_state['remaining'] == 0:
+                    break
+            try:
+                chunk_num = chunk_queue.get(timeout=1)
+            except queue.Empty:
+                continue
+
+            chunk = chunks[chunk_num - 1]
+            with pool_state['lock']:
+                pool_state['status'][str(chunk_num)] = 'in_progress'
+                pool_state['attempts'][str(chunk_num)] = pool_state['attempts'].get(str(chunk_num), 0) + 1
+                attempt = pool_state['attempts'][str(chunk_num)]
+                self.save_pool_progress(pool_state)
+            print(f"[Worker {worker_id}] Taking chunk {chunk_num} (attempt {attempt})")
+
+            crash_error = None
+            try:
+                if not automator.clear_all_selections():
+                    print(f"[Worker {worker_id}] Clear failed - continuing anyway...")
+                automator.apply_chunk_dates(chunk)
+                successful, failed, report_success = automator.process_chunk_with_auto_report(chunk, chunk_num, total_chunks)
+                if report_success and not (automator.last_report or {}).get('no_records'):
+                    new_file = tracker.claim(chunk_num, chunk)
+                    if new_file:
+                        # Named as merge_worker_downloads will name it, so the final scan skips it
+                        pool_state['pipeline'].submit(new_file, f"worker{worker_id}_{os.path.basename(new_file)}")
+            except Exception as e:
+                print(f"[Worker {worker_id}] Crashed on chunk {chunk_num}: {e}")
+                report_success = False
+                crash_error = e
+
+            # The page methods catch WebDriver errors and just return False, so check the browser itself
+            browser_dead = not report_success and (isinstance(crash_error, WebDriverException) or not automator.browser_alive())
+            with pool_state['lock']:
+                if browser_dead:
+                    pool_state['status'][str(chunk_num)] = 'pending'
+                    pool_state['attempts'][str(chunk_num)] -= 1
+                    chunk_queue.put(chunk_num)
+                    print(f"[Worker {worker_id}] Browser is gone - chunk {chunk_num} handed back without using an attempt")
+                elif report_success:
+                    pool_state['status'][str(chunk_num)] = 'done'
+                    pool_state['successful_reports'] += 1
+                    pool_state['remaining'] -= 1
+                    pool_state['failed_selections'].extend(failed)
+                elif attempt < pool_state['max_attempts']:
+                    pool_state['status'][str(chunk_num)] = 'pending'
+                    chunk_queue.put(chunk_num)
+                    print(f"[Worker {worker_id}] Chunk {chunk_num} handed back to the queue for retry")
+                else:
+                    pool_state['status'][str(chunk_num)] = 'failed'
+                    pool_state['failed_reports'] += 1
+                    pool_state['remaining'] -= 1
+                self.save_pool_progress(pool_state)
+
+            if crash_error is not None or browser_dead:
+                print(f"[Worker {worker_id}] Retiring after crash")
+                break
+
+        # Let late downloads land before the browser closes
+        for late_file in tracker.finish():
+            name = f"worker{worker_id}_{os.path.basename(late_file)}"
+            if name not in pool_state['pipeline'].submitted:
+                pool_state['pipeline'].submit(late_file, name)
+        if tracker.pending:
+            # Reports whose file never arrived leave their locations out of the consolidated report
+            with pool_state['lock']:
+                for num, _ in tracker.pending:
+                    pool_state['status'][str(num)] = 'failed'
+                    pool_state['successful_reports'] -= 1
+                    pool_state['failed_reports'] += 1
+                self.save_pool_progress(pool_state)
+        if automator is not None and automator is not self:
+            try:
+                automator.close()
+            except Exception:
+                pass
+
+    def save_pool_progress(self, pool_state):
+        """Save worker pool progress; current_chunk points at the first chunk that is not done"""
+        progress_data = pool_state['progress']
+        progress_data['chunk_status'] = pool_state['status']
+        progress_data['chunk_attempts'] = pool_state['attempts']
+        unfinished = [int(num) for num, status in pool_state['status'].items() if status not in ('done', 'failed')]
+        progress_data['current_chunk'] = min(unfinished) if unfinished else len(progress_data['chunks']) + 1
+        self.save_chunking_progress(progress_data)
+
+    def merge_worker_downloads(self, download_directory, worker_dirs):
+        """Move every worker's CSV files into the main download directory and remove the worker folders"""
+        moved = 0
+        for worker_id, worker_dir in worker_dirs.items():
+            if not os.path.isdir(worker_dir):
+                continue
+            for filename in os.listdir(worker_dir):
+                if filename.endswith('.csv'):
+                    shutil.move(os.path.join(worker_dir, filename),
+                                os.path.join(download_directory, f"worker{worker_id}_{filename}"))
+                    moved += 1
+            # Downloads the worker could not attribute stay out of consolidation, but are kept
+            unattributed_dir = os.path.join(worker_dir, DownloadTracker.UNATTRIBUTED_DIR)
+            if os.path.isdir(unattributed_dir):
+                os.makedirs(os.path.join(download_directory, DownloadTracker.UNATTRIBUTED_DIR), exist_ok=True)
+                for filename in os.listdir(unattributed_dir):
+                    shutil.move(os.path.join(unattributed_dir, filename),
+                                os.path.join(download_directory, DownloadTracker.UNATTRIBUTED_DIR, f"worker{worker_id}_{filename}"))
+            shutil.rmtree(worker_dir, ignore_errors=True)
+        print(f"Merged {moved} report files from {len(worker_dirs)} workers into '{download_directory}'")
+        return moved
+
+    def process_in_chunks_with_worker_pool(self, names_file, column_name="Location Name", download_directory=None, num_workers=3, max_attempts=2,
+                                           region_filter=None, chunk_size=None, resume_policy=None, shard=None):
+        """
+        Chunked processing with automatic reports spread across several browsers.
+        This browser is worker 1; the other workers log in with the same URL and dates.
+        Each worker downloads into its own folder and the files are merged before consolidation.
+        With shard set, each (location chunk, time shard) pair is a separate task in the queue.
+        Returns the same summary dict as process_in_chunks_with_auto_reports, or None if cancelled.
+        """
+        if not download_directory:
+            print("Worker pool mode needs a download directory.")
+            return None
+        if self.target_url is None:
+            print("Worker pool mode needs an automated login to repeat. Falling back to a single browser.")
+            num_workers = 1
+
+        existing_progress, resume_session = self.prompt_for_previous_session(resume_policy)
+        if resume_session is None:
+            return None
+
+        if not resume_session:
+            progress_data = self.plan_automated_chunking_session(names_file, column_name, region_filter, chunk_size, shard=shard)
+            if progress_data is None:
+                return None
+        else:
+            progress_data = existing_progress
+
+        chunks = progress_data['chunks']
+        status = progress_data.get('chunk_status') or {
+            str(num): ('done' if num < progress_data['current_chunk'] else 'pending')
+            for num in range(1, len(chunks) + 1)
+        }
+        pending = [int(num) for num, state in status.items() if state != 'done']
+        for num in pending:
+            status[str(num)] = 'pending'
+
+        pool_state = {
+            'lock': threading.Lock(),
+            'progress': progress_data,
+            'status': status,
+            'attempts': {} if not resume_session else progress_data.get('chunk_attempts', {}),
+            'max_attempts': max_attempts,
+            'remaining': len(pending),
+            'successful_reports': 0,
+            'failed_reports': 0,
+            'failed_selections': [],
+            'pipeline': ConsolidationPipeline(self, download_directory)
+        }
+        if resume_session:
+            # Failed chunks from the previous session get a fresh set of attempts
+            for num in pending:
+                pool_state['attempts'][str(num)] = 0
+
+        chunk_queue = queue.Queue()
+        for num in sorted(pending):
+            chunk_queue.put(num)
+
+        num_workers = max(1, min(num_workers, len(pending)))
+        print(f"\n{'='*70}")
+        print(f"STARTING WORKER POOL")
+        print(f"Workers: {num_workers}")
+        print(f"Chunks to process: {len(pending)} of {len(chunks)}")
+        print(f"{'='*70}")
+
+        worker_dirs = {worker_id: os.path.join(download_directory, f"worker_{worker_id}") for worker_id in range(1, num_workers + 1)}
+        threads = []
+        for worker_id, worker_dir in worker_dirs.items():
+            thread = threading.Thread(
+                target=self.run_pool_worker,
+                args=(worker_id, chunk_queue, pool_state, worker_dir, worker_id == 1),
+                name=f"pool-worker-{worker_id}"
+            )
+            thread.start()
+            threads.append(thread)
+
+        for thread in threads:
+            thread.join()
+
+        # Put this browser's downloads back where they were (it may have died as worker 1)
+        try:
+            self.set_download_directory(download_directory)
+        except WebDriverException as e:
+            print(f"Could not reset this browser's download directory: {e}")
+            self.download_path = download_directory
+
+        print(f"\n{'='*70}")
+        print("WORKER POOL COMPLETE!")
+        print(f"{'='*70}")
+        print(f"Successful reports: {pool_state['successful_reports']}")
+        print(f"Failed reports: {pool_state['failed_reports']}")
+        if pool_state['remaining']:
+            print(f"Unfinished chunks: {pool_state['remaining']} (every worker retired) - progress kept for resume")
+
+        # Worker files can only be moved once the pipeline has finished reading them
+        pool_state['pipeline'].drain()
+        self.merge_worker_downloads(download_directory, worker_dirs)
+        merged_file = pool_state['pipeline'].finish(pool_state['successful_reports'])
+        failed_selections = pool_state['failed_selections']
+        self.record_location_row_counts(merged_file, [name for num, state in status.items() if state == 'done'
+                                                      for name in chunks[int(num) - 1]['items'] if name not in failed_selections])
+
+        if not pool_state['remaining']:
+            self.clear_chunking_progress(self.progress_file)
+
+        failed_chunks = sorted(int(num) for num, state in status.items() if state != 'done')
+        return {
+            'successful_reports': pool_state['successful_reports'],
+            'failed_reports': pool_state['failed_reports'],
+            'failed_chunks': failed_chunks,
+            'failed_names': list(dict.fromkeys([name for num in failed_chunks for name in chunks[num - 1]['items']]
+                                               + failed_selections)),
+            'merged_file': merged_file,
+        }
+
+    # ============= REPORT API REPLAY METHODS =============
+
+    def read_network_events(self):
+        """Drain Chrome's performance log and return the DevTools Network events in it"""
+        events = []
+        for entry in self.driver.get_log('performance'):
+            try:
+                message = json.loads(entry['message'])['message']
+            except (KeyError, ValueError):
+                continue
+            if message.get('method', '').startswith('Network.'):
+                events.append(message)
+        return events
+
+    def capture_report_request(self, probe_name, timeout=60):
+        """
+        Generate a report for probe_name alone through the UI and capture the request the page
+        sends to the report API. Returns a request template (see build_report_request_template) or None.
+        """
+        if not self.capture_network:
+            print("Network capture is off - start the automator with capture_network=True.")
+            return None
+
+        if not (self.from_date and self.to_date):
+            print("Report dates are unknown - log in with start_session or automated_login before capturing.")
+            return None
+
+        print(f"\nCapturing the report API request using '{probe_name}'...")
+        self.read_network_events() # Discard everything logged before the probe report
+        self.clear_all_selections()
+        if not self.select_names_in_batch([probe_name]).get(probe_name):
+            print(f"Could not select '{probe_name}' for the capture.")
+            return None
+        if not self.find_and_click_generate_button():
+            return None
+        self.handle_popups_and_proceed()
+
+        encoded_probe = json.dumps(probe_name)[1:-1]
+        deadline = time.time() + timeout
+        template = None
+        while template is None and time.time() < deadline:
+            for event in self.read_network_events():
+                if event['method'] != 'Network.requestWillBeSent':
+                    continue
+                request = event['params']['request']
+                post_data = request.get('postData')
+                if post_data is None and request.get('hasPostData'):
+                    try:
+                        post_data = self.driver.execute_cdp_cmd('Network.getRequestPostData',
+                                                                {'requestId': event['params']['requestId']})['postData']
+                    except Exception:
+                        continue
+                if not post_data or (probe_name not in post_data and encoded_probe not in post_data):
+                    continue
+
+                print(f"Captured {request['method']} {request['url']}")
+                template = build_report_request_template(request['url'], request['method'], request.get('headers', {}),
+                                                         post_data, probe_name, self.from_date, self.to_date)
+                break
+            else:
+                self.wait_for_dropdown_state('dom_quiet', 250, timeout=1)
+
+        # Let the probe report finish so the page is idle before the selections are cleared
+        self.check_for_no_records_message()
+        self.clear_all_selections()
+
+        if template is None:
+            print("No report API request could be captured.")
+            return None
+        print(f"Report API template ready: names at {template['name_paths']}, {len(template['date_slots'])} date field(s)")
+        self.report_api_template = template
+        return template
+
+    def report_api_headers(self):
+        """Captured request headers plus the browser's current cookies for the API's URL"""
+        headers = dict(self.report_api_template['headers'])
+        cookies = self.driver.execute_cdp_cmd('Network.getCookies', {'urls': [self.report_api_template['url']]})['cookies']
+        if cookies:
+            headers['Cookie'] = "; ".join(f"{cookie['name']}={cookie['value']}" for cookie in cookies)
+        return headers
+
+    def replay_report_request(self, names, from_date, to_date, headers, timeout=300):
+        """Request the report for names and the date range straight from the API. Returns a DataFrame."""
+        template = self.report_api_template
+        response = self.http.request(
+            template['method'], template['url'],
+            body=fill_report_request_body(template, names, from_date, to_date).encode('utf-8'),
+            headers=headers,
+            timeout=urllib3.Timeout(connect=10, read=timeout),
+            retries=urllib3.Retry(total=3, backoff_factor=1, status_forcelist=[502, 503, 504], allowed_methods=None)
+        )
+        if response.status != 200:
+            raise RuntimeError(f"Report API returned HTTP {response.status}")
+        return report_payload_to_frame(json.loads(response.data.decode('utf-8')))
+
+    def process_in_chunks_with_api_replay(self, names_file, column_name="Location Name", download_directory=None,
+                                          region_filter=None, chunk_size=None, resume_policy=None, parallel_requests=2,
+                                          names=None, shard=None):
+        """
+        Chunked extraction that calls the report API directly instead of driving the report UI.
+        One probe report is generated through the page to capture the API request; every chunk is
+        then requested over pooled HTTP connections and its rows are appended to the consolidated file.
+        Falls back to process_in_chunks_with_auto_reports if the request cannot be captured.
+        With shard set, each chunk is requested once per time shard and the shards are written in date order.
+        Returns the same summary dict as process_in_chunks_with_auto_reports, or None if cancelled.
+        """
+        if not download_directory:
+            print("API replay mode needs a download directory.")
+            return None
+
+        existing_progress, resume_session = self.prompt_for_previous_session(resume_policy)
+        if resume_session is None:
+            return None
+
+        if not resume_session:
+            progress_data = self.plan_automated_chunking_session(names_file, column_name, region_filter, chunk_size,
+                                                                 names=names, shard=shard)
+            if progress_data is None:
+                return None
+        else:
+            progress_data = existing_progress
+
+        chunks = progress_data['chunks']
+        start_chunk = progress_data['current_chunk']
+        if start_chunk > len(chunks):
+            print("Every chunk has already been processed.")
+            self.clear_chunking_progress(self.progress_file)
+            return {'successful_reports': 0, 'failed_reports': 0, 'failed_chunks': [], 'failed_names': [],
+                    'merged_file': progress_data.get('api_output_file')}
+
+        if self.report_api_template is None and not self.capture_report_request(chunks[start_chunk - 1]['items'][0]):
+            print("Falling back to automated report generation through the page...")
+            return self.process_in_chunks_with_auto_reports(names_file, column_name, download_directory, resume_policy="resume",
+                                                            names=names, shard=shard)
+
+        location_lookup = self.load_location_lookup()
+        merged_dir = os.path.join(download_directory, "Merged_Reports")
+        os.makedirs(merged_dir, exist_ok=True)
+        if not progress_data.get('api_output_file'):
+            progress_data['api_output_file'] = os.path.join(
+                merged_dir, f"Consolidated_MAR_Report_API_{datetime.now().strftime('%Y%m%d_%H%M%S')}.csv")
+        merged_file_path = progress_data['api_output_file']
+        output_columns = progress_data.get('api_columns')
+        failed_chunks = progress_data.setdefault('api_failed_chunks', [])
+        self.save_chunking_progress(progress_data)
+
+        print(f"\n{'='*70}")
+        print(f"STARTING REPORT API EXTRACTION")
+        print(f"Starting from chunk: {start_chunk}")
+        print(f"Total chunks: {len(chunks)}")
+        print(f"Parallel requests: {parallel_requests}")
+        print(f"Output: {merged_file_path}")
+        print(f"{'='*70}")
+
+        headers = self.report_api_headers()
+        successful_reports = 0
+        total_rows = 0
+        start_time = time.time()
+
+        parallel_requests = max(1, parallel_requests)
+        with ThreadPoolExecutor(max_workers=parallel_requests) as executor:
+            def submit(chunk_num):
+                chunk = chunks[chunk_num - 1]
+                return chunk_num, executor.submit(self.replay_report_request, chunk['items'], chunk.get('from_date', self.from_date),
+                                                  chunk.get('to_date', self.to_date), headers)
+
+            # Keep a small window of requests in flight so finished reports never pile up in memory
+            next_chunk = start_chunk
+            in_flight = []
+            while next_chunk <= len(chunks) and len(in_flight) < parallel_requests * 2:
+                in_flight.append(submit(next_chunk))
+                next_chunk += 1
+
+            # Results are written in chunk order so the progress file stays a simple high-water mark
+            while in_flight:
+                chunk_num, future = in_flight.pop(0)
+                if next_chunk <= len(chunks):
+                    in_flight.append(submit(next_chunk))
+                    next_chunk += 1
+                try:
+                    df = future.result()
+                except Exception as e:
+                    print(f"Chunk {chunk_num}/{len(chunks)}: report request failed: {e}")
+                    failed_chunks.append(chunk_num)
+                    progress_data['current_chunk'] = chunk_num + 1
+                    self.save_chunking_progress(progress_data)
+                    continue
+
+                if 'from_date' in chunks[chunk_num - 1]:
+                    df = rows_within_dates(df, chunks[chunk_num - 1]['from_date'], chunks[chunk_num - 1]['to_date'])
+                if len(df):
+                    df = self.add_location_columns(df, location_lookup, f"chunk {chunk_num}", quiet=output_columns is not None)
+                    if output_columns is None:
+                        output_columns = df.columns.tolist()
+                        progress_data['api_columns'] = output_columns
+                    write_header = not os.path.exists(merged_file_path) or os.path.getsize(merged_file_path) == 0
+                    df.reindex(columns=output_columns).to_csv(merged_file_path, mode='a', header=write_header,
+                                                              index=False, encoding='utf-8')
+                total_rows += len(df)
+                successful_reports += 1
+                print(f"Chunk {chunk_num}/{len(chunks)}: {len(df)} rows ({time.time() - start_time:.1f}s elapsed)")
+
+                progress_data['current_chunk'] = chunk_num + 1
+                self.save_chunking_progress(progress_data)
+
+        print(f"\n{'='*70}")
+        print("REPORT API EXTRACTION COMPLETE!")
+        print(f"{'='*70}")
+        print(f"Successful reports: {successful_reports}")
+        print(f"Failed reports: {len(failed_chunks)}")
+        print(f"Rows written: {total_rows} in {time.time() - start_time:.1f}s")
+        print(f"Consolidated report: {merged_file_path}")
+        # Written from the finished CSV so chunks from a resumed session are included
+        self.write_columnar_copy(merged_file_path)
+        self.load_into_database(merged_file_path)
+
+        self.record_location_row_counts(merged_file_path, [name for num, chunk in enumerate(chunks, 1)
+                                                           if num not in failed_chunks for name in chunk['items']])
+        self.clear_chunking_progress(self.progress_file)
+        return {
+            'successful_reports': successful_reports,
+            'failed_reports': len(failed_chunks),
+            'failed_chunks': list(failed_chunks),
+            'failed_names': [name for num in failed_chunks for name in chunks[num - 1]['items']],
+            'merged_file': merged_file_path if os.path.exists(merged_file_path) else None
+        }
+
+    # ============= INCREMENTAL EXTRACTION METHODS =============
+
+    def process_incremental_extraction(self, names_file, column_name="Location Name", download_directory=None,
+                                       store_directory="mar_store", region_filter=None, chunk_size=None, overlap_days=2,
+                                       default_from_date="01/09/2024", to_date=None, date_column=None, mode="ui",
+                                       parallel_requests=2):
+        """
+        Delta-only extraction: request each location's report only from its high-water mark
+        (less overlap_days) up to to_date and merge the rows into the IncrementalStore.
+        Locations are grouped into date windows; each window is a normal chunked run ('ui' or 'api' mode)
+        with its own download folder. Only locations that were selected in a successful report have their marks advanced.
+        Returns a summary dict like process_in_chunks_with_auto_reports (failed_chunks lists window numbers,
+        merged_file is the store directory), or None if cancelled.
+        """
+        if not download_directory:
+            print("Incremental mode needs a download directory.")
+            return None
+
+        to_date = to_date or self.to_date or datetime.now().strftime("%d/%m/%Y")
+        store = IncrementalStore(store_directory, date_column)
+
+        names, _ = self.load_names_from_file(names_file, column_name)
+        index = self.location_index
+        if region_filter:
+            if region_filter not in index.region_counts:
+                print(f"Region '{region_filter}' not found in the file.")
+                return None
+            names = index.names_in_region(region_filter)
+            print(f"Filtered to {len(names)} locations in {region_filter}")
+        region_of = index.region_of
+
+        windows = store.plan_windows(list(dict.fromkeys(names)), to_date, overlap_days, default_from_date)
+
+        print(f"\n{'='*70}")
+        print(f"INCREMENTAL EXTRACTION THROUGH {to_date}")
+        print(f"Store: {store_directory}")
+        print(f"{'='*70}")
+        if not windows:
+            print("Every location is already up to date.")
+            return {'successful_reports': 0, 'failed_reports': 0, 'failed_chunks': [], 'failed_names': [],
+                    'merged_file': store_directory}
+        for window_from, window_names in windows:
+            days = (datetime.strptime(to_date, "%d/%m/%Y") - datetime.strptime(window_from, "%d/%m/%Y")).days + 1
+            print(f"  {window_from} - {to_date} ({days} days): {len(window_names)} locations")
+
+        # Every window runs without prompting, so the questions are asked once here
+        if self.interactive:
+            if chunk_size is None:
+                chunk_input = input("Enter chunk size for every window (default 50): ").strip()
+                try:
+                    chunk_size = int(chunk_input) if chunk_input else None
+                except ValueError:
+                    print("Invalid input. Using the default chunk size.")
+            if input(f"\nProceed with incremental extraction of {len(windows)} windows? (y/n): ").strip().lower() != 'y':
+                print("Incremental extraction cancelled.")
+                return None
+
+        summary = {'successful_reports': 0, 'failed_reports': 0, 'failed_chunks': [], 'failed_names': [],
+                   'merged_file': store_directory}
+        original_dates = (self.from_date, self.to_date)
+        try:
+            for window_num, (window_from, window_names) in enumerate(windows, 1):
+                print(f"\n--- Window {window_num}/{len(windows)}: {window_from} - {to_date}, {len(window_names)} locations ---")
+                window_dir = os.path.join(download_directory, f"window_{window_num}_{window_from.replace('/', '')}")
+                shutil.rmtree(window_dir, ignore_errors=True)
+                self.set_download_directory(window_dir)
+                self.enter_report_dates(window_from, to_date)
+                self.from_date, self.to_date = window_from, to_date
+
+                if mode == "api":
+                    result = self.process_in_chunks_with_api_replay(
+                        names_file, column_name, window_dir, chunk_size=chunk_size, resume_policy="restart",
+                        parallel_requests=parallel_requests, names=window_names)
+                else:
+                    result = self.process_in_chunks_with_auto_reports(
+                        names_file, column_name, window_dir, chunk_size=chunk_size, resume_policy="restart",
+                        names=window_names)
+
+                if not result or not result.get('merged_file'):
+                    print(f"Window {window_num} produced no consolidated report - its locations keep their old marks.")
+                    summary['failed_reports'] += 1
+                    summary['failed_chunks'].append(window_num)
+                    summary['failed_names'].extend(window_names)
+                    continue
+
+                summary['successful_reports'] += result['successful_reports']
+                summary['failed_reports'] += result['failed_reports']
+                if result['failed_chunks'] or result['failed_names']:
+                    summary['failed_chunks'].append(window_num)
+                failed = set(result['failed_names'])
+                summary['failed_names'].extend(name for name in window_names if name in failed)
+                succeeded = [name for name in window_names if name not in failed]
+
+                try:
+                    latest = store.merge(result['merged_file'], window_from, to_date, succeeded)
+                except Exception as e:
+                    print(f"Could not merge window {window_num} into the store: {e}")
+                    summary['failed_chunks'].append(window_num)
+                    summary['failed_names'].extend(succeeded)
+                    continue
+                store.advance(succeeded, to_date, latest, region_of)
+                store.save()
+                print(f"High-water mark moved to {to_date} for {len(succeeded)} locations")
+        finally:
+            self.set_download_directory(download_directory)
+            if original_dates[0] and original_dates != (self.from_date, self.to_date):
+                try:
+                    self.enter_report_dates(*original_dates)
+                except Exception as e:
+                    print(f"Could not restore the report dates: {e}")
+            self.from_date, self.to_date = original_dates
+
+        summary['failed_chunks'] = sorted(set(summary['failed_chunks']))
+        print(f"\nIncremental extraction complete: {summary['successful_reports']} reports, "
+              f"{len(summary['failed_names'])} locations left for the next run")
+        return summary
+
     def wait_for_manual_setup(self, target_url):
         """Wait for user to manually login and navigate to the correct page"""
         print("=== MANUAL SETUP REQUIRED ===")
@@ -1498,13 +4916,7 @@ class FixedDropdownAutomator:
         """Enhanced main function with automated report generation option"""
 
         # Load names from file
-        all_names, df = self.load_names_from_file(names_file, column_name)
-
-        # Determine which column was actually used
-        if column_name in df.columns:
-            actual_column = column_name
-        else:
-            actual_column = df.columns[1]
+        all_names, _ = self.load_names_from_file(names_file, column_name)
 
         print(f"Loaded {len(all_names)} total names from file")
 
@@ -1517,10 +4929,36 @@ class FixedDropdownAutomator:
         print("3. Select ALL items at once (use dropdown 'Select All')")
         print("4. Process in chunks (manual report generation)")
         print("5. Process in chunks with AUTOMATED report generation")
+        print("6. Process in chunks with AUTOMATED reports across parallel browsers")
+        print("7. Process in chunks through the report API (browser only captures the request)")
+        print("8. Incremental update (only dates after each location's last extraction)")
 
-        filter_choice = input("\nSelect option (1, 2, 3, 4, or 5): ").strip()
+        filter_choice = input("\nSelect option (1, 2, 3, 4, 5, 6, 7, or 8): ").strip()
 
-        if filter_choice == "5":
+        if filter_choice == "8":
+            store_input = input("Incremental store directory (default 'mar_store'): ").strip()
+            print("\nSwitching to incremental extraction mode...")
+            self.process_incremental_extraction(names_file, column_name, DOWNLOAD_DIRECTORY, store_input or "mar_store",
+                                                mode="api" if self.capture_network else "ui")
+            return
+        elif filter_choice == "7":
+            if not self.capture_network:
+                print("API mode needs network capture - set CAPTURE_NETWORK = True or run with --mode api.")
+                return
+            print("\nSwitching to report API extraction mode...")
+            self.process_in_chunks_with_api_replay(names_file, column_name, DOWNLOAD_DIRECTORY)
+            return
+        elif filter_choice == "6":
+            worker_input = input("Enter number of browsers (default 3): ").strip()
+            try:
+                num_workers = int(worker_input) if worker_input else 3
+            except ValueError:
+                num_workers = 3
+                print("Invalid input. Using 3 browsers.")
+            print(f"\nSwitching to worker pool mode with {num_workers} browsers...")
+            self.process_in_chunks_with_worker_pool(names_file, column_name, DOWNLOAD_DIRECTORY, num_workers)
+            return
+        elif filter_choice == "5":
             # Use automated chunking functionality
             print("\nSwitching to AUTOMATED chunked processing mode...")
             self.process_in_chunks_with_auto_reports(names_file, column_name, DOWNLOAD_DIRECTORY)
@@ -1531,37 +4969,7 @@ class FixedDropdownAutomator:
             self.process_in_chunks(names_file, column_name)
             return
         elif filter_choice == "2":
-            # Check if Region column exists
-            if "Region" not in df.columns:
-                print("No 'Region' column found in the file. Using all locations.")
-                names = all_names
-            else:
-                # Show available regions with numbers
-                regions = df["Region"].dropna().unique().tolist()
-                regions.sort()
-
-                print(f"\nAvailable regions:")
-                for i, region in enumerate(regions, 1):
-                    count = len(df[df["Region"] == region])
-                    print(f"  {i}. {region} ({count} locations)")
-
-                try:
-                    region_choice = int(input(f"Select region number (1-{len(regions)}): ").strip())
-                    if 1 <= region_choice <= len(regions):
-                        selected_region = regions[region_choice - 1]
-                        # Filter the DataFrame by region
-                        filtered_df = df[df["Region"] == selected_region]
-                        # Get the names from filtered data using the correct column
-                        names = filtered_df[actual_column].dropna().tolist()
-                        # Normalize the names
-                        names = [self.normalize_text(str(name)) for name in names]
-                        print(f"Filtered to {len(names)} locations in {selected_region}")
-                    else:
-                        print(f"Invalid number. Using all locations.")
-                        names = all_names
-                except ValueError:
-                    print(f"Please enter a valid number. Using all locations.")
-                    names = all_names
+            _, names = self.prompt_for_region(all_names)
         elif filter_choice == "3":
             # Use dropdown Select All functionality
             print("Using dropdown 'Select All' to select all items...")
@@ -1654,24 +5062,26 @@ class FixedDropdownAutomator:
         successful_selections = 0
         failed_selections = []
 
-        for i, name in enumerate(names, 1):
-            print(f"\n{'='*50}")
-            print(f"Processing {i}/{len(names)}: '{name}'")
-            print(f"Remaining: {len(names) - i}")
-            print('='*50)
-
-            success = self.click_dropdown_and_select(name)
+        if self.batch_selection:
+            selection_results = self.select_names_in_batch(names)
+            successful_selections = sum(1 for ok in selection_results.values() if ok)
+            failed_selections = [name for name, ok in selection_results.items() if not ok]
+        else:
+            for i, name in enumerate(names, 1):
+                print(f"\n{'='*50}")
+                print(f"Processing {i}/{len(names)}: '{name}'")
+                print(f"Remaining: {len(names) - i}")
+                print('='*50)
 
-            if success:
-                successful_selections += 1
-            else:
-                failed_selections.append(name)
+                success = self.click_dropdown_and_select(name)
 
-            # Show running totals
-            print(f"Running total: {successful_selections} success, {len(failed_selections)} failed")
+                if success:
+                    successful_selections += 1
+                else:
+                    failed_selections.append(name)
 
-            # Small delay between selections
-            time.sleep(0.08)
+                # Show running totals
+                print(f"Running total: {successful_selections} success, {len(failed_selections)} failed")
 
         # Summary
         print(f"\n" + "="*60)
@@ -1756,8 +5166,236 @@ class FixedDropdownAutomator:
         """Close the browser"""
         self.driver.quit()
 
+# ============= BATCH MODE =============
+
+BATCH_DEFAULTS = {
+    'names_file': None,
+    'column_name': "Location Name",
+    'target_url': "https://emar.vcaresystems.co.uk/#/app/reports/mar",
+    'output_dir': r"C:\temp\camascope\outputs",
+    'from_date': None,
+    'to_date': None,
+    'region': None,
+    'chunk_size': 50,
+    'target_report_seconds': None,
+    'resume': "resume",
+    'workers': 1,
+    'mode': "ui",
+    'parallel_requests': 2,
+    'headless': True,
+    'session_file': "camascope_session.json",
+    'row_counts_file': "location_row_counts.json",
+    'aliases_file': "location_aliases.json",
+    'fuzzy_threshold': 0.75,
+    'incremental': False,
+    'store_dir': "mar_store",
+    'date_column': None,
+    'overlap_days': 2,
+    'shard': None,
+    'parquet': False,
+    'arrow_ipc': False,
+    'database': None,
+    'database_key': None,
+    'user_data_dir': None
+}
+
+def clean_download_directory(directory):
+    """Create the output directory, or empty it (keeping Merged_Reports) if it already exists"""
+    print(f"\nChecking and cleaning output directory: '{directory}'")
+
+    # Check if the directory exists, if not, create it
+    if not os.path.exists(directory):
+        os.makedirs(directory)
+        print("Directory did not exist, so it was created.")
+        return
+
+    # If the directory exists, clean it out
+    print("Directory exists. Cleaning out old files...")
+    for item in os.listdir(directory):
+        item_path = os.path.join(directory, item)
+        # Do NOT remove the 'Merged_Reports' folder
+        if item == "Merged_Reports":
+            print(f"  Skipping '{item_path}' as requested.")
+            continue
+
+        try:
+            if os.path.isfile(item_path):
+                os.remove(item_path)
+                print(f"  Deleted file: {item}")
+            elif os.path.isdir(item_path):
+                shutil.rmtree(item_path)
+                print(f"  Deleted directory: {item}")
+        except OSError as e:
+            print(f"  Error deleting {item_path}: {e}")
+    print("Directory cleanup complete.")
+
+def load_batch_config(argv=None):
+    """Merge BATCH_DEFAULTS, an optional JSON config file and command-line arguments (highest priority)"""
+    parser = argparse.ArgumentParser(description="Camascope MAR report automation")
+    parser.add_argument("--batch", action="store_true", help="Run unattended: no prompts, exit code reports the outcome")
+    parser.add_argument("--config", help="JSON file with any of the batch settings")
+    parser.add_argument("--names-file", dest="names_file")
+    parser.add_argument("--column-name", dest="column_name")
+    parser.add_argument("--target-url", dest="target_url")
+    parser.add_argument("--output-dir", dest="output_dir")
+    parser.add_argument("--from-date", dest="from_date", help="DD/MM/YYYY")
+    parser.add_argument("--to-date", dest="to_date", help="DD/MM/YYYY")
+    parser.add_argument("--region", help="Only process locations in this region")
+    parser.add_argument("--chunk-size", dest="chunk_size", type=int)
+    parser.add_argument("--target-report-seconds", dest="target_report_seconds", type=float,
+                        help="Adapt chunk sizes so each report takes about this long")
+    parser.add_argument("--resume", choices=["resume", "restart", "fail"], help="What to do with a saved chunking session")
+    parser.add_argument("--workers", type=int, help="Number of browsers (more than 1 uses the worker pool)")
+    parser.add_argument("--mode", choices=["ui", "api"], help="'api' replays the report API request instead of driving the page")
+    parser.add_argument("--parallel-requests", dest="parallel_requests", type=int, help="Concurrent report requests in api mode")
+    parser.add_argument("--headed", dest="headless", action="store_false", default=None, help="Show the browser window")
+    parser.add_argument("--session-file", dest="session_file")
+    parser.add_argument("--row-counts-file", dest="row_counts_file", help="Per-location row count history used to balance chunks")
+    parser.add_argument("--aliases-file", dest="aliases_file", help="Confirmed location name -> dropdown label aliases (batch runs add unconfirmed proposals)")
+    parser.add_argument("--fuzzy-threshold", dest="fuzzy_threshold", type=float,
+                        help="Minimum score (0-1) for proposing the closest dropdown label of an unmatched name (above 1 disables)")
+    parser.add_argument("--seed-row-counts", dest="seed_row_counts", nargs="+", metavar="CSV",
+                        help="Add earlier consolidated reports (covering --from-date to --to-date) to the row count table and exit")
+    parser.add_argument("--incremental", action="store_true", default=None,
+                        help="Only request dates after each location's high-water mark and merge them into --store-dir")
+    parser.add_argument("--store-dir", dest="store_dir", help="Incremental store directory")
+    parser.add_argument("--date-column", dest="date_column", help="Report column holding the MAR date (incremental mode)")
+    parser.add_argument("--overlap-days", dest="overlap_days", type=int, help="Days re-requested before each high-water mark")
+    parser.add_argument("--shard", help="Split the date range into 'week', 'month' or N-day shards, one report per chunk and shard")
+    parser.add_argument("--parquet", action="store_true", default=None,
+                        help="Also write the consolidated report as Parquet partitioned by Region and month (needs pyarrow)")
+    parser.add_argument("--arrow-ipc", dest="arrow_ipc", action="store_true", default=None,
+                        help="Also write the consolidated report as an Arrow IPC file (needs pyarrow)")
+    parser.add_argument("--database", help="SQLite file to upsert the consolidated rows into")
+    parser.add_argument("--database-key", dest="database_key", nargs="+", metavar="PART=COLUMN",
+                        help=f"Report column for a part of the database upsert key ({', '.join(MAR_KEY_PARTS)}) "
+                             f"when it cannot be found from the column names")
+    parser.add_argument("--user-data-dir", dest="user_data_dir")
+    args = parser.parse_args(argv)
+
+    config = dict(BATCH_DEFAULTS)
+    if args.config:
+        with open(args.config, 'r') as f:
+            file_config = json.load(f)
+        unknown = set(file_config) - set(BATCH_DEFAULTS)
+        if unknown:
+            parser.error(f"Unknown settings in {args.config}: {', '.join(sorted(unknown))}")
+        config.update(file_config)
+
+    for key in BATCH_DEFAULTS:
+        value = getattr(args, key)
+        if value is not None:
+            config[key] = value
+
+    if config['shard'] and not (config['shard'] in ("week", "month") or str(config['shard']).isdigit()):
+        parser.error("--shard must be 'week', 'month' or a number of days")
+
+    # --database-key gives PART=COLUMN pairs; the config file may give them as a {part: column} object
+    if isinstance(config['database_key'], list):
+        if not all('=' in pair for pair in config['database_key']):
+            parser.error("--database-key takes PART=COLUMN pairs")
+        config['database_key'] = dict(pair.split('=', 1) for pair in config['database_key'])
+    unknown_parts = set(config['database_key'] or {}) - set(MAR_KEY_PARTS)
+    if unknown_parts:
+        parser.error(f"Unknown database key parts: {', '.join(sorted(unknown_parts))} (use {', '.join(MAR_KEY_PARTS)})")
+
+    config['seed_row_counts'] = args.seed_row_counts
+    if not (args.batch or args.seed_row_counts):
+        parser.error("unattended runs need --batch (run without arguments for the interactive menu)")
+    if args.seed_row_counts:
+        if not (config['from_date'] and config['to_date']):
+            parser.error("--seed-row-counts needs the --from-date and --to-date the reports covered")
+    elif not config['names_file']:
+        parser.error("batch mode needs a names file (--names-file or 'names_file' in the config)")
+    return config
+
+def run_batch(config):
+    """
+    Run one unattended chunked report session from a config dict (see BATCH_DEFAULTS).
+    Returns an exit code: 0 all reports succeeded, 1 some chunks or location selections failed,
+    2 the run could not complete.
+    """
+    if config.get('seed_row_counts'):
+        days = (datetime.strptime(config['to_date'], "%d/%m/%Y") - datetime.strptime(config['from_date'], "%d/%m/%Y")).days + 1
+        update_location_row_counts(config['row_counts_file'], config['seed_row_counts'], days)
+        return 0
+
+    global NAMES_FILE
+    NAMES_FILE = config['names_file']
+    output_dir = config['output_dir']
+
+    # The progress file lives with the outputs so a rerun with the same config can resume
+    os.makedirs(output_dir, exist_ok=True)
+    progress_file = os.path.join(output_dir, "chunking_progress.json")
+    if not (config['resume'] == "resume" and os.path.exists(progress_file)):
+        clean_download_directory(output_dir)
+
+    try:
+        automator = FixedDropdownAutomator(download_path=output_dir, interactive=False, headless=config['headless'],
+                                           session_file=config['session_file'], user_data_dir=config['user_data_dir'],
+                                           capture_network=config['mode'] == "api")
+    except Exception as e:
+        print(f"Batch run failed to start the browser: {e}")
+        return 2
+    automator.progress_file = progress_file
+    automator.row_counts_file = config['row_counts_file']
+    automator.location_aliases = LocationAliases(config['aliases_file'])
+    automator.fuzzy_threshold = config['fuzzy_threshold']
+    automator.parquet_output = config['parquet']
+    automator.arrow_output = config['arrow_ipc']
+    automator.database_file = config['database']
+    automator.database_key_columns = config['database_key']
+
+    try:
+        automator.start_session(config['target_url'], config['from_date'], config['to_date'])
+
+        if config['incremental']:
+            # from_date is only the starting point for locations without a high-water mark
+            summary = automator.process_incremental_extraction(
+                NAMES_FILE, config['column_name'], output_dir, store_directory=config['store_dir'],
+                region_filter=config['region'], chunk_size=config['chunk_size'], overlap_days=config['overlap_days'],
+                default_from_date=config['from_date'] or "01/09/2024", to_date=config['to_date'],
+                date_column=config['date_column'], mode=config['mode'], parallel_requests=config['parallel_requests'])
+        elif config['mode'] == "api":
+            summary = automator.process_in_chunks_with_api_replay(
+                NAMES_FILE, config['column_name'], output_dir, region_filter=config['region'],
+                chunk_size=config['chunk_size'], resume_policy=config['resume'], parallel_requests=config['parallel_requests'],
+                shard=config['shard'])
+        elif config['workers'] > 1:
+            summary = automator.process_in_chunks_with_worker_pool(
+                NAMES_FILE, config['column_name'], output_dir, num_workers=config['workers'],
+                region_filter=config['region'], chunk_size=config['chunk_size'], resume_policy=config['resume'],
+                shard=config['shard'])
+        else:
+            summary = automator.process_in_chunks_with_auto_reports(
+                NAMES_FILE, config['column_name'], output_dir,
+                region_filter=config['region'], chunk_size=config['chunk_size'], resume_policy=config['resume'],
+                target_report_seconds=config['target_report_seconds'], shard=config['shard'])
+
+    except Exception as e:
+        print(f"Batch run failed: {str(e)}")
+        traceback.print_exc()
+        return 2
+
+    finally:
+        automator.close()
+
+    if summary is None:
+        print("Batch run was cancelled before any chunks were processed.")
+        return 2
+
+    print(f"\nBatch summary: {json.dumps(summary)}")
+    if summary['failed_chunks'] or summary['failed_names']:
+        return 1
+    return 0
+
 # Example usage
 if __name__ == "__main__":
+    # Unattended runs: python v50.py --batch --names-file ... (or --batch --config batch.json);
+    # any other arguments are checked by load_batch_config, which refuses to run without --batch
+    if len(sys.argv) > 1:
+        sys.exit(run_batch(load_batch_config()))
+
     # CONFIGURATION - Easy to modify
     NAMES_FILE = r"C:\Users\MarkCooper-NCG\OneDrive - National Care Group\Documents\camascope\Camascope Query\full_checkbox_list_checkbox_ID.csv"
     TARGET_URL = "https://emar.vcaresystems.co.uk/#/app/reports/mar"
@@ -1765,41 +5403,30 @@ if __name__ == "__main__":
     # Define the download directory here
     DOWNLOAD_DIRECTORY = r"C:\temp\camascope\outputs"
 
-    # --- NEW: DIRECTORY CHECK AND CLEANUP LOGIC ---
-    print(f"\nChecking and cleaning output directory: '{DOWNLOAD_DIRECTORY}'")
-    
-    # Check if the directory exists, if not, create it
-    if not os.path.exists(DOWNLOAD_DIRECTORY):
-        os.makedirs(DOWNLOAD_DIRECTORY)
-        print("Directory did not exist, so it was created.")
-    else:
-        # If the directory exists, clean it out
-        print("Directory exists. Cleaning out old files...")
-        for item in os.listdir(DOWNLOAD_DIRECTORY):
-            item_path = os.path.join(DOWNLOAD_DIRECTORY, item)
-            # Do NOT remove the 'Merged_Reports' folder
-            if item == "Merged_Reports":
-                print(f"  Skipping '{item_path}' as requested.")
-                continue
+    # Log network traffic so menu option 7 can replay the report API request
+    CAPTURE_NETWORK = False
 
-            try:
-                if os.path.isfile(item_path):
-                    os.remove(item_path)
-                    print(f"  Deleted file: {item}")
-                elif os.path.isdir(item_path):
-                    shutil.rmtree(item_path)
-                    print(f"  Deleted directory: {item}")
-            except OSError as e:
-                print(f"  Error deleting {item_path}: {e}")
-        print("Directory cleanup complete.")
-    # --- END OF NEW LOGIC ---
+    # Also write the consolidated report as Parquet (partitioned by Region and month) and/or Arrow IPC - needs pyarrow
+    WRITE_PARQUET = False
+    WRITE_ARROW = False
+
+    # Upsert every consolidated report into this SQLite database (None to skip)
+    MAR_DATABASE = None
+    # Report columns for upsert key parts the database cannot find by name, e.g. {'resident': 'Client'}
+    MAR_DATABASE_KEY = None
+
+    clean_download_directory(DOWNLOAD_DIRECTORY)
 
     # Initialize the automator and pass the download directory
-    automator = FixedDropdownAutomator(download_path=DOWNLOAD_DIRECTORY)
+    automator = FixedDropdownAutomator(download_path=DOWNLOAD_DIRECTORY, capture_network=CAPTURE_NETWORK)
+    automator.parquet_output = WRITE_PARQUET
+    automator.arrow_output = WRITE_ARROW
+    automator.database_file = MAR_DATABASE
+    automator.database_key_columns = MAR_DATABASE_KEY
 
     try:
-        # Perform the automated login and navigation
-        automator.automated_login(TARGET_URL)
+        # Reuse the saved session if it is still valid, otherwise perform the automated login
+        automator.start_session(TARGET_URL)
 
         # Run the automation using enhanced selection method with automation options
         automator.select_multiple_items_from_current_page(NAMES_FILE, "Location Name")
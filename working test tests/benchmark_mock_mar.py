@@ -0,0 +1,246 @@
+"""
+End-to-end benchmark of FixedDropdownAutomator against the local mock MAR report server.
+
+Measures:
+  - login time (fresh login, then the saved-session restore)
+  - selections per second, batch script vs one-by-one clicks, and clear time
+  - per-chunk latency (selection, report generation, total) over a full automated run
+  - end-to-end run time including download wait and consolidation
+    (or, with --mode api, the report API replay that skips the report UI)
+
+Usage:
+    python "working test tests/benchmark_mock_mar.py" --locations 200 --chunk-size 25
+    python "working test tests/benchmark_mock_mar.py" --report-latency 3 --menu-latency-ms 150 --json-out run.json
+
+Needs Chrome and chromedriver; runs headless unless --headed is given.
+Everything (downloads, progress and session files) goes into a temporary directory.
+"""
+import argparse
+import importlib.util
+import json
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import time
+
+# Load v50.py from the repository root and the mock server from this folder
+TESTS_DIR = os.path.dirname(os.path.abspath(__file__))
+REPO_DIR = os.path.dirname(TESTS_DIR)
+spec = importlib.util.spec_from_file_location("v50", os.path.join(REPO_DIR, "v50.py"))
+v50 = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(v50)
+sys.path.insert(0, TESTS_DIR)
+from mock_mar_server import MockMarServer
+
+def timed_method(automator, method_name, bucket):
+    """Replace automator.<method_name> with a wrapper that appends each call's duration to bucket"""
+    original = getattr(automator, method_name)
+
+    def wrapper(*args, **kwargs):
+        start = time.perf_counter()
+        try:
+            return original(*args, **kwargs)
+        finally:
+            bucket.append(time.perf_counter() - start)
+
+    setattr(automator, method_name, wrapper)
+
+def summarize(durations):
+    if not durations:
+        return {'count': 0}
+    ordered = sorted(durations)
+    return {
+        'count': len(ordered),
+        'total': round(sum(ordered), 3),
+        'mean': round(statistics.mean(ordered), 3),
+        'median': round(statistics.median(ordered), 3),
+        'p90': round(ordered[min(len(ordered) - 1, int(len(ordered) * 0.9))], 3),
+        'max': round(ordered[-1], 3)
+    }
+
+def print_summary(label, summary):
+    if not summary['count']:
+        print(f"  {label:<28} (no samples)")
+        return
+    print(f"  {label:<28} n={summary['count']:<4} mean {summary['mean']:7.2f}s  median {summary['median']:7.2f}s  "
+          f"p90 {summary['p90']:7.2f}s  max {summary['max']:7.2f}s")
+
+def bench_login(server, workdir, args):
+    """Time a full login, then a second browser restoring the saved session"""
+    results = {}
+    for label in ("fresh_login", "session_restore"):
+        automator = v50.FixedDropdownAutomator(download_path=os.path.join(workdir, "outputs"), interactive=False,
+                                               headless=not args.headed, session_file=os.path.join(workdir, "session.json"))
+        try:
+            start = time.perf_counter()
+            automator.start_session(server.target_url, args.from_date, args.to_date)
+            results[label] = round(time.perf_counter() - start, 3)
+        finally:
+            automator.close()
+    return results
+
+def bench_selections(automator, names, rounds):
+    """Selections per second for the batch script and for one-by-one clicks, plus clear time"""
+    results = {}
+    for mode in ("batch", "one_by_one"):
+        select_times = []
+        clear_times = []
+        for _ in range(rounds):
+            start = time.perf_counter()
+            if mode == "batch":
+                outcome = automator.select_names_in_batch(names)
+            else:
+                outcome = {name: automator.click_dropdown_and_select(name) for name in names}
+            select_times.append(time.perf_counter() - start)
+
+            selected = sum(1 for ok in outcome.values() if ok)
+            state = automator.get_selection_state() or {}
+            if selected != len(names) or len(state.get('selected', [])) != len(names):
+                print(f"WARNING: {mode} selected {selected}/{len(names)}, page shows {len(state.get('selected', []))}")
+
+            start = time.perf_counter()
+            automator.clear_all_selections()
+            clear_times.append(time.perf_counter() - start)
+
+        results[mode] = {
+            'selections_per_second': round(len(names) * rounds / sum(select_times), 2),
+            'select': summarize(select_times),
+            'clear': summarize(clear_times)
+        }
+    return results
+
+def bench_end_to_end(automator, server, names_file, output_dir, chunk_size, mode="ui", shard=None):
+    """Run a full non-interactive chunked session and time every chunk"""
+    if mode == "api":
+        timings = {'capture': [], 'request': []}
+        timed_method(automator, 'capture_report_request', timings['capture'])
+        timed_method(automator, 'replay_report_request', timings['request'])
+        run = automator.process_in_chunks_with_api_replay
+    else:
+        timings = {'chunk': [], 'selection': [], 'report': [], 'clear': []}
+        timed_method(automator, 'process_chunk_with_auto_report', timings['chunk'])
+        timed_method(automator, 'select_names_in_batch', timings['selection'])
+        timed_method(automator, 'generate_report_for_current_selections', timings['report'])
+        timed_method(automator, 'clear_all_selections', timings['clear'])
+        run = automator.process_in_chunks_with_auto_reports
+
+    stats_before = server.snapshot_stats()
+    start = time.perf_counter()
+    summary = run(names_file, "Location Name", output_dir, chunk_size=chunk_size, resume_policy="restart", shard=shard)
+    elapsed = time.perf_counter() - start
+    stats_after = server.snapshot_stats()
+
+    return {
+        'seconds': round(elapsed, 3),
+        'summary': summary,
+        'server_reports': stats_after['reports'] - stats_before['reports'],
+        'server_rows': stats_after['rows_served'] - stats_before['rows_served'],
+        'server_report_seconds': round(stats_after['report_seconds'] - stats_before['report_seconds'], 3),
+        'timings': {key: summarize(values) for key, values in timings.items()}
+    }
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Benchmark the MAR automator against the local mock server")
+    parser.add_argument("--locations", type=int, default=200)
+    parser.add_argument("--chunk-size", type=int, default=25)
+    parser.add_argument("--sample", type=int, default=20, help="Names per selection benchmark round")
+    parser.add_argument("--rounds", type=int, default=2, help="Selection benchmark rounds per mode")
+    parser.add_argument("--from-date", default="01/09/2024")
+    parser.add_argument("--to-date", default="30/09/2024")
+    parser.add_argument("--report-latency", type=float, default=0.5)
+    parser.add_argument("--latency-per-location", type=float, default=0.01)
+    parser.add_argument("--menu-latency-ms", type=int, default=0)
+    parser.add_argument("--select-latency-ms", type=int, default=0)
+    parser.add_argument("--virtualize", type=int, default=0)
+    parser.add_argument("--no-batch", action="store_true", help="Run the end-to-end pass with one-by-one selection")
+    parser.add_argument("--mode", choices=["ui", "api"], default="ui", help="End-to-end through the report UI or the report API")
+    parser.add_argument("--shard", help="Split the date range into 'week', 'month' or N-day shards")
+    parser.add_argument("--skip-login", action="store_true")
+    parser.add_argument("--skip-selection", action="store_true")
+    parser.add_argument("--skip-e2e", action="store_true")
+    parser.add_argument("--headed", action="store_true")
+    parser.add_argument("--keep", action="store_true", help="Keep the temporary directory")
+    parser.add_argument("--json-out", help="Write the results to this JSON file for comparing runs")
+    return parser.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    json_out = os.path.abspath(args.json_out) if args.json_out else None
+    server = MockMarServer({
+        'locations': args.locations,
+        'report_latency': args.report_latency,
+        'latency_per_location': args.latency_per_location,
+        'menu_latency_ms': args.menu_latency_ms,
+        'select_latency_ms': args.select_latency_ms,
+        'virtualize': args.virtualize
+    }).start()
+    print(f"Mock server: {server.target_url} ({len(server.locations)} locations)")
+
+    # The automator reads credentials, progress and session files from the working directory
+    original_cwd = os.getcwd()
+    workdir = tempfile.mkdtemp(prefix="mar_benchmark_")
+    os.chdir(workdir)
+    with open("camascope login.txt", "w") as f:
+        f.write("benchmark@example.com\nbenchmark\n")
+    names_file = server.write_names_file(os.path.join(workdir, "names.csv"))
+    v50.NAMES_FILE = names_file
+    output_dir = os.path.join(workdir, "outputs")
+    os.makedirs(output_dir)
+
+    results = {'config': vars(args), 'started_at': time.strftime("%Y-%m-%d %H:%M:%S")}
+    automator = None
+    try:
+        if not args.skip_login:
+            results['login'] = bench_login(server, workdir, args)
+
+        automator = v50.FixedDropdownAutomator(download_path=output_dir, interactive=False, headless=not args.headed,
+                                               batch_selection=not args.no_batch, capture_network=args.mode == "api",
+                                               session_file=os.path.join(workdir, "session.json"))
+        automator.start_session(server.target_url, args.from_date, args.to_date)
+
+        if not args.skip_selection:
+            sample = [name for name, _ in server.locations[:args.sample]]
+            results['selection'] = bench_selections(automator, sample, args.rounds)
+
+        if not args.skip_e2e:
+            results['end_to_end'] = bench_end_to_end(automator, server, names_file, output_dir, args.chunk_size, args.mode,
+                                                      args.shard)
+
+    finally:
+        if automator:
+            automator.close()
+        server.stop()
+        os.chdir(original_cwd)
+        if args.keep:
+            print(f"Kept working directory: {workdir}")
+        else:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\n{'='*70}")
+    print("MOCK MAR BENCHMARK RESULTS")
+    print(f"{'='*70}")
+    if 'login' in results:
+        print(f"Login: fresh {results['login']['fresh_login']:.2f}s, saved session {results['login']['session_restore']:.2f}s")
+    for mode, selection in results.get('selection', {}).items():
+        print(f"\nSelection ({mode}): {selection['selections_per_second']:.2f} selections/s")
+        print_summary(f"select {args.sample} names", selection['select'])
+        print_summary("clear", selection['clear'])
+    if 'end_to_end' in results:
+        e2e = results['end_to_end']
+        print(f"\nEnd-to-end ({args.mode}): {e2e['seconds']:.1f}s for {args.locations} locations in chunks of {args.chunk_size}")
+        print(f"  Server: {e2e['server_reports']} reports, {e2e['server_rows']} rows, {e2e['server_report_seconds']:.1f}s server-side latency")
+        for key, summary in e2e['timings'].items():
+            print_summary(f"per-{key}", summary)
+        if e2e['summary']:
+            print(f"  Merged file: {e2e['summary']['merged_file']}")
+
+    if json_out:
+        with open(json_out, "w") as f:
+            json.dump(results, f, indent=2, default=str)
+        print(f"\nResults written to {json_out}")
+    return results
+
+if __name__ == "__main__":
+    main()
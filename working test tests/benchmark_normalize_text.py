@@ -0,0 +1,107 @@
+import importlib.util
+import os
+import random
+import sys
+import time
+
+import pandas as pd
+
+# Load v50.py from the repository root
+REPO_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+spec = importlib.util.spec_from_file_location("v50", os.path.join(REPO_DIR, "v50.py"))
+v50 = importlib.util.module_from_spec(spec)
+spec.loader.exec_module(v50)
+
+def legacy_normalize_text(text):
+    """
+    The original dict-loop normalizer, frozen here as the reference implementation.
+    The table is copied verbatim from the old method body (including the indentation that
+    ends up inside the quotation mark values) so that any drift in v50.TEXT_REPLACEMENTS shows up.
+    """
+    if not text:
+        return text
+
+    # Common character replacements for HTML entities and encoding issues
+    replacements = {
+        'ÃƒÂ¢Ã¢â€šÂ¬"': '—', # em dash
+        'ÃƒÂ¢Ã¢â€šÂ¬"': '—', # em dash (alternative encoding)
+        'ÃƒÂ¢Ã¢â€šÂ¬Ã‹Å"': ''', # left single quotation mark
+            'ÃƒÂ¢Ã¢â€šÂ¬Ã¢â€žÂ¢': ''', # right single quotation mark
+        'ÃƒÂ¢Ã¢â€šÂ¬Ã…"': '"', # left double quotation mark
+        'ÃƒÂ¢Ã¢â€šÂ¬': '"', # right double quotation mark
+        'ÃƒÂ¢Ã¢â€šÂ¬Ã‚Â¦': '…', # horizontal ellipsis
+        '&amp;': '&', # ampersand
+        '&lt;': '<', # less than
+        '&gt;': '>', # greater than
+        '&quot;': '"', # quotation mark
+        '&#39;': "'", # apostrophe
+    }
+
+    normalized = text
+    for old, new in replacements.items():
+        normalized = normalized.replace(old, new)
+
+    return normalized.strip()
+
+def random_text(rng, fragments):
+    """Build a string out of replacement keys, pieces of keys and plain text"""
+    pieces = []
+    for _ in range(rng.randint(0, 8)):
+        choice = rng.random()
+        if choice < 0.4:
+            pieces.append(rng.choice(fragments))
+        elif choice < 0.7:
+            fragment = rng.choice(fragments)
+            start = rng.randint(0, len(fragment))
+            pieces.append(fragment[start:rng.randint(start, len(fragment))])
+        else:
+            pieces.append(rng.choice([" ", "a", "&", ";", "amp", "lt", "'", '"', "House", " - "]))
+    return "".join(pieces)
+
+def check_exactness(samples=200000, seed=1):
+    """Compare the precompiled normalizer with the legacy loop on random and real inputs"""
+    rng = random.Random(seed)
+    fragments = list(v50.TEXT_REPLACEMENTS) + list(v50.TEXT_REPLACEMENTS.values())
+    master = pd.read_csv(os.path.join(REPO_DIR, "full_checkbox_list_checkbox_ID.csv"), encoding="utf-8-sig")
+    inputs = [str(name) for name in master["Location Name"]]
+    inputs += [random_text(rng, fragments) for _ in range(samples)]
+
+    mismatches = [text for text in inputs if v50.normalize_text.__wrapped__(text) != legacy_normalize_text(text)]
+    series_result = v50.normalize_text_series(pd.Series(inputs)).tolist()
+    series_mismatches = [text for text, result in zip(inputs, series_result) if result != legacy_normalize_text(text)]
+
+    print(f"Exactness: {len(inputs)} inputs, {len(mismatches)} single-value mismatches, {len(series_mismatches)} series mismatches")
+    for text in (mismatches + series_mismatches)[:5]:
+        print(f"  Mismatch: {text!r}")
+    return not mismatches and not series_mismatches
+
+def time_call(label, func, repeat=3):
+    best = min(_timed(func) for _ in range(repeat))
+    print(f"  {label:<40} {best * 1000:9.1f} ms")
+    return best
+
+def _timed(func):
+    start = time.perf_counter()
+    func()
+    return time.perf_counter() - start
+
+def run_benchmark(rows=1000000):
+    """Time the per-row normalization that consolidation used to do on a MAR-sized column"""
+    master = pd.read_csv(os.path.join(REPO_DIR, "full_checkbox_list_checkbox_ID.csv"), encoding="utf-8-sig")
+    names = [str(name) for name in master["Location Name"]] + ["Oak &amp; Ash House", "ENDK &#39;Seabrook&#39;"]
+    care_services = pd.Series(random.Random(2).choices(names, k=rows))
+
+    print(f"\nNormalizing {rows} Care Service values ({care_services.nunique()} distinct):")
+    legacy = time_call("legacy dict loop (per row)", lambda: [legacy_normalize_text(text) for text in care_services])
+    uncached = time_call("single regex pass (per row, no cache)", lambda: [
+        v50.normalize_text.__wrapped__(text) for text in care_services])
+    cached = time_call("single regex pass + LRU cache (per row)", lambda: [v50.normalize_text(text) for text in care_services])
+    series = time_call("normalize_text_series (whole column)", lambda: v50.normalize_text_series(care_services))
+
+    print(f"\nSpeedup vs legacy: regex {legacy / uncached:.1f}x, cached {legacy / cached:.1f}x, series {legacy / series:.1f}x")
+
+if __name__ == "__main__":
+    rows = int(sys.argv[1]) if len(sys.argv) > 1 else 1000000
+    if not check_exactness():
+        sys.exit(1)
+    run_benchmark(rows)
@@ -0,0 +1,692 @@
+"""
+Local stand-in for the Camascope MAR report page, so the automator can be run and
+benchmarked without the live site.
+
+It reproduces the parts of the app that v50.py drives:
+  - the 3-step login ('Another User', #signInName/#continue, #password/#continue),
+    a dashboard pop-up that Escape dismisses and the Reports > MAR Report menu
+  - the Start Date / End Date inputs
+  - the react-select multi-select: 'Select...' placeholder, badges with a x remover,
+    the 'All units' badge, the menu with 'Select All' and div.option > span.me-2 labels,
+    the search input and (optionally) a virtualized option list
+  - 'Generate Report', the 'Proceed Anyway' modal, the ag-grid loading overlay,
+    the 'No Records!' state and the <a download> CSV link
+  - the JSON report endpoint the page calls (POST /api/reports/mar)
+
+Usage:
+    python "working test tests/mock_mar_server.py" --port 8765 --locations 300 --report-latency 2
+    then set TARGET_URL to http://127.0.0.1:8765/#/app/reports/mar
+"""
+import argparse
+import json
+import random
+import secrets
+import threading
+import time
+import zlib
+from datetime import datetime, timedelta
+from http.cookies import SimpleCookie
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse
+
+import pandas as pd
+
+MOCK_DEFAULTS = {
+    'locations': 200,                # number of generated location names (ignored with names_file)
+    'regions': 4,                    # number of generated regions
+    'names_file': None,              # CSV with 'Location Name' (and optionally 'Region') to use instead
+    'tricky_names': False,           # add names with quotes/ampersands like the real estate has
+    'rows_per_location_day': 2.0,    # average MAR rows per location per day of date range
+    'max_rows_per_location': 5000,
+    'empty_ratio': 0.1,              # share of locations that never have records
+    'report_latency': 0.5,           # seconds, fixed cost of every report request
+    'latency_per_location': 0.01,    # seconds per selected location
+    'latency_per_1k_rows': 0.05,     # seconds per 1000 rows returned
+    'menu_latency_ms': 0,            # delay before the options render after opening the menu
+    'select_latency_ms': 0,          # delay before a click on an option updates the badges
+    'close_on_select': True,         # react-select closes the menu after each pick
+    'virtualize': 0,                 # render only this many options at a time (0 = all)
+    'proceed_threshold': 25,         # selections above this show the 'Proceed Anyway' modal
+    'session_ttl': 0                 # seconds a login stays valid (0 = until the server stops)
+}
+
+MAR_COLUMNS = ["Care Service", "Resident", "Medication", "Dose", "Scheduled Date", "Scheduled Time", "Outcome", "Recorded By"]
+MEDICATIONS = ["Paracetamol 500mg", "Amlodipine 5mg", "Metformin 500mg", "Sertraline 50mg", "Omeprazole 20mg", "Ramipril 2.5mg"]
+OUTCOMES = ["Given", "Given", "Given", "Refused", "Not Given", "Self Administered"]
+TRICKY_NAMES = ["Oak & Ash House", "St. Mary's Lodge", "The \"Willows\"", "Brook - View (Annexe)"]
+
+def build_locations(config):
+    """Return the [(name, region)] list the dropdown offers"""
+    if config['names_file']:
+        df = pd.read_csv(config['names_file'], encoding='utf-8-sig')
+        regions = df['Region'] if 'Region' in df.columns else ['Mock Region'] * len(df)
+        locations = [(str(name).strip(), str(region)) for name, region in zip(df['Location Name'], regions) if pd.notna(name)]
+    else:
+        locations = [(f"Mock Care Home {i:04d}", f"Mock Region {i % config['regions'] + 1}") for i in range(1, config['locations'] + 1)]
+        if config['tricky_names']:
+            locations += [(name, "Mock Region 1") for name in TRICKY_NAMES]
+
+    # The dropdown lists each label once
+    seen = set()
+    return [(name, region) for name, region in locations if not (name in seen or seen.add(name))]
+
+def parse_report_date(value, default):
+    try:
+        return datetime.strptime(value, "%d/%m/%Y")
+    except (TypeError, ValueError):
+        return default
+
+def generate_report_rows(locations, from_date, to_date, config):
+    """Deterministic MAR rows for the requested locations and DD/MM/YYYY date range"""
+    end = parse_report_date(to_date, datetime.now())
+    start = parse_report_date(from_date, end - timedelta(days=29))
+    days = max(1, (end - start).days + 1)
+
+    rows = []
+    for name in locations:
+        rng = random.Random(zlib.crc32(name.encode('utf-8')))
+        if rng.random() < config['empty_ratio']:
+            continue
+        count = int(config['rows_per_location_day'] * days * rng.uniform(0.5, 1.5))
+        count = min(count, config['max_rows_per_location'])
+        residents = [f"Resident {rng.randint(1000, 9999)}" for _ in range(rng.randint(3, 12))]
+        for _ in range(count):
+            day = start + timedelta(days=rng.randrange(days))
+            rows.append([
+                name,
+                rng.choice(residents),
+                rng.choice(MEDICATIONS),
+                f"{rng.choice([1, 1, 2])} tablet(s)",
+                day.strftime("%d/%m/%Y"),
+                rng.choice(["08:00", "12:00", "17:00", "22:00"]),
+                rng.choice(OUTCOMES),
+                f"Carer {rng.randint(1, 40)}"
+            ])
+    return rows
+
+LOGIN_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Sign in - Mock Camascope</title>
+<style>
+body { font-family: sans-serif; margin: 40px; }
+.otherUserDetailsBox { display: inline-block; padding: 16px 24px; border: 1px solid #888; cursor: pointer; }
+input { display: block; margin: 8px 0; padding: 6px; width: 260px; }
+</style>
+</head>
+<body>
+<h1>Mock Camascope</h1>
+<div id="login"></div>
+<script>
+var login = document.getElementById('login');
+var username = '';
+
+function step1() {
+    login.innerHTML = '<div class="otherUserDetailsBox">Another User</div>';
+    login.firstChild.addEventListener('click', step2);
+}
+function step2() {
+    login.innerHTML = '<input id="signInName" type="text" placeholder="Email Address"><button id="continue" type="button">Sign in</button>';
+    document.getElementById('continue').addEventListener('click', function () {
+        username = document.getElementById('signInName').value;
+        step3();
+    });
+}
+function step3() {
+    login.innerHTML = '<input id="password" type="password" placeholder="Password"><button id="continue" type="button">Sign in</button>';
+    document.getElementById('continue').addEventListener('click', function () {
+        fetch('/login', {
+            method: 'POST',
+            headers: {'Content-Type': 'application/json'},
+            body: JSON.stringify({username: username, password: document.getElementById('password').value})
+        }).then(function (response) {
+            if (!response.ok) { login.innerHTML = 'Sign in failed'; return; }
+            window.location.hash = '#/app/dashboard';
+            window.location.reload();
+        });
+    });
+}
+step1();
+</script>
+</body>
+</html>
+"""
+
+APP_HTML = """<!DOCTYPE html>
+<html>
+<head><meta charset="utf-8"><title>Mock Camascope</title>
+<style>
+body { font-family: sans-serif; margin: 0; }
+nav { background: #234; padding: 10px; }
+nav a { color: #fff; margin-right: 16px; }
+#reports-submenu { display: none; margin-top: 6px; }
+#page { padding: 20px; }
+.modal { position: fixed; top: 0; left: 0; right: 0; bottom: 0; background: rgba(0, 0, 0, 0.4); display: none; }
+.modal.show { display: block; }
+.modal-dialog { background: #fff; width: 420px; margin: 120px auto; padding: 20px; }
+.mock-select { position: relative; width: 600px; margin: 12px 0; }
+.css-yk16xz-control, .css-1pahdxg-control { display: flex; flex-wrap: wrap; min-height: 38px; border: 1px solid #ccc; padding: 2px 6px; cursor: default; }
+.css-1pahdxg-control { border-color: #2684ff; }
+.badge { display: inline-block; margin: 2px; padding: 2px 6px; border: 1px solid #0d6efd; color: #0d6efd; }
+.badge-remove { margin-left: 6px; cursor: pointer; }
+.css-1wa3eu0-placeholder { color: #888; padding: 6px 2px; }
+.select-input { border: 0; outline: 0; min-width: 40px; flex: 1; }
+.css-26l3qy-menu { position: absolute; left: 0; right: 0; background: #fff; border: 1px solid #ccc; z-index: 10; }
+.css-11unzgr { max-height: 300px; overflow-y: auto; position: relative; }
+.css-yt9ioa-option { height: 36px; line-height: 36px; padding: 0 8px; box-sizing: border-box; cursor: pointer; }
+.css-yt9ioa-option.is-selected { background: #deebff; }
+.ag-root-wrapper { position: relative; border: 1px solid #ccc; min-height: 120px; margin-top: 12px; }
+.ag-overlay-loading-wrapper { position: absolute; top: 0; left: 0; right: 0; bottom: 0; background: rgba(255, 255, 255, 0.8); }
+.ag-center-cols-viewport { max-height: 300px; overflow: auto; font-size: 12px; }
+</style>
+</head>
+<body>
+<nav>
+    <a href="#/app/dashboard">Dashboard</a>
+    <a href="#/app/reports" id="nav-reports">Reports</a>
+    <div id="reports-submenu"><a href="#/app/reports/mar">MAR Report</a></div>
+</nav>
+<div id="page"></div>
+<script>
+var CONFIG = __CONFIG__;
+var LOCATIONS = CONFIG.locations;
+var OPTION_HEIGHT = 36;
+
+function el(tag, className, text) {
+    var node = document.createElement(tag);
+    if (className) { node.className = className; }
+    if (text !== undefined) { node.textContent = text; }
+    return node;
+}
+function later(ms, callback) {
+    if (ms > 0) { setTimeout(callback, ms); } else { callback(); }
+}
+
+document.getElementById('nav-reports').addEventListener('click', function (event) {
+    event.preventDefault();
+    document.getElementById('reports-submenu').style.display = 'block';
+});
+
+// ---------- dashboard ----------
+
+function renderDashboard(page) {
+    page.innerHTML = '<h2>Dashboard</h2>';
+    var popup = el('div', 'modal show dashboard-popup');
+    var dialog = el('div', 'modal-dialog', "What's new in Camascope - press Escape to close");
+    popup.appendChild(dialog);
+    document.body.appendChild(popup);
+}
+document.addEventListener('keydown', function (event) {
+    if (event.key !== 'Escape') { return; }
+    var popups = document.querySelectorAll('.dashboard-popup');
+    for (var i = 0; i < popups.length; i++) { popups[i].parentNode.removeChild(popups[i]); }
+});
+
+// ---------- multi-select ----------
+
+var select = {selected: {}, count: 0, menuOpen: false, filter: '', scrollTop: 0};
+
+function isSelected(name) { return select.selected.hasOwnProperty(name); }
+function allSelected() { return select.count === LOCATIONS.length && LOCATIONS.length > 0; }
+function setSelected(name, on) {
+    if (on && !isSelected(name)) { select.selected[name] = true; select.count++; }
+    if (!on && isSelected(name)) { delete select.selected[name]; select.count--; }
+}
+function selectedNames() {
+    return LOCATIONS.filter(function (name) { return isSelected(name); });
+}
+
+function renderSelect(page) {
+    var wrapper = el('div', 'mock-select');
+    var control = el('div', 'css-yk16xz-control');
+    var values = el('div', 'css-1hwfws3');
+    var input = el('input', 'select-input');
+    input.id = 'react-select-2-input';
+    input.type = 'text';
+    input.autocomplete = 'off';
+    control.appendChild(values);
+    wrapper.appendChild(control);
+    page.appendChild(wrapper);
+    select.wrapper = wrapper;
+    select.control = control;
+    select.values = values;
+    select.input = input;
+    select.menu = null;
+
+    control.addEventListener('mousedown', function (event) {
+        if (event.target.classList.contains('badge-remove')) {
+            event.preventDefault();
+            var label = event.target.previousSibling.textContent;
+            if (label === 'All units') { select.selected = {}; select.count = 0; } else { setSelected(label, false); }
+            renderValues();
+            return;
+        }
+        if (event.target === input) { if (!select.menuOpen) { openMenu(); } return; }
+        event.preventDefault();
+        if (select.menuOpen) { closeMenu(); } else { openMenu(); }
+        input.focus();
+    });
+    input.addEventListener('input', function () {
+        select.filter = input.value;
+        select.scrollTop = 0;
+        if (!select.menuOpen) { openMenu(); } else { renderMenu(); }
+    });
+    document.addEventListener('mousedown', function (event) {
+        if (select.menuOpen && !wrapper.contains(event.target)) { closeMenu(); }
+    });
+    input.addEventListener('keydown', function (event) {
+        if (event.key === 'Escape') { closeMenu(); }
+    });
+    renderValues();
+}
+
+function renderValues() {
+    var values = select.values;
+    values.innerHTML = '';
+    var labels = allSelected() ? ['All units'] : selectedNames();
+    if (labels.length === 0 && !select.input.value) {
+        values.appendChild(el('div', 'css-1wa3eu0-placeholder', 'Select...'));
+    }
+    labels.forEach(function (label) {
+        var badge = el('div', 'badge border border-primary text-primary me-1');
+        badge.appendChild(el('span', null, label));
+        badge.appendChild(el('span', 'badge-remove', '\\u00d7'));
+        values.appendChild(badge);
+    });
+    values.appendChild(select.input);
+}
+
+function openMenu() {
+    select.menuOpen = true;
+    select.control.className = 'css-1pahdxg-control';
+    later(CONFIG.menu_latency_ms, function () { if (select.menuOpen) { renderMenu(); } });
+}
+
+function closeMenu() {
+    select.menuOpen = false;
+    select.control.className = 'css-yk16xz-control';
+    if (select.menu) { select.menu.parentNode.removeChild(select.menu); select.menu = null; }
+}
+
+function filteredOptions() {
+    var filter = select.filter.toLowerCase();
+    var names = filter ? LOCATIONS.filter(function (name) { return name.toLowerCase().indexOf(filter) !== -1; }) : LOCATIONS.slice();
+    if (!filter) { names.unshift('Select All'); }
+    return names;
+}
+
+function optionElement(name) {
+    var option = el('div', 'css-yt9ioa-option' + (isSelected(name) || (name === 'Select All' && allSelected()) ? ' is-selected' : ''));
+    var checkbox = el('input');
+    checkbox.type = 'checkbox';
+    checkbox.tabIndex = -1;
+    checkbox.checked = name === 'Select All' ? allSelected() : isSelected(name);
+    option.appendChild(checkbox);
+    option.appendChild(el('span', 'me-2', name));
+    option.addEventListener('click', function () { pickOption(name); });
+    return option;
+}
+
+function renderMenu() {
+    if (!select.menu) {
+        select.menu = el('div', 'css-26l3qy-menu');
+        select.list = el('div', 'css-11unzgr');
+        select.menu.appendChild(select.list);
+        select.wrapper.appendChild(select.menu);
+        select.list.addEventListener('scroll', function () {
+            select.scrollTop = select.list.scrollTop;
+            if (CONFIG.virtualize) { renderMenu(); }
+        });
+    }
+    var names = filteredOptions();
+    var list = select.list;
+    list.innerHTML = '';
+    if (names.length === 0) {
+        list.appendChild(el('div', 'css-1gl4k7y-NoOptionsMessage', 'No options'));
+        return;
+    }
+    var start = 0;
+    var end = names.length;
+    if (CONFIG.virtualize && names.length > CONFIG.virtualize) {
+        start = Math.min(Math.floor(select.scrollTop / OPTION_HEIGHT), names.length - CONFIG.virtualize);
+        end = start + CONFIG.virtualize;
+    }
+    var top = el('div', 'virtual-spacer');
+    top.style.height = (start * OPTION_HEIGHT) + 'px';
+    list.appendChild(top);
+    for (var i = start; i < end; i++) { list.appendChild(optionElement(names[i])); }
+    var bottom = el('div', 'virtual-spacer');
+    bottom.style.height = ((names.length - end) * OPTION_HEIGHT) + 'px';
+    list.appendChild(bottom);
+    list.scrollTop = select.scrollTop;
+}
+
+function pickOption(name) {
+    later(CONFIG.select_latency_ms, function () {
+        if (name === 'Select All') {
+            var selectAll = !allSelected();
+            select.selected = {};
+            select.count = 0;
+            if (selectAll) { LOCATIONS.forEach(function (location) { setSelected(location, true); }); }
+        } else {
+            setSelected(name, !isSelected(name));
+        }
+        select.input.value = '';
+        select.filter = '';
+        renderValues();
+        if (CONFIG.close_on_select) { closeMenu(); } else if (select.menuOpen) { renderMenu(); }
+    });
+}
+
+// ---------- report ----------
+
+function renderReportPage(page) {
+    page.innerHTML = '<h2>MAR Report</h2>';
+    var dates = el('div', 'row');
+    ['Start Date', 'End Date'].forEach(function (placeholder) {
+        var input = el('input', 'form-control');
+        input.type = 'text';
+        input.placeholder = placeholder;
+        dates.appendChild(input);
+    });
+    page.appendChild(dates);
+
+    select.selected = {};
+    select.count = 0;
+    select.menuOpen = false;
+    select.filter = '';
+    select.scrollTop = 0;
+    renderSelect(page);
+
+    var button = el('button', 'btn btn-primary', 'Generate Report');
+    button.type = 'button';
+    button.addEventListener('click', function () {
+        if (select.count === 0) { return; }
+        if (select.count > CONFIG.proceed_threshold) { showProceedModal(); } else { runReport(); }
+    });
+    page.appendChild(button);
+
+    var actions = el('div', 'report-actions');
+    actions.id = 'report-actions';
+    page.appendChild(actions);
+
+    var grid = el('div', 'ag-root-wrapper');
+    grid.id = 'report-grid';
+    grid.appendChild(el('div', 'ag-center-cols-viewport'));
+    page.appendChild(grid);
+}
+
+function showProceedModal() {
+    var modal = el('div', 'modal show');
+    modal.id = 'proceed-modal';
+    var dialog = el('div', 'modal-dialog', 'This report covers a large number of units and may take a while. ');
+    var proceed = el('button', 'btn btn-warning', 'Proceed Anyway');
+    var cancel = el('button', 'btn btn-secondary', 'Cancel');
+    proceed.type = cancel.type = 'button';
+    dialog.appendChild(proceed);
+    dialog.appendChild(cancel);
+    modal.appendChild(dialog);
+    document.body.appendChild(modal);
+    proceed.addEventListener('click', function () { modal.parentNode.removeChild(modal); runReport(); });
+    cancel.addEventListener('click', function () { modal.parentNode.removeChild(modal); });
+}
+
+function csvField(value) { return '"' + String(value).replace(/"/g, '""') + '"'; }
+
+function runReport() {
+    var grid = document.getElementById('report-grid');
+    var viewport = grid.querySelector('.ag-center-cols-viewport');
+    var actions = document.getElementById('report-actions');
+    actions.innerHTML = '';
+    viewport.innerHTML = '';
+    var overlay = el('div', 'ag-overlay-loading-wrapper');
+    overlay.appendChild(el('span', 'ag-overlay-loading-center', 'Loading...'));
+    grid.appendChild(overlay);
+
+    var body = {
+        locations: allSelected() ? LOCATIONS : selectedNames(),
+        fromDate: document.querySelector("input[placeholder='Start Date']").value,
+        toDate: document.querySelector("input[placeholder='End Date']").value
+    };
+    fetch('/api/reports/mar', {
+        method: 'POST',
+        headers: {'Content-Type': 'application/json', 'X-Requested-With': 'XMLHttpRequest'},
+        body: JSON.stringify(body)
+    }).then(function (response) {
+        return response.json();
+    }).then(function (report) {
+        grid.removeChild(overlay);
+        if (!report.rows || report.rows.length === 0) {
+            viewport.textContent = 'No Records!';
+            return;
+        }
+        var table = el('table');
+        report.rows.slice(0, 100).forEach(function (row) {
+            var tr = el('tr');
+            row.forEach(function (value) { tr.appendChild(el('td', null, value)); });
+            table.appendChild(tr);
+        });
+        viewport.appendChild(table);
+
+        var lines = [report.columns.map(csvField).join(',')];
+        report.rows.forEach(function (row) { lines.push(row.map(csvField).join(',')); });
+        var link = el('a', 'btn btn-link', 'Generate CSV');
+        link.download = 'MAR Report.csv';
+        link.href = URL.createObjectURL(new Blob([lines.join('\\r\\n')], {type: 'text/csv'}));
+        actions.appendChild(link);
+    }).catch(function (error) {
+        if (overlay.parentNode) { grid.removeChild(overlay); }
+        viewport.textContent = 'Report failed: ' + error;
+    });
+}
+
+// ---------- routing ----------
+
+function route() {
+    var page = document.getElementById('page');
+    if (window.location.hash.indexOf('#/app/reports/mar') === 0) {
+        renderReportPage(page);
+    } else if (window.location.hash.indexOf('#/app/reports') === 0) {
+        page.innerHTML = '<h2>Reports</h2>';
+    } else {
+        renderDashboard(page);
+    }
+}
+window.addEventListener('hashchange', route);
+route();
+</script>
+</body>
+</html>
+"""
+
+class MockMarHandler(BaseHTTPRequestHandler):
+    """Serves the login page, the app page and the JSON endpoints for one MockMarServer"""
+
+    def log_message(self, format, *args):
+        if self.server.mock.verbose:
+            super().log_message(format, *args)
+
+    def send_body(self, status, body, content_type="text/html; charset=utf-8", headers=None):
+        data = body.encode('utf-8') if isinstance(body, str) else body
+        self.send_response(status)
+        self.send_header("Content-Type", content_type)
+        self.send_header("Content-Length", str(len(data)))
+        self.send_header("Cache-Control", "no-store")
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(data)
+
+    def send_json(self, status, payload, headers=None):
+        self.send_body(status, json.dumps(payload), "application/json", headers)
+
+    def read_json(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        try:
+            return json.loads(self.rfile.read(length) or b"{}")
+        except ValueError:
+            return {}
+
+    def session_valid(self):
+        cookie = SimpleCookie(self.headers.get("Cookie", ""))
+        token = cookie.get("mock_session")
+        return token is not None and self.server.mock.session_valid(token.value)
+
+    def do_GET(self):
+        mock = self.server.mock
+        path = urlparse(self.path).path
+        if path in ("/", "/index.html"):
+            mock.count("page_loads")
+            if self.session_valid():
+                self.send_body(200, mock.app_html)
+            else:
+                self.send_body(200, LOGIN_HTML)
+        elif path == "/favicon.ico":
+            self.send_body(204, b"", "image/x-icon")
+        elif path == "/api/locations":
+            if not self.session_valid():
+                self.send_json(401, {'error': 'not signed in'})
+                return
+            self.send_json(200, [{'name': name, 'region': region} for name, region in mock.locations])
+        elif path == "/api/stats":
+            self.send_json(200, mock.snapshot_stats())
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+    def do_POST(self):
+        mock = self.server.mock
+        path = urlparse(self.path).path
+        if path == "/login":
+            body = self.read_json()
+            if not body.get('username') or not body.get('password'):
+                self.send_json(403, {'error': 'missing credentials'})
+                return
+            mock.count("logins")
+            token = mock.new_session()
+            self.send_json(200, {'ok': True}, {"Set-Cookie": f"mock_session={token}; Path=/; HttpOnly"})
+        elif path == "/api/reports/mar":
+            if not self.session_valid():
+                self.send_json(401, {'error': 'not signed in'})
+                return
+            body = self.read_json()
+            locations = [name for name in body.get('locations', []) if name in mock.location_set]
+            rows = generate_report_rows(locations, body.get('fromDate'), body.get('toDate'), mock.config)
+            latency = (mock.config['report_latency'] + mock.config['latency_per_location'] * len(locations)
+                       + mock.config['latency_per_1k_rows'] * len(rows) / 1000)
+            time.sleep(latency)
+            mock.record_report(len(locations), len(rows), latency)
+            self.send_json(200, {'columns': MAR_COLUMNS, 'rows': rows})
+        else:
+            self.send_json(404, {'error': 'not found'})
+
+class MockMarServer:
+    """
+    Runs the mock site on a background thread.
+    server = MockMarServer({'locations': 300}).start(); ...; server.stop()
+    """
+
+    def __init__(self, config=None, host="127.0.0.1", port=0, verbose=False):
+        self.config = dict(MOCK_DEFAULTS)
+        self.config.update(config or {})
+        self.host = host
+        self.port = port
+        self.verbose = verbose
+        self.locations = build_locations(self.config)
+        self.location_set = {name for name, _ in self.locations}
+        self.sessions = {}
+        self.lock = threading.Lock()
+        self.stats = {'page_loads': 0, 'logins': 0, 'reports': 0, 'locations_requested': 0, 'rows_served': 0, 'report_seconds': 0.0}
+
+        client_config = {key: self.config[key] for key in
+                         ('menu_latency_ms', 'select_latency_ms', 'close_on_select', 'virtualize', 'proceed_threshold')}
+        client_config['locations'] = [name for name, _ in self.locations]
+        # Escape '</' so a location name can never close the script tag
+        self.app_html = APP_HTML.replace("__CONFIG__", json.dumps(client_config).replace("</", "<\\/"))
+
+        self.httpd = None
+        self.thread = None
+
+    @property
+    def url(self):
+        return f"http://{self.host}:{self.port}"
+
+    @property
+    def target_url(self):
+        return self.url + "/#/app/reports/mar"
+
+    def start(self):
+        self.httpd = ThreadingHTTPServer((self.host, self.port), MockMarHandler)
+        self.httpd.daemon_threads = True
+        self.httpd.mock = self
+        self.port = self.httpd.server_address[1]
+        self.thread = threading.Thread(target=self.httpd.serve_forever, name="mock-mar-server", daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        if self.httpd:
+            self.httpd.shutdown()
+            self.httpd.server_close()
+            self.httpd = None
+
+    def new_session(self):
+        token = secrets.token_hex(16)
+        with self.lock:
+            self.sessions[token] = time.time()
+        return token
+
+    def session_valid(self, token):
+        with self.lock:
+            created = self.sessions.get(token)
+        if created is None:
+            return False
+        return not self.config['session_ttl'] or time.time() - created < self.config['session_ttl']
+
+    def count(self, key):
+        with self.lock:
+            self.stats[key] += 1
+
+    def record_report(self, locations, rows, latency):
+        with self.lock:
+            self.stats['reports'] += 1
+            self.stats['locations_requested'] += locations
+            self.stats['rows_served'] += rows
+            self.stats['report_seconds'] += latency
+
+    def snapshot_stats(self):
+        with self.lock:
+            return dict(self.stats)
+
+    def write_names_file(self, path):
+        """Write the dropdown's locations as a names file the automator can load"""
+        pd.DataFrame(self.locations, columns=["Location Name", "Region"]).to_csv(path, index=False, encoding='utf-8-sig')
+        return path
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Local mock of the Camascope MAR report page")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--verbose", action="store_true", help="Log every request")
+    parser.add_argument("--write-names", help="Write the mock's locations to this CSV and keep serving")
+    for key, default in MOCK_DEFAULTS.items():
+        option = "--" + key.replace("_", "-")
+        if isinstance(default, bool):
+            parser.add_argument(option, dest=key, type=lambda value: value.lower() in ("1", "true", "yes"), default=default)
+        elif default is None:
+            parser.add_argument(option, dest=key, default=default)
+        else:
+            parser.add_argument(option, dest=key, type=type(default), default=default)
+    return parser.parse_args(argv)
+
+if __name__ == "__main__":
+    args = parse_args()
+    server = MockMarServer({key: getattr(args, key) for key in MOCK_DEFAULTS}, args.host, args.port, args.verbose).start()
+    if args.write_names:
+        server.write_names_file(args.write_names)
+        print(f"Wrote {len(server.locations)} locations to {args.write_names}")
+    print(f"Mock MAR report server running - TARGET_URL = {server.target_url}")
+    print("Press Ctrl+C to stop")
+    try:
+        while True:
+            time.sleep(1)
+    except KeyboardInterrupt:
+        server.stop()